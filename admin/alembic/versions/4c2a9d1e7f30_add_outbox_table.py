@@ -0,0 +1,31 @@
+"""Add outbox table for transactional event publishing
+
+Revision ID: 4c2a9d1e7f30
+Revises: 1b014e8e83b7
+Create Date: 2026-10-18 09:12:40.118204
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# Revision identifiers, used by Alembic.
+revision = '4c2a9d1e7f30'
+down_revision = '1b014e8e83b7'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'outbox',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('routing_key', sa.String(length=100), nullable=False),
+        sa.Column('payload', sa.Text(), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+    )
+    op.create_index('ix_outbox_id', 'outbox', ['id'])
+
+
+def downgrade() -> None:
+    op.drop_index('ix_outbox_id', table_name='outbox')
+    op.drop_table('outbox')
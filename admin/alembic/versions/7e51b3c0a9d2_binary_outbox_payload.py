@@ -0,0 +1,26 @@
+"""Store encoded outbox payloads as binary with their content type
+
+Revision ID: 7e51b3c0a9d2
+Revises: 4c2a9d1e7f30
+Create Date: 2026-10-18 11:40:02.551730
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# Revision identifiers, used by Alembic.
+revision = '7e51b3c0a9d2'
+down_revision = '4c2a9d1e7f30'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Existing rows were JSON text
+    op.alter_column('outbox', 'payload', type_=sa.LargeBinary(), postgresql_using="convert_to(payload, 'UTF8')")
+    op.add_column('outbox', sa.Column('content_type', sa.String(length=50), nullable=False, server_default='application/json'))
+
+
+def downgrade() -> None:
+    op.drop_column('outbox', 'content_type')
+    op.alter_column('outbox', 'payload', type_=sa.Text(), postgresql_using="convert_from(payload, 'UTF8')")
@@ -0,0 +1,27 @@
+"""Add per-entity version counters to books and users
+
+Revision ID: 9a3f6c2d1b84
+Revises: 7e51b3c0a9d2
+Create Date: 2026-10-18 14:05:27.309116
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# Revision identifiers, used by Alembic.
+revision = '9a3f6c2d1b84'
+down_revision = '7e51b3c0a9d2'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('users', sa.Column('version', sa.Integer(), nullable=False, server_default='1'))
+    op.add_column('books', sa.Column('version', sa.Integer(), nullable=False, server_default='1'))
+    op.add_column('books', sa.Column('loan_version', sa.Integer(), nullable=False, server_default='0'))
+
+
+def downgrade() -> None:
+    op.drop_column('books', 'loan_version')
+    op.drop_column('books', 'version')
+    op.drop_column('users', 'version')
@@ -0,0 +1,30 @@
+"""Add row_counts for listing totals
+
+Revision ID: a6d1e3f8c294
+Revises: f4b9d2c7e815
+Create Date: 2026-10-18 18:40:12.083516
+
+Run `python reports.py rebuild` once after upgrading to fill it.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# Revision identifiers, used by Alembic.
+revision = 'a6d1e3f8c294'
+down_revision = 'f4b9d2c7e815'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'row_counts',
+        sa.Column('table_name', sa.String(length=50), nullable=False),
+        sa.Column('total', sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint('table_name'),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('row_counts')
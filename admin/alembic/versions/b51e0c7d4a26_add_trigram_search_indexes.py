@@ -0,0 +1,33 @@
+"""Add pg_trgm GIN indexes for book search
+
+Revision ID: b51e0c7d4a26
+Revises: 9a3f6c2d1b84
+Create Date: 2026-10-18 15:20:11.482907
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# Revision identifiers, used by Alembic.
+revision = 'b51e0c7d4a26'
+down_revision = '9a3f6c2d1b84'
+branch_labels = None
+depends_on = None
+
+FIELDS = ('title', 'publisher', 'category')
+
+
+def upgrade() -> None:
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    for field in FIELDS:
+        op.create_index(f'ix_books_{field}_trgm', 'books', [field],
+                        postgresql_using='gin', postgresql_ops={field: 'gin_trgm_ops'})
+
+
+def downgrade() -> None:
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    for field in FIELDS:
+        op.drop_index(f'ix_books_{field}_trgm', table_name='books')
@@ -0,0 +1,27 @@
+"""Add composite indexes for filtered book browsing
+
+Revision ID: d2a7f4e9c153
+Revises: b51e0c7d4a26
+Create Date: 2026-10-18 16:02:48.930174
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# Revision identifiers, used by Alembic.
+revision = 'd2a7f4e9c153'
+down_revision = 'b51e0c7d4a26'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_index('ix_books_category_publisher_available', 'books', ['category', 'publisher', 'available', 'id'])
+    op.create_index('ix_books_publisher_available', 'books', ['publisher', 'available', 'id'])
+    op.create_index('ix_books_category_available', 'books', ['category', 'available', 'id'])
+
+
+def downgrade() -> None:
+    op.drop_index('ix_books_category_available', table_name='books')
+    op.drop_index('ix_books_publisher_available', table_name='books')
+    op.drop_index('ix_books_category_publisher_available', table_name='books')
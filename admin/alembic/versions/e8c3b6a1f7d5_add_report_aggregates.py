@@ -0,0 +1,51 @@
+"""Add incrementally maintained report aggregate tables
+
+Revision ID: e8c3b6a1f7d5
+Revises: d2a7f4e9c153
+Create Date: 2026-10-18 17:11:05.264813
+
+Run `python reports.py rebuild` once after upgrading to fill them.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# Revision identifiers, used by Alembic.
+revision = 'e8c3b6a1f7d5'
+down_revision = 'd2a7f4e9c153'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'report_counters',
+        sa.Column('dimension', sa.String(length=20), nullable=False),
+        sa.Column('value', sa.String(length=255), nullable=False),
+        sa.Column('books', sa.Integer(), nullable=False),
+        sa.Column('borrowed', sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint('dimension', 'value'),
+    )
+    op.create_table(
+        'report_due_dates',
+        sa.Column('return_date', sa.Date(), nullable=False),
+        sa.Column('loans', sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint('return_date'),
+    )
+    op.create_table(
+        'report_borrowers',
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('current_loans', sa.Integer(), nullable=False),
+        sa.Column('total_loans', sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint('user_id'),
+    )
+    op.create_index(op.f('ix_report_borrowers_current_loans'), 'report_borrowers', ['current_loans'], unique=False)
+    op.create_index(op.f('ix_report_borrowers_total_loans'), 'report_borrowers', ['total_loans'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_report_borrowers_total_loans'), table_name='report_borrowers')
+    op.drop_index(op.f('ix_report_borrowers_current_loans'), table_name='report_borrowers')
+    op.drop_table('report_borrowers')
+    op.drop_table('report_due_dates')
+    op.drop_table('report_counters')
@@ -0,0 +1,25 @@
+"""Index loans by return date and track sent reminders
+
+Revision ID: f4b9d2c7e815
+Revises: e8c3b6a1f7d5
+Create Date: 2026-10-18 18:02:37.519204
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# Revision identifiers, used by Alembic.
+revision = 'f4b9d2c7e815'
+down_revision = 'e8c3b6a1f7d5'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('books', sa.Column('reminded_on', sa.Date(), nullable=True))
+    op.create_index('ix_books_return_date', 'books', ['return_date', 'id'])
+
+
+def downgrade() -> None:
+    op.drop_index('ix_books_return_date', table_name='books')
+    op.drop_column('books', 'reminded_on')
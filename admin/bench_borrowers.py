@@ -0,0 +1,92 @@
+"""Benchmark: loading borrower summaries for a page of books, three ways.
+
+    joinedload  ORM objects with joinedload(Book.user) (the old get_books)
+    join        projected columns with one LEFT JOIN to users
+    batched     projected book columns, then one IN query for the borrowed subset
+
+Uses DB_URL when set, otherwise a throwaway SQLite file (seeding 1M books
+takes a minute). Run from the admin directory:
+
+    python bench_borrowers.py --rows 1000000 --borrowed 0.1
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+
+os.environ.setdefault("DB_URL", f"sqlite:///{tempfile.mkdtemp()}/bench_borrowers.db")
+
+from sqlalchemy import insert
+from sqlalchemy.orm import joinedload
+from database import Base, SessionLocal, engine
+import crud
+import models
+
+
+def seed(rows, borrowed, users=10000):
+    Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+    try:
+        if db.query(models.Book).count() >= rows:
+            return
+        db.execute(insert(models.User), [
+            {"id": i, "email": f"user{i}@example.com", "firstname": "First", "lastname": f"Last {i}"} for i in range(1, users + 1)
+        ])
+        rng = random.Random(42)
+        for start in range(0, rows, 50000):
+            chunk = []
+            for i in range(start, min(start + 50000, rows)):
+                borrower = rng.randint(1, users) if rng.random() < borrowed else None
+                chunk.append({"title": f"Title {i}", "publisher": f"Publisher {i % 500}", "category": f"Category {i % 40}",
+                              "available": borrower is None, "borrower_id": borrower})
+            db.execute(insert(models.Book), chunk)
+        db.commit()
+    finally:
+        db.close()
+
+
+def joinedload_page(db, after, limit):
+    query = db.query(models.Book).options(joinedload(models.Book.user)).filter(models.Book.id > after)
+    return query.order_by(models.Book.id).limit(limit).all()
+
+
+def join_page(db, after, limit):
+    return crud.book_rows_with_borrower(db, models.Book.id > after, limit=limit, borrowers="join")
+
+
+def batched_page(db, after, limit):
+    return crud.book_rows_with_borrower(db, models.Book.id > after, limit=limit, borrowers="batched")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=1000000)
+    parser.add_argument("--borrowed", type=float, default=0.1, help="share of books that are borrowed")
+    parser.add_argument("--limit", type=int, default=1000)
+    parser.add_argument("--pages", type=int, default=50)
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    seed(args.rows, args.borrowed)
+    print(f"Seeded {args.rows} books in {time.perf_counter() - started:.1f}s")
+
+    rng = random.Random(7)
+    positions = [rng.randrange(0, args.rows - args.limit) for _ in range(args.pages)]
+    print(f"{'strategy':>11} {'ms/page':>9} {'us/row':>8}")
+    for name, page in [("joinedload", joinedload_page), ("join", join_page), ("batched", batched_page)]:
+        db = SessionLocal()
+        try:
+            page(db, 0, args.limit)  # warm up
+            started = time.perf_counter()
+            for after in positions:
+                page(db, after, args.limit)
+                db.expunge_all()
+            elapsed = (time.perf_counter() - started) / len(positions)
+        finally:
+            db.close()
+        print(f"{name:>11} {elapsed * 1000:>9.2f} {elapsed * 1e6 / args.limit:>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+"""Benchmark: POST /books/bulk against one POST /books/ per title.
+
+Uses DB_URL when set, otherwise a throwaway SQLite file. Run from the admin
+directory:
+
+    python bench_bulk_import.py --rows 20000
+"""
+import argparse
+import os
+import tempfile
+import time
+
+os.environ.setdefault("DB_URL", f"sqlite:///{tempfile.mkdtemp()}/bench_bulk.db")
+
+from fastapi.testclient import TestClient
+from main import app
+
+
+def ndjson(rows, offset=0):
+    for i in range(offset, offset + rows):
+        yield f'{{"title": "Title {i}", "publisher": "Publisher {i % 500}", "category": "Category {i % 40}"}}\n'.encode()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=20000)
+    parser.add_argument("--single-rows", type=int, default=1000, help="rows for the one-request-per-book path")
+    args = parser.parse_args()
+
+    # No lifespan: the async publisher stays off and events remain in the outbox
+    client = TestClient(app)
+
+    started = time.perf_counter()
+    for i in range(args.single_rows):
+        client.post("/books/", json={"title": f"Single {i}", "publisher": "Pub", "category": "Cat"})
+    single_rate = args.single_rows / (time.perf_counter() - started)
+
+    started = time.perf_counter()
+    response = client.post("/books/bulk", content=ndjson(args.rows), headers={"Content-Type": "application/x-ndjson"})
+    elapsed = time.perf_counter() - started
+    assert response.status_code == 200, response.text
+
+    print(f"{'POST /books/':>16}: {single_rate:10.1f} rows/s ({args.single_rows} rows)")
+    print(f"{'POST /books/bulk':>16}: {args.rows / elapsed:10.1f} rows/s ({args.rows} rows, "
+          f"server-reported {response.json()['rows_per_second']} rows/s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""Benchmark: OFFSET paging against keyset (cursor) paging at increasing depth.
+
+Uses DB_URL when set, otherwise a throwaway SQLite file. Run from the admin
+directory:
+
+    python bench_pagination.py --rows 200000 --limit 50
+"""
+import argparse
+import os
+import tempfile
+import time
+
+os.environ.setdefault("DB_URL", f"sqlite:///{tempfile.mkdtemp()}/bench_pagination.db")
+
+from sqlalchemy import insert
+from database import Base, SessionLocal, engine
+from pagination import encode_cursor
+import crud
+import models
+
+
+def seed(rows):
+    Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+    try:
+        if db.query(models.Book).count() >= rows:
+            return
+        for start in range(0, rows, 10000):
+            db.execute(insert(models.Book), [
+                {"title": f"Title {i}", "publisher": f"Publisher {i % 500}", "category": f"Category {i % 40}", "available": True}
+                for i in range(start, min(start + 10000, rows))
+            ])
+        db.commit()
+    finally:
+        db.close()
+
+
+def timed(fn, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - started)
+    return best * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=200000)
+    parser.add_argument("--limit", type=int, default=50)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    seed(args.rows)
+    db = SessionLocal()
+    try:
+        print(f"{'depth':>10} {'offset ms':>12} {'cursor ms':>12}")
+        depth = 0
+        while depth < args.rows:
+            # Ids start at 1, so the cursor for depth d points at id d
+            cursor = encode_cursor(depth) if depth else ""
+            offset_ms = timed(lambda: crud.get_books(db, offset=depth, limit=args.limit), args.repeat)
+            cursor_ms = timed(lambda: crud.get_books_page(db, cursor=cursor, limit=args.limit), args.repeat)
+            print(f"{depth:>10} {offset_ms:>12.2f} {cursor_ms:>12.2f}")
+            depth = depth * 10 if depth else 1000
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
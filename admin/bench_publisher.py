@@ -0,0 +1,85 @@
+"""Benchmark: connect-per-message publishing vs the pooled publisher.
+
+Needs a running RabbitMQ (RABBITMQ_HOST). Run from the admin directory:
+
+    python bench_publisher.py --messages 2000 --threads 8
+"""
+import argparse
+import json
+import statistics
+import threading
+import time
+
+from messaging.config import get_rabbitmq_connection
+from messaging.publisher import ChannelPool
+from messaging import topology
+
+QUEUE = "bench_publisher"
+ROUTING_KEY = "bench.publisher"
+
+
+def connect_per_message(message):
+    """The old producer path: one connection, declare and publish per event."""
+    connection = get_rabbitmq_connection()
+    channel = connection.channel()
+    channel.queue_declare(queue=QUEUE)
+    channel.basic_publish(exchange="", routing_key=QUEUE, body=json.dumps(message))
+    connection.close()
+
+
+def run(publish_fn, messages, threads):
+    latencies = []
+    lock = threading.Lock()
+    per_thread = messages // threads
+
+    def worker():
+        local = []
+        for i in range(per_thread):
+            start = time.perf_counter()
+            publish_fn({"book_id": i, "title": "Bench", "publisher": "Pub", "category": "Cat", "available": True})
+            local.append(time.perf_counter() - start)
+        with lock:
+            latencies.extend(local)
+
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    started = time.perf_counter()
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    p99 = latencies[int(len(latencies) * 0.99) - 1]
+    return len(latencies) / elapsed, statistics.median(latencies), p99
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--messages", type=int, default=2000)
+    parser.add_argument("--threads", type=int, default=8)
+    args = parser.parse_args()
+
+    pool = ChannelPool()
+    pooled = lambda message: pool.publish(ROUTING_KEY, json.dumps(message))
+
+    # The pooled path publishes to the event exchange; route its key to the bench queue
+    connection = get_rabbitmq_connection()
+    channel = connection.channel()
+    topology.declare_exchange(channel)
+    channel.queue_declare(queue=QUEUE)
+    channel.queue_bind(queue=QUEUE, exchange=topology.EXCHANGE, routing_key=ROUTING_KEY)
+    connection.close()
+
+    for name, fn in [("connect-per-message", connect_per_message), ("pooled", pooled)]:
+        rate, p50, p99 = run(fn, args.messages, args.threads)
+        print(f"{name:>20}: {rate:10.1f} msg/s   p50 {p50 * 1000:7.2f} ms   p99 {p99 * 1000:7.2f} ms")
+
+    pool.close()
+    connection = get_rabbitmq_connection()
+    connection.channel().queue_delete(queue=QUEUE)
+    connection.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""Benchmark: per-row cost of ORM + response_model serialization against projected rows + orjson.
+
+The "current" path mirrors what FastAPI does with response_model: load ORM
+objects, validate them into schema.Book1 and dump them as JSON. Uses DB_URL
+when set, otherwise a throwaway SQLite file. Run from the admin directory:
+
+    python bench_serialization.py --rows 1000
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+from datetime import date
+from typing import List
+
+os.environ.setdefault("DB_URL", f"sqlite:///{tempfile.mkdtemp()}/bench_serialization.db")
+
+import orjson
+from pydantic import TypeAdapter
+from sqlalchemy import insert
+from sqlalchemy.orm import joinedload
+from database import Base, SessionLocal, engine
+import crud
+import models
+import schema
+
+books_adapter = TypeAdapter(List[schema.Book1])
+
+
+def seed(rows):
+    Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+    try:
+        if db.query(models.Book).count() >= rows:
+            return
+        db.execute(insert(models.User), [
+            {"id": i, "email": f"user{i}@example.com", "firstname": "First", "lastname": f"Last {i}"} for i in range(1, 101)
+        ])
+        # Every third book is borrowed, so the nested "user" object is exercised
+        db.execute(insert(models.Book), [
+            {"title": f"Title {i}", "publisher": f"Publisher {i % 500}", "category": f"Category {i % 40}",
+             "available": i % 3 != 0, "borrower_id": i % 100 + 1 if i % 3 == 0 else None,
+             "borrow_date": date(2025, 1, 1) if i % 3 == 0 else None,
+             "return_date": date(2025, 1, 15) if i % 3 == 0 else None}
+            for i in range(rows)
+        ])
+        db.commit()
+    finally:
+        db.close()
+
+
+def orm_path(db, rows):
+    books = db.query(models.Book).options(joinedload(models.Book.user)).limit(rows).all()
+    loaded = time.perf_counter()
+    validated = books_adapter.validate_python(books, from_attributes=True)
+    body = json.dumps(books_adapter.dump_python(validated, mode="json")).encode()
+    return loaded, body
+
+
+def fast_path(db, rows):
+    books = crud.get_books(db, limit=rows)
+    loaded = time.perf_counter()
+    return loaded, orjson.dumps(books)
+
+
+def measure(path, rows, repeat):
+    best_load = best_serialize = float("inf")
+    for _ in range(repeat):
+        db = SessionLocal()  # fresh identity map, as per request
+        started = time.perf_counter()
+        loaded, body = path(db, rows)
+        done = time.perf_counter()
+        db.close()
+        best_load = min(best_load, loaded - started)
+        best_serialize = min(best_serialize, done - loaded)
+    return best_load, best_serialize, body
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    seed(args.rows)
+    results = {name: measure(path, args.rows, args.repeat) for name, path in [("orm+pydantic", orm_path), ("rows+orjson", fast_path)]}
+    assert json.loads(results["orm+pydantic"][2]) == json.loads(results["rows+orjson"][2])
+
+    print(f"{'path':>14} {'load us/row':>12} {'serialize us/row':>17} {'total us/row':>13}")
+    for name, (load, serialize, _) in results.items():
+        per_row = 1e6 / args.rows
+        print(f"{name:>14} {load * per_row:>12.2f} {serialize * per_row:>17.2f} {(load + serialize) * per_row:>13.2f}")
+
+
+if __name__ == "__main__":
+    main()
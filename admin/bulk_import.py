@@ -0,0 +1,76 @@
+import csv
+import json
+import os
+from pydantic import ValidationError
+import schema
+
+BULK_IMPORT_CHUNK_SIZE = int(os.getenv("BULK_IMPORT_CHUNK_SIZE", "1000"))
+
+CSV = "csv"
+NDJSON = "ndjson"
+
+
+class BulkImportError(Exception):
+    """A row of the upload could not be parsed or validated."""
+
+    def __init__(self, line, message):
+        super().__init__(f"Line {line}: {message}")
+        self.line = line
+
+
+def detect_format(content_type: str):
+    content_type = (content_type or "").split(";")[0].strip().lower()
+    if content_type in ("text/csv", "application/csv"):
+        return CSV
+    if content_type in ("application/x-ndjson", "application/ndjson", "application/jsonl"):
+        return NDJSON
+    return None
+
+
+async def iter_lines(stream):
+    """Yield raw lines from a byte stream without buffering the whole body.
+
+    Lines are decoded by the caller, so bad UTF-8 is reported with its line number.
+    """
+    pending = b""
+    async for chunk in stream:
+        pending += chunk
+        *lines, pending = pending.split(b"\n")
+        for line in lines:
+            yield line.rstrip(b"\r")
+    if pending:
+        yield pending.rstrip(b"\r")
+
+
+async def iter_chunks(stream, fmt, chunk_size=BULK_IMPORT_CHUNK_SIZE):
+    """Parse an upload into validated lists of BookCreate, chunk_size at a time.
+
+    CSV needs a header row with title, publisher and category; each record
+    must fit on one line. NDJSON has one JSON object per line.
+    """
+    header = None
+    chunk = []
+    line_no = 0
+    async for raw in iter_lines(stream):
+        line_no += 1
+        if not raw.strip():
+            continue
+        try:
+            line = raw.decode("utf-8")  # UnicodeDecodeError is a ValueError
+            if fmt == CSV:
+                values = next(csv.reader([line]))
+                if header is None:
+                    header = [name.strip() for name in values]
+                    continue
+                record = dict(zip(header, values))
+            else:
+                record = json.loads(line)
+            chunk.append(schema.BookCreate.model_validate(record))
+        except (ValueError, ValidationError) as e:
+            raise BulkImportError(line_no, str(e))
+
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
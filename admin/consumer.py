@@ -1,148 +1,348 @@
 import pika
-import json
+import functools
+import os
 import time
+from sqlalchemy import select, update
 from sqlalchemy.orm import Session
 from database import SessionLocal
 from models import User, Book
 from messaging.config import get_rabbitmq_connection
+from messaging.codec import decode_event
+from messaging import topology
+from messaging.workers import PartitionedWorkerPool
+from messaging.versions import VersionMap
+from messaging import retry
+import reports
 
+# CONSUMER_BATCH_SIZE > 1 switches to batched, manually-acked consumption
+CONSUMER_BATCH_SIZE = int(os.getenv("CONSUMER_BATCH_SIZE", "1"))
+CONSUMER_BATCH_WAIT_MS = int(os.getenv("CONSUMER_BATCH_WAIT_MS", "200"))
+# CONSUMER_WORKERS > 1 applies messages on a thread pool partitioned by entity
+CONSUMER_WORKERS = int(os.getenv("CONSUMER_WORKERS", "1"))
+CONSUMER_PREFETCH = int(os.getenv("CONSUMER_PREFETCH", str(max(CONSUMER_BATCH_SIZE * 2, CONSUMER_WORKERS * 10))))
 
-def process_user_created(ch, method, properties, body):
-    """Process messages from RabbitMQ and add users to Admin API database."""
-    try:
-        data = json.loads(body)
+# Highest applied version per entity, to skip replays without touching the DB
+versions = VersionMap()
 
-        if not all(k in data for k in ["user_id", "firstname", "lastname", "email"]):
-            print(f"⚠️ Invalid user message format: {data}")
-            return
 
-        user_id = data["user_id"]
-        firstname = data["firstname"]
-        lastname = data["lastname"]
-        email = data["email"]
+def parse_message(queue, properties, body):
+    """Decode and validate a message, returning None if it is not valid for the queue."""
+    event = decode_event(queue, properties, body)
+    return event.model_dump() if event is not None else None
 
-        db: Session = SessionLocal()
-        try:
-            existing_user = db.query(User).filter(User.id == user_id).first()
-            if not existing_user:
-                new_user = User(id=user_id, firstname=firstname, lastname=lastname, email=email)
-                db.add(new_user)
-                db.commit()
-                print(f"✅ Admin API: User {email} added to PostgreSQL")
-            else:
-                print(f"ℹ️ User {email} already exists in PostgreSQL")
-        finally:
-            db.close()
 
-    except Exception as e:
-        print(f"❌ Error processing user message: {e}")
+def apply_user_created(db: Session, data):
+    """Add a user created in the User API. Does not commit."""
+    user_id = data["user_id"]
+    email = data["email"]
 
+    if db.get(User, user_id) is None:
+        db.add(User(id=user_id, firstname=data["firstname"], lastname=data["lastname"], email=email,
+                    version=data["version"] or 1))
+        reports.count_users(db, 1)
+        db.flush()  # Later messages in the same batch must see this user
+        print(f"✅ Admin API: User {email} added to PostgreSQL")
+    else:
+        print(f"ℹ️ User {email} already exists in PostgreSQL")
 
-def process_book_borrowed(ch, method, properties, body):
-    """Process messages from RabbitMQ for book borrowing."""
+
+def _apply_book_loan(db: Session, data, action):
+    """Single conditional UPDATE: only applies if the loan version is newer.
+
+    The report deltas need the row as it was, so on PostgreSQL the UPDATE
+    reads it through a locking CTE and returns it; stale events match no
+    row and touch no counters.
+    """
+    book_id = data["book_id"]
+    version = data["version"]
+
+    values = {
+        "available": data["available"],
+        "borrower_id": data["borrower_id"],
+        "borrow_date": data["borrow_date"],
+        "return_date": data["return_date"],
+        "reminded_on": None,  # A new loan or a return starts the reminder schedule over
+    }
+    condition = [Book.id == book_id]
+    if version:
+        condition.append(Book.loan_version < version)
+        values["loan_version"] = version
+    fields = [getattr(Book, field) for field in reports.SNAPSHOT_FIELDS]
+
+    if db.get_bind().dialect.name == "postgresql":
+        old = select(Book.id, *fields).where(*condition).with_for_update().cte("old")
+        before = db.execute(
+            update(Book).where(Book.id == old.c.id).values(**values)
+            .returning(*(old.c[field] for field in reports.SNAPSHOT_FIELDS))
+            .execution_options(synchronize_session=False)
+        ).mappings().first()
+    else:
+        # No RETURNING of old values here: lock the row only if the event still applies
+        before = db.execute(select(*fields).where(*condition).with_for_update()).mappings().first()
+        if before is not None:
+            db.execute(update(Book).where(Book.id == book_id).values(**values).execution_options(synchronize_session=False))
+
+    if before is not None:
+        reports.record(db, [(dict(before), {**before, **values})])
+        print(f"✅ Admin API: Book {book_id} marked as {action} in PostgreSQL")
+    else:
+        print(f"⚠️ Admin API: Book {book_id} not found or loan version {version} is stale")
+
+
+def apply_book_borrowed(db: Session, data):
+    """Record a book borrowed in the User API. Does not commit."""
+    _apply_book_loan(db, data, "borrowed")
+
+
+def apply_book_returned(db: Session, data):
+    """Record a book returned in the User API. Does not commit."""
+    _apply_book_loan(db, data, "returned")
+
+
+APPLIERS = {
+    "user_created": apply_user_created,
+    "book_borrowed": apply_book_borrowed,
+    "book_returned": apply_book_returned,
+}
+
+
+def version_key(queue, data):
+    """Key under which an event's version is tracked."""
+    if queue == "user_created":
+        return ("user", data["user_id"])
+    return ("loan", data["book_id"])
+
+
+def is_stale(queue, data):
+    if versions.is_stale(version_key(queue, data), data["version"]):
+        print(f"ℹ️ Skipping stale {queue} event (version {data['version']})")
+        return True
+    return False
+
+
+def record_versions(batch):
+    for queue, data in batch:
+        versions.record(version_key(queue, data), data["version"])
+
+
+def partition_key(queue, data):
+    """Events about the same entity must be applied in order."""
+    if "book_id" in data:
+        return ("book", data["book_id"])
+    return ("user", data["user_id"])
+
+
+def apply_message(queue, data):
+    """Apply one message in its own transaction. Returns False on DB failure."""
+    if is_stale(queue, data):
+        return True
+
+    db: Session = SessionLocal()
     try:
-        data = json.loads(body)
+        APPLIERS[queue](db, data)
+        db.commit()
+        record_versions([(queue, data)])
+        return True
+    except Exception as db_error:
+        db.rollback()  # ✅ Rollback in case of failure
+        print(f"❌ Database error processing {queue} message: {db_error}")
+        return False
+    finally:
+        db.close()  # ✅ Ensure DB session is closed
 
-        if not all(k in data for k in ["book_id", "available", "borrower_id", "borrow_date","return_date"]):
-            print(f"⚠️ Invalid user message format: {data}")
-            return
 
-        book_id = data["book_id"]
-        available = data["available"]
-        borrower_id = data["borrower_id"]
-        borrow_date = data["borrow_date"]
-        return_date = data["return_date"]
+def _process(queue, ch, method, properties, body):
+    """Apply one delivery; failures go to the retry queues instead of being lost."""
+    data = parse_message(queue, properties, body)
+    if data is None:
+        retry.dead_letter(ch, queue, properties, body, "undecodable")
+    elif not apply_message(queue, data):
+        retry.defer(ch, queue, properties, body)
+    ch.basic_ack(delivery_tag=method.delivery_tag)
 
-        db: Session = SessionLocal()
-        try:
-            db_book = db.query(Book).filter(Book.id == book_id).first()
-            if db_book:
-                # ✅ Update the existing book record
-                db_book.available = available
-                db_book.borrower_id = borrower_id
-                db_book.borrow_date = borrow_date
-                db_book.return_date = return_date
-
-                db.commit()
-                print(f"✅ Admin API: Book {book_id} marked as borrowed in PostgreSQL")
-            else:
-                print(f"⚠️ Admin API: Book {book_id} not found in database")
-        finally:
-            db.close()
 
-    except Exception as e:
-        print(f"❌ Error processing book borrow message: {e}")
+def process_user_created(ch, method, properties, body):
+    """Process messages from RabbitMQ and add users to Admin API database."""
+    _process("user_created", ch, method, properties, body)
 
 
+def process_book_borrowed(ch, method, properties, body):
+    """Process messages from RabbitMQ for book borrowing."""
+    _process("book_borrowed", ch, method, properties, body)
+
 
 def process_book_returned(ch, method, properties, body):
     """Process messages from RabbitMQ for book return."""
-    try:
-        data = json.loads(body)
+    _process("book_returned", ch, method, properties, body)
 
-        if not all(k in data for k in ["book_id", "available", "borrower_id", "borrow_date", "return_date"]):
-            print(f"⚠️ Invalid book return message format: {data}")
-            return
 
-        book_id = data["book_id"]
-        available = data["available"]
-        borrower_id = data["borrower_id"]
-        borrow_date = data["borrow_date"]
-        return_date = data["return_date"]
+def preload(db: Session, batch):
+    """Load every user a batch creates with one SELECT.
+
+    apply_user_created uses db.get(), which is then served from the identity
+    map; loan events lock and read their own row before the conditional UPDATE.
+    """
+    user_ids = {data["user_id"] for queue, data in batch if queue == "user_created"}
+    if user_ids:
+        db.query(User).filter(User.id.in_(user_ids)).all()
+
+
+class BatchConsumer:
+    """Collect up to batch_size messages or batch_wait_ms, apply them in one
+    transaction and ack them only after it commits."""
+
+    def __init__(self, channel, batch_size=CONSUMER_BATCH_SIZE, batch_wait_ms=CONSUMER_BATCH_WAIT_MS):
+        self.channel = channel
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait_ms / 1000
+        self.buffer = []
+        self.deadline = None
+
+    def on_message(self, ch, method, properties, body):
+        if not self.buffer:
+            self.deadline = time.monotonic() + self.batch_wait
+        self.buffer.append((retry.event_name(method, properties), method.delivery_tag, properties, body))
+        if len(self.buffer) >= self.batch_size:
+            self.flush()
+
+    def time_left(self):
+        if not self.buffer:
+            return self.batch_wait
+        return max(self.deadline - time.monotonic(), 0)
+
+    def flush_if_due(self):
+        if self.buffer and time.monotonic() >= self.deadline:
+            self.flush()
+
+    def flush(self):
+        messages, self.buffer = self.buffer, []
+        last_tag = messages[-1][1]
+        decoded = []
+        for queue, tag, properties, body in messages:
+            data = parse_message(queue, properties, body)
+            if data is None:
+                # Malformed messages can never succeed, so they are dead-lettered right away
+                retry.dead_letter(self.channel, queue, properties, body, "undecodable")
+            else:
+                decoded.append((queue, properties, body, data))
+        batch = [(queue, data) for queue, properties, body, data in decoded if not is_stale(queue, data)]
 
         db: Session = SessionLocal()
         try:
-            db_book = db.query(Book).filter(Book.id == book_id).first()
-            if db_book:
-                db_book.available = available
-                db_book.borrower_id = borrower_id
-                db_book.borrow_date = borrow_date
-                db_book.return_date = return_date
-
-                db.commit()
-                print(f"✅ Admin API: Book {book_id} marked as returned in PostgreSQL")
-            else:
-                print(f"⚠️ Admin API: Book {book_id} not found in database")
+            preload(db, batch)
+            for queue, data in batch:
+                APPLIERS[queue](db, data)
+            db.commit()
+            record_versions(batch)
+            print(f"✅ Admin API: applied batch of {len(batch)} messages")
         except Exception as db_error:
-            db.rollback()  # ✅ Rollback in case of failure
-            print(f"❌ Database error: {db_error}")
+            db.rollback()
+            print(f"❌ Batch of {len(batch)} failed ({db_error}), applying messages one by one")
+            self.apply_individually(decoded)
         finally:
-            db.close()  # ✅ Ensure DB session is closed
-    except json.JSONDecodeError:
-        print(f"❌ Error: Invalid JSON format in message: {body}")
-    except Exception as e:
-        print(f"❌ Unexpected error processing book return message: {e}")
+            db.close()
+
+        self.channel.basic_ack(delivery_tag=last_tag, multiple=True)
+
+    def apply_individually(self, decoded):
+        """Isolate the failing messages of a batch; they go to the retry queues."""
+        for queue, properties, body, data in decoded:
+            if not apply_message(queue, data):
+                retry.defer(self.channel, queue, properties, body)
 
 
+def defer_and_ack(ch, queue, properties, body, tag):
+    retry.defer(ch, queue, properties, body)
+    ch.basic_ack(delivery_tag=tag)
 
 
+def worker_pool_callback(connection, pool):
+    """Build an on_message callback that hands messages to the worker pool.
+
+    Acks and retries happen on the connection's thread (pika is not
+    thread-safe) once the worker is done; a lost connection simply leaves
+    them unacked for redelivery.
+    """
+    def on_message(ch, method, properties, body):
+        queue = retry.event_name(method, properties)
+        data = parse_message(queue, properties, body)
+        if data is None:
+            retry.dead_letter(ch, queue, properties, body, "undecodable")
+            ch.basic_ack(delivery_tag=method.delivery_tag)
+            return
+
+        def on_done(success, tag=method.delivery_tag):
+            if success:
+                callback = functools.partial(ch.basic_ack, delivery_tag=tag)
+            else:
+                callback = functools.partial(defer_and_ack, ch, queue, properties, body, tag)
+            try:
+                connection.add_callback_threadsafe(callback)
+            except Exception:
+                pass
 
-def start_consumer():
+        pool.submit(partition_key(queue, data), (queue, data), on_done)
+
+    return on_message
+
+
+def start_consumer(batch_size=CONSUMER_BATCH_SIZE, workers=CONSUMER_WORKERS, prefetch=CONSUMER_PREFETCH):
     """Start RabbitMQ consumer with automatic reconnection."""
+    pool = None
+    if workers > 1 and batch_size <= 1:
+        pool = PartitionedWorkerPool(workers, lambda item: apply_message(*item))
+        pool.start()
+
     while True:
         try:
             connection = get_rabbitmq_connection()
             channel = connection.channel()
+            # Retry and dead-letter copies are confirmed before the original delivery is acked
+            channel.confirm_delivery()
 
-            # Declare queues
-            channel.queue_declare(queue="user_created", durable=False)
-            channel.queue_declare(queue="book_borrowed", durable=False)
-            channel.queue_declare(queue="book_returned", durable=False)
-            
+            # Declare our queues and bind them to the event exchange, plus their retry and dead-letter queues
+            topology.bind_queues(channel, APPLIERS)
+            retry.declare_queues(channel, APPLIERS)
 
+            if batch_size > 1:
+                channel.basic_qos(prefetch_count=prefetch)
+                batcher = BatchConsumer(channel, batch_size=batch_size)
+                for event in APPLIERS:
+                    channel.basic_consume(queue=topology.queue_name(event), on_message_callback=batcher.on_message)
 
+                print(f"🎧 Admin API is listening for user creation events (batches of {batch_size})...")
+                while True:
+                    connection.process_data_events(time_limit=batcher.time_left())
+                    batcher.flush_if_due()
+
+            if pool is not None:
+                channel.basic_qos(prefetch_count=prefetch)
+                on_message = worker_pool_callback(connection, pool)
+                for event in APPLIERS:
+                    channel.basic_consume(queue=topology.queue_name(event), on_message_callback=on_message)
+
+                print(f"🎧 Admin API is listening for user creation events ({workers} workers)...")
+                while True:
+                    connection.process_data_events(time_limit=1)
+                    pool.maybe_report()
+
+            # Consume messages from both queues; acked once applied or handed to a retry queue
+            channel.basic_qos(prefetch_count=prefetch)
+            channel.basic_consume(queue=topology.queue_name("user_created"), on_message_callback=process_user_created)
+            channel.basic_consume(queue=topology.queue_name("book_borrowed"), on_message_callback=process_book_borrowed)
+            channel.basic_consume(queue=topology.queue_name("book_returned"), on_message_callback=process_book_returned)
 
-            # Consume messages from both queues
-            channel.basic_consume(queue="user_created", on_message_callback=process_user_created, auto_ack=True)
-            channel.basic_consume(queue="book_borrowed", on_message_callback=process_book_borrowed, auto_ack=True)
-            channel.basic_consume(queue="book_returned", on_message_callback=process_book_returned, auto_ack=True)
-            
             print("🎧 Admin API is listening for user creation events...")
             channel.start_consuming()
 
         except pika.exceptions.AMQPConnectionError as e:
             print(f"🔴 RabbitMQ Connection Error: {e}. Retrying in 5 seconds...")
             time.sleep(5)
+        except (pika.exceptions.UnroutableError, pika.exceptions.NackError) as e:
+            # A retry copy was refused: reconnecting redelivers everything still unacked
+            print(f"🔴 Could not hand a failed message to its retry queue ({e}). Reconnecting in 5 seconds...")
+            connection.close()
+            time.sleep(5)
 
 if __name__ == "__main__":
     start_consumer()
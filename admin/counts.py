@@ -0,0 +1,130 @@
+"""Totals for listing endpoints without COUNT(*) scans.
+
+Unfiltered listings read the counters that reports.record() and
+reports.count_users() keep exact in every write transaction. Filtered
+listings run a real COUNT but cache it for COUNT_CACHE_TTL seconds; a
+commit in this process that changes books or users drops the cache, so
+clients see their own writes. mode="approximate" asks the query planner
+instead, which costs a plan and no rows on very large tables.
+"""
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from sqlalchemy import event, func, select
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.expression import ClauseElement, Executable
+from sqlalchemy.orm import Session
+from models import Book, User, RowCount
+import reports
+
+COUNT_CACHE_TTL = float(os.getenv("COUNT_CACHE_TTL", "10"))
+COUNT_CACHE_SIZE = int(os.getenv("COUNT_CACHE_SIZE", "1000"))
+MODES = ("exact", "approximate")
+
+# Listing name -> the rows it pages over, for planner estimates
+LISTINGS = {
+    "books": select(Book.id),
+    "borrowed": select(Book.id).where(Book.available == False),
+    "users": select(User.id),
+}
+
+_cache = OrderedDict()  # SQL -> (expires_at, count)
+_lock = threading.Lock()
+
+
+def changed(db: Session):
+    """Mark the transaction as changing counts; the cache is cleared when it commits."""
+    db.info["counts_changed"] = True
+
+
+@event.listens_for(Session, "after_commit")
+def _clear_on_commit(session):
+    if session.info.pop("counts_changed", False):
+        clear()
+
+
+@event.listens_for(Session, "after_rollback")
+def _forget_change(session):
+    session.info.pop("counts_changed", None)
+
+
+def clear():
+    with _lock:
+        _cache.clear()
+
+
+def _counter(db: Session, name: str):
+    if name == "users":
+        row = db.get(RowCount, "users")
+        return row.total if row else 0
+    books, borrowed = reports.totals(db)
+    return borrowed if name == "borrowed" else books
+
+
+def _cache_key(db: Session, statement):
+    """The statement's SQL with its parameters; values are never rendered into SQL."""
+    compiled = statement.compile(dialect=db.get_bind().dialect)
+    return str(compiled), repr(sorted(compiled.params.items()))
+
+
+class Explain(Executable, ClauseElement):
+    """EXPLAIN of a select, compiled with the select's bound parameters."""
+    inherit_cache = False
+
+    def __init__(self, statement, prefix="EXPLAIN"):
+        self.statement = statement
+        self.prefix = prefix
+
+
+@compiles(Explain)
+def _compile_explain(element, compiler, **kw):
+    return f"{element.prefix} {compiler.process(element.statement, **kw)}"
+
+
+def estimate(db: Session, statement):
+    """The planner's row estimate for statement, or None where there is none."""
+    dialect = db.get_bind().dialect.name
+    if dialect == "postgresql":
+        plan = db.execute(Explain(statement, "EXPLAIN (FORMAT JSON)")).scalar()
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return int(plan[0]["Plan"]["Plan Rows"])
+    if dialect == "mysql":
+        row = db.execute(Explain(statement)).mappings().first()
+        if row is None or row["rows"] is None:
+            return None
+        return int(row["rows"] * (row["filtered"] or 100) / 100)
+    return None
+
+
+def total(db: Session, name: str, mode: str = "exact"):
+    """Total rows of an unfiltered listing ("books", "borrowed" or "users")."""
+    if mode == "approximate":
+        approximate = estimate(db, LISTINGS[name])
+        if approximate is not None:
+            return approximate
+    return _counter(db, name)
+
+
+def filtered_total(db: Session, statement, mode: str = "exact"):
+    """Rows matching a filtered select: a planner estimate, or an exact count cached for COUNT_CACHE_TTL."""
+    if mode == "approximate":
+        approximate = estimate(db, statement)
+        if approximate is not None:
+            return approximate
+    key = _cache_key(db, statement)
+    with _lock:
+        entry = _cache.get(key)
+        if entry is not None and entry[0] > time.monotonic():
+            _cache.move_to_end(key)
+            return entry[1]
+
+    count = db.scalar(select(func.count()).select_from(statement.subquery()))
+    with _lock:
+        _cache[key] = (time.monotonic() + COUNT_CACHE_TTL, count)
+        _cache.move_to_end(key)
+        while len(_cache) > COUNT_CACHE_SIZE:
+            _cache.popitem(last=False)
+    return count
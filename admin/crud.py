@@ -1,6 +1,11 @@
+from sqlalchemy import case, delete, func, insert, or_, select, update
 from sqlalchemy.orm import Session
 import schema, models
-from sqlalchemy.orm import joinedload
+from pagination import keyset_page
+import reports
+import counts
+from sqlalchemy.orm import selectinload
+from producer import send_book_created, send_books_created, send_book_deleted, send_books_deleted, send_user_deleted, send_users_deleted, send_book_updated, send_book_availability
 
 
 # Function to ADD book
@@ -13,10 +18,35 @@ def add_book(db: Session, book: schema.BookCreate):
         available=True
     )
     db.add(db_book)
+    db.flush()
+    reports.record(db, [(None, reports.snapshot(db_book))])
+
+    # Publish book-created event through the outbox, in the same transaction
+    send_book_created(db, db_book.id, db_book.title, db_book.publisher, db_book.category, db_book.available, db_book.version)
+
     db.commit()
     db.refresh(db_book)
     return db_book
 
+# Function to ADD a chunk of books in one executemany INSERT
+def add_books(db: Session, books: list[schema.BookCreate]):
+    rows = [
+        {"title": book.title, "publisher": book.publisher, "category": book.category, "available": True, "version": 1}
+        for book in books
+    ]
+    ids = db.scalars(
+        insert(models.Book).returning(models.Book.id, sort_by_parameter_order=True),
+        rows,
+    ).all()
+
+    reports.record(db, [(None, reports.snapshot(row)) for row in rows])
+
+    # One catalog event per chunk, in the same transaction
+    send_books_created(db, [{"book_id": book_id, **row} for book_id, row in zip(ids, rows)])
+
+    db.commit()
+    return ids
+
 # Funtion to DELETE book
 def delete_book(db: Session, book_id: int):
     db_book = db.query(models.Book).filter(models.Book.id == book_id).first()
@@ -25,35 +55,160 @@ def delete_book(db: Session, book_id: int):
         print(f" [!] Book with ID {book_id} not found in the frontend database")
         return {"error": "Book not found"}
     
+    reports.record(db, [(reports.snapshot(db_book), None)])
     db.delete(db_book)
+    send_book_deleted(db, book_id)
     db.commit()
     
     print(f" [x] Deleted book with ID {book_id} from the frontend database")
     return {"message": f"Book {book_id} deleted successfully"}
 
+# IDs per DELETE ... WHERE id IN (...), to stay under database parameter limits
+BULK_DELETE_CHUNK = 5000
+
+
+def _chunks(ids):
+    ids = sorted(set(ids))
+    return [ids[start:start + BULK_DELETE_CHUNK] for start in range(0, len(ids), BULK_DELETE_CHUNK)]
+
+
+# Function to DELETE many books by id and/or exact-match filters in one transaction
+def delete_books(db: Session, ids: list[int] = None, category: str = None, publisher: str = None,
+                 available: bool = None):
+    criteria = []
+    if category is not None:
+        criteria.append(models.Book.category == category)
+    if publisher is not None:
+        criteria.append(models.Book.publisher == publisher)
+    if available is not None:
+        criteria.append(models.Book.available == available)
+    if ids is None and not criteria:
+        return {"error": "Give ids or at least one filter"}
+
+    # RETURNING hands back the ids for the event and the snapshots for the report counters
+    statement = delete(models.Book).returning(models.Book.id, *(getattr(models.Book, field) for field in reports.SNAPSHOT_FIELDS))
+    if ids is None:
+        deleted = db.execute(statement.where(*criteria)).mappings().all()
+    else:
+        deleted = [row for chunk in _chunks(ids)
+                   for row in db.execute(statement.where(models.Book.id.in_(chunk), *criteria)).mappings().all()]
+
+    book_ids = sorted(row["id"] for row in deleted)
+    if book_ids:
+        reports.record(db, [(reports.snapshot(row), None) for row in deleted])
+        send_books_deleted(db, book_ids)
+    db.commit()
+
+    print(f" [x] Deleted {len(book_ids)} books from the frontend database")
+    return {"message": f"{len(book_ids)} books deleted successfully", "count": len(book_ids), "ids": book_ids}
+
+# Function to DELETE many users by id in one transaction
+def delete_users(db: Session, ids: list[int]):
+    user_ids = []
+    for chunk in _chunks(ids):
+        # What db.delete() does per user: their borrowed books lose the borrower
+        db.execute(update(models.Book).where(models.Book.borrower_id.in_(chunk)).values(borrower_id=None))
+        user_ids += db.scalars(delete(models.User).where(models.User.id.in_(chunk)).returning(models.User.id)).all()
+
+    user_ids.sort()
+    if user_ids:
+        reports.forget_borrowers(db, user_ids)
+        reports.count_users(db, -len(user_ids))
+        send_users_deleted(db, user_ids)
+    db.commit()
+
+    print(f" [x] Deleted {len(user_ids)} users from the frontend database")
+    return {"message": f"{len(user_ids)} users deleted successfully", "count": len(user_ids), "ids": user_ids}
+
 #Get all users
 def get_users(db: Session, offset: int = 0, limit: int = 10):
-    return db.query(models.User).offset(offset).limit(limit).all()
+    # Borrowed books are loaded up front so async callers never lazy-load
+    return db.query(models.User).options(selectinload(models.User.books)).offset(offset).limit(limit).all()
 
-#Get all books
-def get_books(db: Session, offset: int = 0, limit: int = 10):
-    return (
-        db.query(models.Book)
-        .options(joinedload(models.Book.user))  # ✅ Now correctly loads borrower
-        .offset(offset)
+def get_users_page(db: Session, cursor: str = "", limit: int = 10):
+    query = db.query(models.User).options(selectinload(models.User.books))
+    return keyset_page(query, models.User.id, cursor, limit)
+
+# Columns of schema.Book: list endpoints select just these and skip ORM objects and Pydantic
+BOOK_COLUMNS = (
+    models.Book.id, models.Book.title, models.Book.publisher, models.Book.category, models.Book.available,
+    models.Book.borrower_id, models.Book.borrow_date, models.Book.return_date,
+)
+
+
+def _rows(result):
+    """Plain dicts from a projected query, ready for orjson."""
+    keys = list(result.keys())
+    return [dict(zip(keys, row)) for row in result]
+
+
+def book_rows(db: Session, *criteria, offset: int = 0, limit: int = None):
+    statement = select(*BOOK_COLUMNS).where(*criteria).offset(offset or None).limit(limit)
+    return _rows(db.execute(statement))
+
+
+BORROWER_COLUMNS = (models.User.email, models.User.firstname, models.User.lastname)
+
+
+def _pop_borrower(book):
+    """Move joined borrower columns into a nested "user" (None when not borrowed)."""
+    user = {"email": book.pop("email"), "firstname": book.pop("firstname"), "lastname": book.pop("lastname")}
+    book["user"] = user if user["email"] is not None else None
+    return book
+
+
+def attach_borrowers(db: Session, books):
+    """Batched borrower summary: one SELECT of just the borrowed books' users, no join."""
+    borrower_ids = {book["borrower_id"] for book in books if book["borrower_id"] is not None}
+    users = {}
+    if borrower_ids:
+        statement = select(models.User.id, *BORROWER_COLUMNS).where(models.User.id.in_(borrower_ids))
+        users = {user.pop("id"): user for user in _rows(db.execute(statement))}
+    for book in books:
+        book["user"] = users.get(book["borrower_id"])
+    return books
+
+
+def book_rows_with_borrower(db: Session, *criteria, offset: int = 0, limit: int = None, borrowers: str = "batched"):
+    """schema.Book1 rows: the book columns plus a borrower summary as "user".
+
+    borrowers="batched" selects the books alone and then the borrowed subset's
+    users with one IN query, so unborrowed books cost nothing extra; "join"
+    LEFT JOINs the borrower columns, which suits listings of borrowed books.
+    """
+    if borrowers == "batched":
+        return attach_borrowers(db, book_rows(db, *criteria, offset=offset, limit=limit))
+    statement = (
+        select(*BOOK_COLUMNS, *BORROWER_COLUMNS)
+        .outerjoin(models.User, models.Book.borrower_id == models.User.id)
+        .where(*criteria)
+        .offset(offset or None)
         .limit(limit)
-        .all()
     )
+    return [_pop_borrower(book) for book in _rows(db.execute(statement))]
+
+
+#Get all books (as schema.Book1 rows); few books are borrowed, so borrowers are batched
+def get_books(db: Session, offset: int = 0, limit: int = 10):
+    return book_rows_with_borrower(db, offset=offset, limit=limit, borrowers="batched")
+
+def get_books_page(db: Session, cursor: str = "", limit: int = 10):
+    books, next_cursor = keyset_page(db.query(*BOOK_COLUMNS), models.Book.id, cursor, limit)
+    return attach_borrowers(db, [book._asdict() for book in books]), next_cursor
 
-# Get Borrowed Books
+# Get Borrowed Books; every row has a borrower, so one join is cheapest
     
 def get_borrowed_books(db: Session, offset: int = 0, limit: int = 10):
-    books = db.query(models.Book).filter(models.Book.available == False).offset(offset).limit(limit).all()
-    
-    if not books:
-        return []
-    
-    return books
+    return book_rows_with_borrower(db, models.Book.available == False, offset=offset, limit=limit, borrowers="join")
+
+def get_borrowed_books_page(db: Session, cursor: str = "", limit: int = 10):
+    query = (
+        db.query(*BOOK_COLUMNS, *BORROWER_COLUMNS)
+        .outerjoin(models.User, models.Book.borrower_id == models.User.id)
+        .filter(models.Book.available == False)
+    )
+    books, next_cursor = keyset_page(query, models.Book.id, cursor, limit)
+    return [_pop_borrower(book._asdict()) for book in books], next_cursor
 
 
 # Function to DELETE User
@@ -64,7 +219,10 @@ def delete_user(db: Session, user_id: int):
         print(f" [!] User with ID {user_id} not found in the frontend database")
         return {"error": "User not found"}
     
+    reports.forget_borrower(db, user_id)
+    reports.count_users(db, -1)
     db.delete(db_user)
+    send_user_deleted(db, user_id)
     db.commit()
     
     print(f" [x] Deleted user with ID {user_id} from the frontend database")
@@ -77,9 +235,13 @@ def update_book(db:Session, book_id: int, book_update: schema.BookUpdate):
     if not db_book:
         return None
     
+    before = reports.snapshot(db_book)
     for key, value in book_update.model_dump(exclude_unset=True).items():
             setattr(db_book, key, value)
-            
+    reports.record(db, [(before, reports.snapshot(db_book))])
+
+    db_book.version += 1
+    send_book_updated(db, db_book.id, db_book.title, db_book.publisher, db_book.category, db_book.version)
     db.commit()
     db.refresh(db_book)
     return db_book
@@ -90,7 +252,11 @@ def update_book_availability(db: Session, book_id: int, available: bool):
     if not db_book:
         return None
 
+    before = reports.snapshot(db_book)
     db_book.available = available
+    reports.record(db, [(before, reports.snapshot(db_book))])
+    # Loans belong to the user service: it applies the override and echoes it back with a new loan_version
+    send_book_availability(db, db_book.id, db_book.available)
     db.commit()
     db.refresh(db_book)
     return db_book
@@ -98,21 +264,67 @@ def update_book_availability(db: Session, book_id: int, available: bool):
 
 # GET USER BY id
 def get_user_by_id(db: Session, user_id: int):
-    return db.query(models.User).filter(models.User.id ==user_id).first()
+    return db.query(models.User).options(selectinload(models.User.books)).filter(models.User.id ==user_id).first()
 
-# GET BOOK BY title
+# GET BOOK BY title (as schema.Book rows)
 def get_book_by_title(db: Session, title: str):
-    return db.query(models.Book).filter(models.Book.title.ilike(f"%{title}%")).all()
+    return book_rows(db, models.Book.title.ilike(f"%{title}%"))
 
 # GET BOOKS BY CATEGORY
 def get_books_by_category(db: Session, category: str):
-    return db.query(models.Book).filter(models.Book.category.ilike(f"%{category}%")).all()
+    return book_rows(db, models.Book.category.ilike(f"%{category}%"))
 
 
 
 # GET BOOK BY publisher
 def get_books_by_publisher(db: Session, publisher: str):
-    return db.query(models.Book).filter(models.Book.publisher.ilike(f"%{publisher}%")).all()
+    return book_rows(db, models.Book.publisher.ilike(f"%{publisher}%"))
+
+# FILTER BOOKS by any combination of category, publisher and availability
+def filter_books(db: Session, category: str = None, publisher: str = None, available: bool = None,
+                 cursor: str = "", limit: int = 10, total: str = None):
+    criteria = []
+    if category is not None:
+        criteria.append(models.Book.category == category)
+    if publisher is not None:
+        criteria.append(models.Book.publisher == publisher)
+    if available is not None:
+        criteria.append(models.Book.available == available)
+    # All books and all borrowed books are counted already; anything else is a filtered count
+    if total is None:
+        count = None
+    elif category is None and publisher is None and available is None:
+        count = counts.total(db, "books", total)
+    elif category is None and publisher is None and available is False:
+        count = counts.total(db, "borrowed", total)
+    else:
+        # Counted over the composite (category, publisher, available, id) indexes
+        count = counts.filtered_total(db, select(models.Book.id).where(*criteria), total)
+    books, next_cursor = keyset_page(db.query(*BOOK_COLUMNS).filter(*criteria), models.Book.id, cursor, limit)
+    return attach_borrowers(db, [book._asdict() for book in books]), next_cursor, count
+
+# SEARCH BOOKS by title, publisher or category, best matches first
+def search_books(db: Session, q: str, limit: int = 20):
+    if db.get_bind().dialect.name == "postgresql":
+        # word_similarity (%>) uses the pg_trgm GIN indexes and tolerates typos
+        score = func.greatest(
+            func.word_similarity(q, models.Book.title) * 2,
+            func.word_similarity(q, models.Book.publisher),
+            func.word_similarity(q, models.Book.category),
+        )
+        matches = or_(*(column.op("%>")(q) for column in (models.Book.title, models.Book.publisher, models.Book.category)))
+        return db.query(models.Book).filter(matches).order_by(score.desc(), models.Book.id).limit(limit).all()
+
+    # Other databases: substring match, title hits ranked first
+    pattern = f"%{q}%"
+    title_hit = case((models.Book.title.ilike(pattern), 0), else_=1)
+    return (
+        db.query(models.Book)
+        .filter(or_(models.Book.title.ilike(pattern), models.Book.publisher.ilike(pattern), models.Book.category.ilike(pattern)))
+        .order_by(title_hit, models.Book.id)
+        .limit(limit)
+        .all()
+    )
 
 # GET Book BY id
 def get_book_by_id(db: Session, book_id: int):
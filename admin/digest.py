@@ -0,0 +1,99 @@
+"""Range digests over the tables both services replicate.
+
+A digest of an id range is (row count, sum of 64-bit row hashes mod 2**64),
+so it does not depend on row order and two databases agree on it exactly
+when they hold the same rows. A row hash is the first 8 bytes of the MD5
+of a canonical text form of the row. PostgreSQL and MySQL build that text
+and sum the hashes per slice in SQL, so only one row per slice leaves the
+database; other databases stream the rows and hash them here, identically.
+This module is identical in the admin and user services.
+"""
+import hashlib
+from sqlalchemy import BigInteger, Boolean, String, case, cast, func, literal, select
+from sqlalchemy.dialects import mysql, postgresql
+from sqlalchemy.orm import Session
+from models import Book, User
+
+MASK = 2 ** 64 - 1
+NULL_TEXT = "\\N"
+SEPARATOR = "\x1f"
+
+# Columns both services hold for each table, id first
+TABLES = {
+    "books": (Book.id, Book.title, Book.publisher, Book.category, Book.available, Book.borrower_id,
+              Book.borrow_date, Book.return_date, Book.version, Book.loan_version),
+    "users": (User.id, User.firstname, User.lastname, User.email, User.version),
+}
+
+
+def _text(value):
+    if value is None:
+        return NULL_TEXT
+    if isinstance(value, bool):
+        return "1" if value else "0"
+    if hasattr(value, "isoformat"):
+        return value.isoformat()
+    return str(value)
+
+
+def row_hash(row):
+    text = SEPARATOR.join(_text(value) for value in row)
+    return int.from_bytes(hashlib.md5(text.encode()).digest()[:8], "big")
+
+
+def _sql_text(column):
+    """A column's canonical text as the database renders it; matches _text()."""
+    if isinstance(column.type, Boolean):
+        value = case((column == True, "1"), (column == False, "0"))
+    elif isinstance(column.type, String):
+        value = column
+    else:
+        value = cast(column, String)  # integers, and dates as YYYY-MM-DD
+    return func.coalesce(value, NULL_TEXT)
+
+
+def _sql_row_hash(dialect, columns):
+    """row_hash() in SQL, or None where the database cannot compute it."""
+    prefix = func.substr(func.md5(func.concat_ws(SEPARATOR, *(_sql_text(c) for c in columns))), 1, 16)
+    if dialect == "postgresql":
+        return cast(cast(literal("x") + prefix, postgresql.BIT(64)), BigInteger)  # signed; the sum is masked
+    if dialect == "mysql":
+        return cast(func.conv(prefix, 16, 10), mysql.BIGINT(unsigned=True))
+    return None
+
+
+def bounds(db: Session, table: str):
+    """Smallest and largest id, or None for an empty table."""
+    key = TABLES[table][0]
+    low, high = db.execute(select(func.min(key), func.max(key))).one()
+    return None if low is None else {"lo": low, "hi": high + 1}
+
+
+def range_digests(db: Session, table: str, lo: int, hi: int, parts: int = 16):
+    """Digests of `parts` equal slices of [lo, hi), from one streaming scan of the range."""
+    columns = TABLES[table]
+    width = max(1, -(-(hi - lo) // parts))
+    buckets = [[0, 0] for _ in range(-(-(hi - lo) // width))]
+    in_range = (columns[0] >= lo, columns[0] < hi)
+
+    hashed = _sql_row_hash(db.get_bind().dialect.name, columns)
+    if hashed is not None:
+        slice_index = ((columns[0] - lo) // width).label("slice")
+        for index, count, total in db.execute(
+            select(slice_index, func.count(), func.sum(hashed)).where(*in_range).group_by("slice")
+        ):
+            buckets[int(index)] = [count, int(total) & MASK]
+    else:
+        for row in db.execute(select(*columns).where(*in_range).execution_options(yield_per=10000)):
+            bucket = buckets[(row[0] - lo) // width]
+            bucket[0] += 1
+            bucket[1] = (bucket[1] + row_hash(row)) & MASK
+    return [{"lo": lo + i * width, "hi": min(hi, lo + (i + 1) * width), "count": count, "hash": f"{digest:016x}"}
+            for i, (count, digest) in enumerate(buckets)]
+
+
+def range_rows(db: Session, table: str, lo: int, hi: int, limit: int = None):
+    """Every replicated column of the rows in [lo, hi) (the first `limit`), as dicts ordered by id."""
+    columns = TABLES[table]
+    result = db.execute(select(*columns).where(columns[0] >= lo, columns[0] < hi).order_by(columns[0]).limit(limit))
+    return [dict(row._mapping) for row in result]
@@ -1,30 +1,72 @@
-from fastapi import FastAPI, Depends, HTTPException
+from fastapi import FastAPI, Depends, HTTPException, Query, Request, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import ORJSONResponse, StreamingResponse
 from sqlalchemy.orm import Session
-from database import SessionLocal, engine, Base, get_db
+from sqlalchemy.ext.asyncio import AsyncSession
+from database import SessionLocal, engine, Base, get_db, get_async_db
 import schema, crud
-from typing import List
-from producer import send_book_created, send_book_deleted, send_user_deleted, send_book_updated
+from typing import List, Literal, Optional, Union
+from contextlib import asynccontextmanager
+from messaging.async_publisher import publisher
+import outbox
+import bulk_import
+import reports
+import counts
+import snapshot
+import time
 
 # Create database tables
 Base.metadata.create_all(bind=engine)
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Committed outbox events are published in the background, off the request path
+    await publisher.start(on_published=outbox.discard_published, on_superseded=outbox.discard_published)
+    yield
+    await publisher.stop()
+
+app = FastAPI(lifespan=lifespan)
 
 
 # Endpoint to CREATE book
 @app.post("/books/", tags=["Admin"])
 def create_book(book: schema.BookCreate, db: Session = Depends(get_db)):
+    # The book-created event is written to the outbox by crud and relayed to RabbitMQ
     added_book = crud.add_book(db=db, book=book)
 
-    # Publish book-created event to RabbitMQ
-    send_book_created(added_book.id, added_book.title, added_book.publisher, added_book.category, added_book.available)
-
     return {
         "message": "Book added successfully",
         "book": added_book
     }
 
 
+# Endpoint to bulk import books from a streamed CSV or NDJSON upload
+@app.post("/books/bulk", tags=["Admin"])
+async def bulk_create_books(request: Request, db: Session = Depends(get_db)):
+    fmt = bulk_import.detect_format(request.headers.get("content-type"))
+    if fmt is None:
+        raise HTTPException(status_code=415, detail="Upload text/csv or application/x-ndjson")
+
+    ids = []
+    started = time.perf_counter()
+    try:
+        async for chunk in bulk_import.iter_chunks(request.stream(), fmt):
+            # Each chunk is one executemany INSERT, one batched event and one commit
+            ids.extend(await run_in_threadpool(crud.add_books, db, chunk))
+    except bulk_import.BulkImportError as e:
+        raise HTTPException(status_code=422, detail={"error": str(e), "line": e.line, "imported": len(ids), "ids": ids})
+    elapsed = time.perf_counter() - started
+
+    return {
+        "message": "Books imported successfully",
+        "count": len(ids),
+        "ids": ids,
+        "seconds": round(elapsed, 3),
+        "rows_per_second": round(len(ids) / elapsed, 1) if elapsed else None,
+    }
+
+
 # Endpoint to DELETE a book by Id
 @app.delete("/books/{book_id}/delete", response_model=dict, tags=["Admin"])
 def delete_book(book_id: int, db: Session = Depends(get_db)):
@@ -33,9 +75,16 @@ def delete_book(book_id: int, db: Session = Depends(get_db)):
     if "error" in result:
         raise HTTPException(status_code=404, detail=result["error"])
     
-    # Send RabbitMQ message **only if the book was deleted successfully**
-    send_book_deleted(book_id)
-    
+    return result
+
+# Endpoint to DELETE many books at once: one set-based DELETE and one batched event
+@app.post("/books/bulk-delete", response_model=dict, tags=["Admin"])
+def bulk_delete_books(payload: schema.BookBulkDelete, db: Session = Depends(get_db)):
+    result = crud.delete_books(db, **payload.model_dump())
+
+    if "error" in result:
+        raise HTTPException(status_code=400, detail=result["error"])
+
     return result
 
 # Endpoint to DELETE a user by Id
@@ -46,22 +95,54 @@ def delete_user(user_id: int, db: Session = Depends(get_db)):
     if "error" in result:
         raise HTTPException(status_code=404, detail=result["error"])
     
-    # Send RabbitMQ message **only if the user was deleted successfully**
-    send_user_deleted(user_id)
-    
     return result
 
+# Endpoint to DELETE many users at once
+@app.post("/users/bulk-delete", response_model=dict, tags=["Admin"])
+def bulk_delete_users(payload: schema.UserBulkDelete, db: Session = Depends(get_db)):
+    return crud.delete_users(db, payload.ids)
+
+
+async def cursor_page(db: AsyncSession, fetch, cursor: str, limit: int):
+    """Keyset pagination: ?cursor= (empty) for the first page, then next_cursor."""
+    try:
+        items, next_cursor = await db.run_sync(fetch, cursor=cursor, limit=limit)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return {"items": items, "next_cursor": next_cursor}
+
+
+# ?total=exact|approximate adds the listing's total as an X-Total-Count header
+TotalMode = Optional[Literal["exact", "approximate"]]
+
+
+async def add_total(response: Response, db: AsyncSession, name: str, mode: TotalMode):
+    if mode is not None:
+        response.headers["X-Total-Count"] = str(await db.run_sync(counts.total, name, mode))
+
+
 # Endpoint to GET all users
-@app.get("/users/", response_model=List[schema.User], tags=["Admin"])
-def get_users(db: Session = Depends(get_db), offset: int = 0, limit: int = 10):
-    users = crud.get_users(db, offset=offset, limit=limit)
+@app.get("/users/", response_model=Union[List[schema.User], schema.UserPage], tags=["Admin"])
+async def get_users(response: Response, db: AsyncSession = Depends(get_async_db), offset: int = 0, limit: int = 10,
+                    cursor: Optional[str] = None, total: TotalMode = None):
+    await add_total(response, db, "users", total)
+    if cursor is not None:
+        return await cursor_page(db, crud.get_users_page, cursor, limit)
+    users = await db.run_sync(crud.get_users, offset=offset, limit=limit)
     return users
 
+# List endpoints below return projected rows serialized by orjson directly, skipping
+# ORM objects and response_model validation; response_model still documents the shape.
+
 # Endpoint to GET all books
-@app.get("/books/", response_model=List[schema.Book1], tags=["Admin"])
-def get_books(db: Session = Depends(get_db), offset: int = 0, limit: int = 10):
-    books = crud.get_books(db, offset=offset, limit=limit)
-    return books
+@app.get("/books/", response_model=Union[List[schema.Book1], schema.BookPage], tags=["Admin"])
+async def get_books(response: Response, db: AsyncSession = Depends(get_async_db), offset: int = 0, limit: int = 10,
+                    cursor: Optional[str] = None, total: TotalMode = None):
+    await add_total(response, db, "books", total)
+    if cursor is not None:
+        return await cursor_page(db, crud.get_books_page, cursor, limit)
+    books = await db.run_sync(crud.get_books, offset=offset, limit=limit)
+    return ORJSONResponse(books, headers=response.headers)
 
 # Endpoint to UPDATE books
 @app.put("/books/{book_id}", tags=["Admin"])
@@ -74,9 +155,6 @@ def update_book(book_id: int, payload: schema.BookUpdate, db: Session = Depends(
     if updated_book is None:
         raise HTTPException(status_code=404, detail="Book not found")
     
-    # Publish book-created event to RabbitMQ
-    send_book_updated(updated_book.id, updated_book.title, updated_book.publisher, updated_book.category, updated_book.available)
-    
     return {'message': 'success', 'data':updated_book}
 
 # Endpoint to UPDATE Book Availability
@@ -90,65 +168,110 @@ def update_book_availability(
     if updated_book is None:
         raise HTTPException(status_code=404, detail="Book not found")
 
-    # Publish book-availability-changed event to RabbitMQ
-    send_book_updated(
-        updated_book.id,
-        updated_book.title,
-        updated_book.publisher,
-        updated_book.category,
-        updated_book.available
-    )
-
     return {"message": "Availability updated", "data": updated_book}
 
 # Endpoint to GET User by id
 @app.get("/users/{user_id}/get/", response_model=schema.User, tags=["Admin"])
-def get_user_by_id(user_id: int, db: Session = Depends(get_db)):
-   user= crud.get_user_by_id(db=db, user_id=user_id) 
+async def get_user_by_id(user_id: int, db: AsyncSession = Depends(get_async_db)):
+   user= await db.run_sync(crud.get_user_by_id, user_id=user_id) 
    if user is None:
        raise HTTPException(status_code=404, detail="User not found")
    return user   
 
+# Endpoint to GET books filtered by category, publisher and availability, one page at a time
+@app.get("/books/filter", response_model=schema.BookPage, tags=["Admin"])
+async def filter_books(response: Response, category: Optional[str] = None, publisher: Optional[str] = None,
+                       available: Optional[bool] = None, cursor: str = "", limit: int = Query(10, ge=1, le=100),
+                       total: TotalMode = None, db: AsyncSession = Depends(get_async_db)):
+    try:
+        books, next_cursor, count = await db.run_sync(crud.filter_books, category=category, publisher=publisher,
+                                                      available=available, cursor=cursor, limit=limit, total=total)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if count is not None:
+        response.headers["X-Total-Count"] = str(count)
+    return {"items": books, "next_cursor": next_cursor}
+
+# Endpoint to SEARCH books, best matches first
+@app.get("/books/search", response_model=List[schema.Book], tags=["Admin"])
+async def search_books(q: str = Query(min_length=1), limit: int = Query(20, ge=1, le=100),
+                       db: AsyncSession = Depends(get_async_db)):
+    return await db.run_sync(crud.search_books, q=q, limit=limit)
+
 # Endpoint to GET Book by title
 @app.get("/books/title/{title}/", response_model=List[schema.Book], tags=["Admin"] )
-def get_book_by_title(title: str, db:Session = Depends(get_db)):
-    books=crud.get_book_by_title(db=db, title=title)
+async def get_book_by_title(title: str, db: AsyncSession = Depends(get_async_db)):
+    books=await db.run_sync(crud.get_book_by_title, title=title)
     if not books:
         raise HTTPException(status_code=404, detail="Book not found")
-    # Convert each SQLAlchemy model instance to a Pydantic schema
-    return [schema.Book.model_validate(book) for book in books]
+    return ORJSONResponse(books)
 
 # Endpoint to GET Books by category
 @app.get("/books/category/{category}/", response_model=List[schema.Book], tags=["Admin"])
-def get_books_by_category(category: str, db: Session = Depends(get_db)):
-    books = crud.get_books_by_category(db=db, category=category)
+async def get_books_by_category(category: str, db: AsyncSession = Depends(get_async_db)):
+    books = await db.run_sync(crud.get_books_by_category, category=category)
     if not books:
         raise HTTPException(status_code=404, detail="No books found in this category")
-    return books
+    return ORJSONResponse(books)
 
 # Endpoint to GET Books by publisher
 @app.get("/books/publisher/{publisher}/", response_model=List[schema.Book], tags=["Admin"])
-def get_books_by_publisher(publisher: str, db: Session = Depends(get_db)):
-    print(f"checking")
-    books = crud.get_books_by_publisher(db=db, publisher=publisher)
+async def get_books_by_publisher(publisher: str, db: AsyncSession = Depends(get_async_db)):
+    books = await db.run_sync(crud.get_books_by_publisher, publisher=publisher)
     if not books:
         raise HTTPException(status_code=404, detail="No books found for this publisher")
-    return books
+    return ORJSONResponse(books)
 
 # Endpoint to GET Book by id
 @app.get("/books/{book_id}/", response_model=schema.Book, tags=["Admin"])
-def get_Book_by_id(book_id: int, db: Session = Depends(get_db)):
-   book= crud.get_book_by_id(db=db, book_id=book_id) 
+async def get_Book_by_id(book_id: int, db: AsyncSession = Depends(get_async_db)):
+   book= await db.run_sync(crud.get_book_by_id, book_id=book_id) 
    if book is None:
        raise HTTPException(status_code=404, detail="Book not found")
    return book
 
 
 # Endpoint to Get borrowed books
-@app.get("/borrowed/books/", response_model=List[schema.Book1], tags=["Admin"])
-def get_borrowed_books(db: Session = Depends(get_db), offset: int = 0, limit: int = 10):
-    books = crud.get_borrowed_books(db, offset=offset, limit=limit)
-    return books
+@app.get("/borrowed/books/", response_model=Union[List[schema.Book1], schema.BookPage], tags=["Admin"])
+async def get_borrowed_books(response: Response, db: AsyncSession = Depends(get_async_db), offset: int = 0, limit: int = 10,
+                             cursor: Optional[str] = None, total: TotalMode = None):
+    await add_total(response, db, "borrowed", total)
+    if cursor is not None:
+        return await cursor_page(db, crud.get_borrowed_books_page, cursor, limit)
+    books = await db.run_sync(crud.get_borrowed_books, offset=offset, limit=limit)
+    return ORJSONResponse(books, headers=response.headers)
+
+
+# Report endpoints read incrementally maintained counters, never the books table
+@app.get("/reports/summary", tags=["Reports"])
+async def report_summary(db: AsyncSession = Depends(get_async_db)):
+    return await db.run_sync(reports.summary)
+
+@app.get("/reports/categories", tags=["Reports"])
+async def report_categories(db: AsyncSession = Depends(get_async_db)):
+    return await db.run_sync(reports.breakdown, "category")
+
+@app.get("/reports/publishers", tags=["Reports"])
+async def report_publishers(db: AsyncSession = Depends(get_async_db)):
+    return await db.run_sync(reports.breakdown, "publisher")
+
+@app.get("/reports/top-borrowers", tags=["Reports"])
+async def report_top_borrowers(limit: int = Query(10, ge=1, le=100),
+                               by: str = Query("total_loans", pattern="^(total_loans|current_loans)$"),
+                               db: AsyncSession = Depends(get_async_db)):
+    return await db.run_sync(reports.top_borrowers, limit=limit, by=by)
+
+
+# Endpoint to stream a gzip NDJSON catalog snapshot for bootstrapping user-service replicas
+@app.get("/snapshot", tags=["Admin"])
+def export_snapshot():
+    return StreamingResponse(snapshot.stream(SessionLocal), media_type="application/gzip",
+                             headers={"Content-Disposition": "attachment; filename=catalog-snapshot.ndjson.gz"})
+
+# Endpoint to GET event publisher counters (including updates saved by coalescing)
+@app.get("/metrics/publisher", tags=["Admin"])
+def get_publisher_metrics():
+    return publisher.stats
 
 
 @app.get("/")
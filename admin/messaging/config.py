@@ -2,7 +2,13 @@ import pika
 import os
 
 RABBITMQ_HOST = os.getenv("RABBITMQ_HOST", "localhost")
+RABBITMQ_HEARTBEAT = int(os.getenv("RABBITMQ_HEARTBEAT", "30"))
+RABBITMQ_BLOCKED_TIMEOUT = int(os.getenv("RABBITMQ_BLOCKED_TIMEOUT", "60"))
 
 def get_rabbitmq_connection():
     """Establish RabbitMQ connection."""
-    return pika.BlockingConnection(pika.ConnectionParameters(host=RABBITMQ_HOST))
+    return pika.BlockingConnection(pika.ConnectionParameters(
+        host=RABBITMQ_HOST,
+        heartbeat=RABBITMQ_HEARTBEAT,
+        blocked_connection_timeout=RABBITMQ_BLOCKED_TIMEOUT,
+    ))
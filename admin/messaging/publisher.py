@@ -0,0 +1,112 @@
+import os
+import threading
+import pika
+from messaging.config import get_rabbitmq_connection
+from messaging.codec import encode, properties
+from messaging import topology
+
+PUBLISH_RETRIES = int(os.getenv("RABBITMQ_PUBLISH_RETRIES", "2"))
+
+
+class ChannelPool:
+    """Long-lived RabbitMQ connections with one channel per worker thread.
+
+    pika's BlockingConnection is not thread-safe, so every thread that
+    publishes (FastAPI runs sync endpoints on a threadpool) gets its own
+    connection and channel. They are reused across requests, kept alive with
+    heartbeats and reopened transparently when the broker drops them.
+
+    A transactional pool puts its channels in tx mode, so publish_batch()
+    returns only once the broker has accepted the whole batch.
+    """
+
+    def __init__(self, connection_factory=get_rabbitmq_connection, transactional=False):
+        self._connection_factory = connection_factory
+        self.transactional = transactional
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connections = []
+
+    def _open(self):
+        connection = self._connection_factory()
+        channel = connection.channel()
+        # Declared once per connection instead of a queue_declare per publish
+        topology.declare_exchange(channel)
+        if self.transactional:
+            channel.tx_select()
+        self._local.connection = connection
+        self._local.channel = channel
+        with self._lock:
+            self._connections.append(connection)
+        return channel
+
+    def _discard(self):
+        connection = getattr(self._local, "connection", None)
+        self._local.connection = None
+        self._local.channel = None
+        if connection is None:
+            return
+        with self._lock:
+            if connection in self._connections:
+                self._connections.remove(connection)
+        try:
+            if connection.is_open:
+                connection.close()
+        except Exception:
+            pass
+
+    def channel(self):
+        """Return this thread's channel, opening a connection if needed."""
+        channel = getattr(self._local, "channel", None)
+        if channel is None or channel.is_closed or self._local.connection.is_closed:
+            self._discard()
+            return self._open()
+        # Service heartbeats and broker frames that arrived while we were idle
+        self._local.connection.process_data_events(time_limit=0)
+        return channel
+
+    def publish(self, event, body, properties=None):
+        """Publish an event to the exchange, reconnecting if the pooled connection went stale."""
+        self.publish_batch([(event, body, properties)])
+
+    def publish_batch(self, messages):
+        """Publish (event, body, properties) tuples, committed as one transaction on a transactional pool.
+
+        A batch whose commit fails is published again in full after reconnecting.
+        """
+        for attempt in range(PUBLISH_RETRIES + 1):
+            try:
+                channel = self.channel()
+                for event, body, properties in messages:
+                    channel.basic_publish(exchange=topology.EXCHANGE, routing_key=topology.routing_key(event),
+                                          body=body, properties=properties)
+                if self.transactional:
+                    channel.tx_commit()
+                return
+            except (pika.exceptions.AMQPConnectionError, pika.exceptions.AMQPChannelError):
+                self._discard()
+                if attempt == PUBLISH_RETRIES:
+                    raise
+                print(f"🔁 RabbitMQ connection lost, reconnecting (attempt {attempt + 1})...")
+
+    def close(self):
+        """Close every pooled connection (used on shutdown)."""
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for connection in connections:
+            try:
+                if connection.is_open:
+                    connection.close()
+            except Exception:
+                pass
+        self._local = threading.local()
+
+
+# Shared pool used by every producer function
+pool = ChannelPool()
+
+
+def publish(event, message):
+    """Serialize a message with the configured codec and publish it on the shared pool."""
+    body, content_type = encode(message)
+    pool.publish(event, body, properties(content_type))
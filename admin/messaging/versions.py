@@ -0,0 +1,41 @@
+import os
+import threading
+from collections import OrderedDict
+
+VERSION_MAP_SIZE = int(os.getenv("VERSION_MAP_SIZE", "100000"))
+
+
+class VersionMap:
+    """Highest applied event version per entity, kept in memory.
+
+    Lets consumers drop duplicate and out-of-order events without a database
+    round trip. Bounded with LRU eviction; an evicted or never-seen entity
+    simply falls through to the conditional UPDATE in the database.
+    """
+
+    def __init__(self, max_entries=VERSION_MAP_SIZE):
+        self.max_entries = max_entries
+        self._versions = OrderedDict()
+        self._lock = threading.Lock()
+        self.dropped = 0
+
+    def is_stale(self, key, version):
+        """True if an event with this version was already applied (or superseded)."""
+        if not version:
+            return False  # Unversioned (legacy) events are always applied
+        with self._lock:
+            known = self._versions.get(key)
+            if known is not None and version <= known:
+                self.dropped += 1
+                return True
+        return False
+
+    def record(self, key, version):
+        if not version:
+            return
+        with self._lock:
+            if version > self._versions.get(key, 0):
+                self._versions[key] = version
+            self._versions.move_to_end(key)
+            while len(self._versions) > self.max_entries:
+                self._versions.popitem(last=False)
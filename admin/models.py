@@ -1,4 +1,5 @@
-from sqlalchemy import Boolean, Column, Date, ForeignKey, Integer, String
+from datetime import datetime
+from sqlalchemy import DDL, Boolean, Column, Date, DateTime, ForeignKey, Index, Integer, LargeBinary, String, event
 from sqlalchemy.orm import relationship
 from database import Base
 
@@ -9,6 +10,8 @@ class User(Base):
     email = Column(String(255), unique=True, index=True, nullable=False)
     lastname = Column(String(255), index=True, nullable=False)
     firstname = Column(String(255), index=True, nullable=False)
+    # Bumped by the user service, which owns user records
+    version = Column(Integer, nullable=False, default=1, server_default="1")
 
     # Relationship with books (No cascade delete)
     books = relationship("Book", back_populates="user")
@@ -23,8 +26,70 @@ class Book(Base):
     available = Column(Boolean, index=True, default=True, nullable=False)
     borrow_date = Column(Date, nullable=True)
     return_date = Column(Date, nullable=True)
+    # Catalog changes are versioned by the admin service, loans by the user service
+    version = Column(Integer, nullable=False, default=1, server_default="1")
+    loan_version = Column(Integer, nullable=False, default=0, server_default="0")
+    # Last day the reminder scheduler sent a reminder for the current loan
+    reminded_on = Column(Date, nullable=True)
     
     borrower_id = Column(Integer, ForeignKey("users.id", ondelete="SET NULL"), nullable=True)
 
     # Relationship with user (borrower)
     user = relationship("User", back_populates="books")
+
+    __table_args__ = (
+        # Filtered browsing (GET /books): equality filters, then id for keyset paging
+        Index("ix_books_category_publisher_available", "category", "publisher", "available", "id"),
+        Index("ix_books_publisher_available", "publisher", "available", "id"),
+        Index("ix_books_category_available", "category", "available", "id"),
+        # Reminder scheduler: range scan over due dates, keyset-paged by (return_date, id)
+        Index("ix_books_return_date", "return_date", "id"),
+    ) + tuple(
+        # Trigram indexes serve ILIKE '%term%' and similarity search on PostgreSQL
+        Index(f"ix_books_{field}_trgm", field, postgresql_using="gin", postgresql_ops={field: "gin_trgm_ops"})
+        .ddl_if(dialect="postgresql")
+        for field in ("title", "publisher", "category")
+    )
+
+class ReportCounter(Base):
+    """Books and borrowed books overall ("all"), per category and per publisher."""
+    __tablename__ = "report_counters"
+
+    dimension = Column(String(20), primary_key=True)
+    value = Column(String(255), primary_key=True)
+    books = Column(Integer, nullable=False, default=0)
+    borrowed = Column(Integer, nullable=False, default=0)
+
+class ReportDueDate(Base):
+    """Open loans per return date; overdue = loans due before today."""
+    __tablename__ = "report_due_dates"
+
+    return_date = Column(Date, primary_key=True)
+    loans = Column(Integer, nullable=False, default=0)
+
+class ReportBorrower(Base):
+    __tablename__ = "report_borrowers"
+
+    user_id = Column(Integer, primary_key=True)
+    current_loans = Column(Integer, nullable=False, default=0, index=True)
+    total_loans = Column(Integer, nullable=False, default=0, index=True)
+
+class RowCount(Base):
+    """Exact row counts of tables that have no report counter (users)."""
+    __tablename__ = "row_counts"
+
+    table_name = Column(String(50), primary_key=True)
+    total = Column(Integer, nullable=False, default=0)
+
+# The trigram operator classes live in the pg_trgm extension
+event.listen(Book.__table__, "before_create", DDL("CREATE EXTENSION IF NOT EXISTS pg_trgm").execute_if(dialect="postgresql"))
+
+class OutboxEvent(Base):
+    """Event written in the same transaction as the change it describes."""
+    __tablename__ = "outbox"
+
+    id = Column(Integer, primary_key=True, index=True)
+    routing_key = Column(String(100), nullable=False)
+    payload = Column(LargeBinary, nullable=False)
+    content_type = Column(String(50), nullable=False, default="application/json")
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
@@ -0,0 +1,84 @@
+from datetime import datetime, timedelta
+import models
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from messaging.async_publisher import OutboundMessage, publisher
+from messaging.codec import encode
+
+
+def stage_event(db: Session, routing_key: str, message: dict, coalesce_key=None):
+    """Add an event to the outbox as part of the caller's transaction.
+
+    Nothing is committed here: the event becomes visible to the relay only
+    when the surrounding crud change commits, and disappears with it on
+    rollback. Events with a coalesce_key may be merged latest-wins by the
+    async publisher.
+    """
+    payload, content_type = encode(message)
+    outbox_event = models.OutboxEvent(routing_key=routing_key, payload=payload, content_type=content_type)
+    db.add(outbox_event)
+    db.info.setdefault("outbox_staged", []).append((outbox_event, coalesce_key))
+    return outbox_event
+
+
+@event.listens_for(Session, "before_commit")
+def _collect_staged(session):
+    staged = session.info.pop("outbox_staged", None)
+    if staged and publisher.running:
+        session.flush()
+        session.info["outbox_committing"] = [
+            (OutboundMessage(e.routing_key, e.payload, e.id, session.get_bind(), e.content_type), key)
+            for e, key in staged
+        ]
+
+
+@event.listens_for(Session, "after_commit")
+def _dispatch_committed(session):
+    """Hand committed events to the async publisher for immediate delivery.
+
+    The relay still owns anything the publisher drops or fails to send, so
+    this is purely a latency shortcut.
+    """
+    for message, coalesce_key in session.info.pop("outbox_committing", []):
+        publisher.submit(message, coalesce_key=coalesce_key)
+
+
+@event.listens_for(Session, "after_rollback")
+def _forget_staged(session):
+    session.info.pop("outbox_staged", None)
+    session.info.pop("outbox_committing", None)
+
+
+def discard_published(messages):
+    """Delete outbox rows the async publisher has delivered or superseded."""
+    by_bind = {}
+    for message in messages:
+        if message.source is not None:
+            by_bind.setdefault(message.source, []).append(message.message_id)
+    for bind, event_ids in by_bind.items():
+        with Session(bind=bind) as db:
+            delete_events(db, event_ids)
+            db.commit()
+
+
+def fetch_batch(db: Session, limit: int, min_age_seconds: float = 0):
+    """Lock the oldest pending events; concurrent relays skip locked rows.
+
+    min_age_seconds leaves fresh events to the async publisher.
+    """
+    query = db.query(models.OutboxEvent)
+    if min_age_seconds:
+        cutoff = datetime.utcnow() - timedelta(seconds=min_age_seconds)
+        query = query.filter(models.OutboxEvent.created_at <= cutoff)
+    return (
+        query.order_by(models.OutboxEvent.id)
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+        .all()
+    )
+
+
+def delete_events(db: Session, event_ids):
+    """Remove events that the broker has confirmed."""
+    if event_ids:
+        db.query(models.OutboxEvent).filter(models.OutboxEvent.id.in_(event_ids)).delete(synchronize_session=False)
@@ -1,68 +1,71 @@
-import pika
-import json
-from messaging.config import get_rabbitmq_connection
+from sqlalchemy.orm import Session
+from outbox import stage_event
 
 
-def send_book_created(book_id, title, publisher, category, available):
-    """Send a message when a new book is created."""
-    connection = get_rabbitmq_connection()
-    channel = connection.channel()
-    
-    # Declare queue for book messages
-    channel.queue_declare(queue="book_created")
-
+def send_book_created(db: Session, book_id, title, publisher, category, available, version):
+    """Queue a book_created event in the caller's transaction."""
     # Create message data
-    message = {"book_id": book_id, "title": title, "publisher": publisher, "category": category, "available": available}
-    channel.basic_publish(exchange="", routing_key="book_created", body=json.dumps(message))
+    message = {"book_id": book_id, "title": title, "publisher": publisher, "category": category, "available": available, "version": version}
+    stage_event(db, "book_created", message)
 
-    print(f"📨 Sent book_created message: {message}")
-    connection.close()
+    print(f"📨 Queued book_created message: {message}")
 
-def send_book_deleted(book_id):
-    """Send a message when a book is deleted."""
-    connection = get_rabbitmq_connection()
-    channel = connection.channel()
+def send_books_created(db: Session, books):
+    """Queue one books_created event for a chunk of bulk-imported books."""
+    stage_event(db, "books_created", {"books": books})
 
-    # Declare queue for book deleted event
-    channel.queue_declare(queue="book_deleted")
+    print(f"📨 Queued books_created message for {len(books)} books")
 
+def send_book_deleted(db: Session, book_id):
+    """Queue a book_deleted event in the caller's transaction."""
     # Create delete message
     message = {"book_id": book_id}
+    stage_event(db, "book_deleted", message)
 
-    channel.basic_publish(exchange="", routing_key="book_deleted", body=json.dumps(message))
-
-    print(f"📨 Sent book deleted message: {message}")
-    connection.close()
+    print(f"📨 Queued book deleted message: {message}")
 
-    
-def send_user_deleted(user_id):
-    """Send a message when a user is deleted."""
-    connection = get_rabbitmq_connection()
-    channel = connection.channel()
+def send_books_deleted(db: Session, book_ids):
+    """Queue one books_deleted event for a bulk delete."""
+    stage_event(db, "books_deleted", {"book_ids": book_ids})
 
-    # Declare queue for user deleted event
-    channel.queue_declare(queue="user_deleted")
+    print(f"📨 Queued books_deleted message for {len(book_ids)} books")
 
+    
+def send_user_deleted(db: Session, user_id):
+    """Queue a user_deleted event in the caller's transaction."""
     # Create delete message
     message = {"user_id": user_id}
+    stage_event(db, "user_deleted", message)
 
-    channel.basic_publish(exchange="", routing_key="user_deleted", body=json.dumps(message))
+    print(f"📨 Queued user deleted message: {message}")
 
-    print(f"📨 Sent user deleted message: {message}")
-    connection.close()
+def send_users_deleted(db: Session, user_ids):
+    """Queue one users_deleted event for a bulk delete."""
+    stage_event(db, "users_deleted", {"user_ids": user_ids})
+
+    print(f"📨 Queued users_deleted message for {len(user_ids)} users")
 
     
-def send_book_updated(book_id, title, publisher, category, available):
-    """Send a message when a new book is created."""
-    connection = get_rabbitmq_connection()
-    channel = connection.channel()
-    
-    # Declare queue for book messages
-    channel.queue_declare(queue="book_updated")
+def send_book_updated(db: Session, book_id, title, publisher, category, version):
+    """Queue a book_updated event in the caller's transaction.
 
+    Rapid successive updates of one book may be coalesced so only the latest
+    full record is sent (see ASYNC_PUBLISH_COALESCE_MS).
+    """
     # Create message data
-    message = {"book_id": book_id, "title": title, "publisher": publisher, "category": category, "available": available}
-    channel.basic_publish(exchange="", routing_key="book_updated", body=json.dumps(message))
+    message = {"book_id": book_id, "title": title, "publisher": publisher, "category": category, "version": version}
+    stage_event(db, "book_updated", message, coalesce_key=book_id)
+
+    print(f"📨 Queued book_updated message: {message}")
+
+
+def send_book_availability(db: Session, book_id, available):
+    """Queue an availability override for the user service, which owns loans.
+
+    It applies the override as a loan change and sends it back as
+    book_borrowed or book_returned with its next loan_version.
+    """
+    message = {"book_id": book_id, "available": available}
+    stage_event(db, "book_availability", message)
 
-    print(f"📨 Sent book_updated message: {message}")
-    connection.close()
\ No newline at end of file
+    print(f"📨 Queued book_availability message: {message}")
@@ -0,0 +1,197 @@
+"""Anti-entropy repair between the admin and user databases.
+
+Lost events leave the two copies of books and users silently different.
+reconcile() compares range digests of both databases (see digest.py),
+splits only the ranges that differ into RECONCILE_FANOUT slices and
+recurses until a range holds at most RECONCILE_LEAF_ROWS rows; only those
+rows are fetched and repaired. Two tables that match cost one digest
+exchange.
+
+Each side's data is repaired from its owner:
+- books exist and carry catalog fields per the admin service, so
+  differences are re-sent to the user service through the outbox as
+  book_created, book_updated (with a bumped version) or book_deleted,
+  and availability overrides not yet applied there as book_availability;
+- loans are owned by the user service: a newer loan_version there is
+  applied here with the consumer's loan appliers;
+- users are created by the user service, so missing or differing users
+  are copied here. A user only the user service has looks the same
+  whether user_created or user_deleted was lost; it is re-created here,
+  so delete it again through the API if it had been deleted.
+
+Every repair is idempotent under the version checks, so events still in
+flight while the tool runs are harmless.
+
+    python reconcile.py books|users [--dry-run]
+"""
+import json
+import os
+import sys
+from collections import Counter
+from urllib.parse import urlencode
+from urllib.request import Request, urlopen
+from sqlalchemy import update
+from sqlalchemy.orm import Session
+from database import SessionLocal
+from models import Book, User
+from messaging.events import BookLoan
+from producer import send_book_availability, send_book_created, send_book_deleted, send_book_updated
+import consumer
+import digest
+
+USER_API_URL = os.getenv("USER_API_URL", "http://localhost:8001")
+# Shared with the user service, whose /sync endpoints refuse requests without it
+SYNC_TOKEN = os.getenv("SYNC_TOKEN", "")
+RECONCILE_FANOUT = int(os.getenv("RECONCILE_FANOUT", "16"))
+RECONCILE_LEAF_ROWS = int(os.getenv("RECONCILE_LEAF_ROWS", "256"))
+
+CATALOG_FIELDS = ("title", "publisher", "category", "version")
+
+
+class LocalPeer:
+    """Digests and rows from this service's database."""
+
+    def __init__(self, db: Session):
+        self.db = db
+
+    def bounds(self, table):
+        return digest.bounds(self.db, table)
+
+    def digests(self, table, lo, hi, parts):
+        return digest.range_digests(self.db, table, lo, hi, parts)
+
+    def rows(self, table, lo, hi):
+        return digest.range_rows(self.db, table, lo, hi)
+
+
+class HttpPeer:
+    """Digests and rows from the user service's /sync endpoints."""
+
+    def __init__(self, base_url=USER_API_URL, token=SYNC_TOKEN, timeout=60):
+        self.base_url = base_url.rstrip("/")
+        self.token = token
+        self.timeout = timeout
+
+    def _get(self, path, **params):
+        request = Request(f"{self.base_url}{path}?{urlencode(params)}", headers={"X-Sync-Token": self.token})
+        with urlopen(request, timeout=self.timeout) as response:
+            return json.load(response)
+
+    def bounds(self, table):
+        return self._get(f"/sync/{table}/bounds")
+
+    def digests(self, table, lo, hi, parts):
+        return self._get(f"/sync/{table}/digests", lo=lo, hi=hi, parts=parts)
+
+    def rows(self, table, lo, hi):
+        return self._get(f"/sync/{table}/rows", lo=lo, hi=hi)
+
+
+def mismatched_ranges(local, remote, table, fanout=RECONCILE_FANOUT, leaf_rows=RECONCILE_LEAF_ROWS):
+    """The smallest id ranges whose digests differ, narrowed Merkle-style."""
+    ends = [b for b in (local.bounds(table), remote.bounds(table)) if b]
+    if not ends:
+        return []
+    pending = [(min(b["lo"] for b in ends), max(b["hi"] for b in ends))]
+    ranges = []
+    while pending:
+        lo, hi = pending.pop()
+        # Both sides slice [lo, hi) identically, so the slices pair up
+        for ours, theirs in zip(local.digests(table, lo, hi, fanout), remote.digests(table, lo, hi, fanout)):
+            if (ours["count"], ours["hash"]) == (theirs["count"], theirs["hash"]):
+                continue
+            if max(ours["count"], theirs["count"]) <= leaf_rows or ours["hi"] - ours["lo"] == 1:
+                ranges.append((ours["lo"], ours["hi"]))
+            else:
+                pending.append((ours["lo"], ours["hi"]))
+    return sorted(ranges)
+
+
+def _same(table, ours, theirs):
+    columns = [column.key for column in digest.TABLES[table]]
+    return digest.row_hash([ours[c] for c in columns]) == digest.row_hash([theirs[c] for c in columns])
+
+
+def repair_books(db: Session, ours, theirs, repaired: Counter):
+    """Bring one range of books in line. Does not commit."""
+    for book_id in sorted(ours.keys() | theirs.keys()):
+        mine, other = ours.get(book_id), theirs.get(book_id)
+        if other is None:
+            send_book_created(db, book_id, mine["title"], mine["publisher"], mine["category"], mine["available"], mine["version"])
+            repaired["books_created"] += 1
+            continue
+        if mine is None:
+            send_book_deleted(db, book_id)
+            repaired["books_deleted"] += 1
+            continue
+        if _same("books", mine, other):
+            continue
+
+        if other["loan_version"] > mine["loan_version"]:
+            loan = BookLoan.model_validate({**other, "book_id": book_id, "version": other["loan_version"]}).model_dump()
+            (consumer.apply_book_returned if loan["available"] else consumer.apply_book_borrowed)(db, loan)
+            mine = {**mine, "available": loan["available"]}
+            repaired["loans"] += 1
+        if any(mine[field] != other[field] for field in CATALOG_FIELDS):
+            # A bumped version makes the user consumer apply it whatever version it holds
+            version = db.scalar(update(Book).where(Book.id == book_id).values(version=Book.version + 1).returning(Book.version))
+            send_book_updated(db, book_id, mine["title"], mine["publisher"], mine["category"], version)
+            repaired["books_updated"] += 1
+        if mine["available"] != other["available"]:
+            send_book_availability(db, book_id, mine["available"])
+            repaired["availability"] += 1
+
+
+def repair_users(db: Session, ours, theirs, repaired: Counter):
+    """Copy users from the user service, which owns them. Does not commit."""
+    for user_id in sorted(ours.keys() | theirs.keys()):
+        mine, other = ours.get(user_id), theirs.get(user_id)
+        if other is None:
+            print(f"⚠️ User {user_id} exists only in the admin database; left as is")
+        elif mine is None:
+            consumer.apply_user_created(db, {**other, "user_id": user_id})
+            repaired["users_created"] += 1
+        elif not _same("users", mine, other):
+            db.execute(update(User).where(User.id == user_id).values(
+                firstname=other["firstname"], lastname=other["lastname"], email=other["email"], version=other["version"]))
+            repaired["users_updated"] += 1
+
+
+REPAIRS = {"books": repair_books, "users": repair_users}
+
+
+def reconcile(table, remote=None, session_factory=SessionLocal, dry_run=False,
+              fanout=RECONCILE_FANOUT, leaf_rows=RECONCILE_LEAF_ROWS):
+    """Find and repair differences in one table; returns the ranges and repair counts."""
+    remote = remote or HttpPeer()
+    db = session_factory()
+    try:
+        local = LocalPeer(db)
+        ranges = mismatched_ranges(local, remote, table, fanout, leaf_rows)
+        db.rollback()
+
+        repaired = Counter()
+        for lo, hi in ranges:
+            ours = {row["id"]: row for row in local.rows(table, lo, hi)}
+            theirs = {row["id"]: row for row in remote.rows(table, lo, hi)}
+            REPAIRS[table](db, ours, theirs, repaired)
+            # One transaction per range keeps locks short; a dry run discards the repairs
+            if dry_run:
+                db.rollback()
+            else:
+                db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+    print(f"🔁 {table}: {len(ranges)} mismatched ranges, {'would repair' if dry_run else 'repaired'} {dict(repaired)}")
+    return {"ranges": ranges, "repaired": dict(repaired)}
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    if not args or args[0] not in REPAIRS or args[1:] not in ([], ["--dry-run"]):
+        sys.exit("usage: python reconcile.py books|users [--dry-run]")
+    reconcile(args[0], dry_run=args[1:] == ["--dry-run"])
@@ -0,0 +1,141 @@
+"""Overdue and due-soon loan reminders.
+
+A run walks the open loans due within REMINDER_DUE_SOON_DAYS in
+(return_date, id) order over ix_books_return_date, REMINDER_CHUNK_SIZE
+loans at a time, so memory is bounded by the chunk and not by the number
+of loans. Each chunk is claimed with SELECT ... FOR UPDATE SKIP LOCKED,
+published as one persistent loan_reminders message and only stamped with
+reminded_on once the broker has confirmed it, so a failed or unroutable
+publish leaves the loans to the next run. Any number of schedulers can
+run side by side: a loan is claimed by exactly one of them and is not
+picked up again until REMINDER_REPEAT_DAYS have passed or the loan changes.
+
+Reminders go to the durable loan_reminders queue (CONSUMES["notifications"]
+in messaging/topology.py), which the scheduler declares so nothing is
+dropped before a notification service first connects.
+"""
+import os
+import sys
+import time
+from datetime import date, timedelta
+import pika
+from sqlalchemy import or_, select, tuple_, update
+from sqlalchemy.orm import Session
+from database import SessionLocal
+from models import Book, User
+from messaging.config import get_rabbitmq_connection
+from messaging import topology
+from messaging.codec import encode, properties
+
+REMINDER_CHUNK_SIZE = int(os.getenv("REMINDER_CHUNK_SIZE", "1000"))
+REMINDER_DUE_SOON_DAYS = int(os.getenv("REMINDER_DUE_SOON_DAYS", "2"))
+# An open loan is reminded again at most this often
+REMINDER_REPEAT_DAYS = int(os.getenv("REMINDER_REPEAT_DAYS", "3"))
+REMINDER_INTERVAL = float(os.getenv("REMINDER_INTERVAL", "3600"))
+
+
+def claim_chunk(db: Session, today: date, after=None, limit=REMINDER_CHUNK_SIZE):
+    """Lock the next loans that need a reminder, after the (return_date, id) key `after`."""
+    query = (
+        select(Book.id, Book.title, Book.return_date, Book.borrower_id, User.email, User.firstname)
+        .join(User, User.id == Book.borrower_id)
+        .where(
+            Book.available == False,
+            Book.return_date <= today + timedelta(days=REMINDER_DUE_SOON_DAYS),
+            or_(Book.reminded_on.is_(None), Book.reminded_on <= today - timedelta(days=REMINDER_REPEAT_DAYS)),
+        )
+    )
+    if after is not None:
+        # The plain >= keeps the row comparison an index range scan on every database
+        query = query.where(Book.return_date >= after[0], tuple_(Book.return_date, Book.id) > tuple_(*after))
+    return db.execute(
+        query.order_by(Book.return_date, Book.id).limit(limit).with_for_update(skip_locked=True, of=Book)
+    ).all()
+
+
+def publish_reminders(channel, loans, today: date):
+    """Publish one chunk of reminders; returns once the broker has confirmed it.
+
+    The channel is in confirm mode and the message mandatory, so pika raises
+    instead of returning when the broker nacks it or no queue is bound.
+    """
+    reminders = [
+        {"book_id": loan.id, "title": loan.title, "borrower_id": loan.borrower_id, "email": loan.email,
+         "firstname": loan.firstname, "return_date": loan.return_date,
+         "kind": "overdue" if loan.return_date < today else "due_soon"}
+        for loan in loans
+    ]
+    body, content_type = encode({"reminders": reminders})
+    channel.basic_publish(
+        exchange=topology.EXCHANGE,
+        routing_key=topology.routing_key("loan_reminders"),
+        body=body,
+        properties=properties(content_type, delivery_mode=2),
+        mandatory=True,
+    )
+
+
+def run_once(channel, today=None, session_factory=SessionLocal, chunk_size=REMINDER_CHUNK_SIZE):
+    """Remind every loan that is due for it. Returns the number of reminders sent.
+
+    A crash between the confirm and the commit sends that chunk again on the
+    next run: delivery is at-least-once.
+    """
+    today = today or date.today()
+    sent, after = 0, None
+    while True:
+        db = session_factory()
+        try:
+            loans = claim_chunk(db, today, after, chunk_size)
+            if not loans:
+                db.rollback()
+                return sent
+            publish_reminders(channel, loans, today)
+            db.execute(
+                update(Book).where(Book.id.in_([loan.id for loan in loans])).values(reminded_on=today)
+                .execution_options(synchronize_session=False)
+            )
+            db.commit()
+            sent += len(loans)
+            after = (loans[-1].return_date, loans[-1].id)
+            print(f"⏰ Sent {len(loans)} loan reminders")
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+
+def open_channel(connection):
+    """A confirm-mode channel with the reminders queue declared and bound."""
+    channel = connection.channel()
+    topology.bind_queues(channel, topology.CONSUMES["notifications"])
+    channel.confirm_delivery()
+    return channel
+
+
+def start_scheduler(interval=REMINDER_INTERVAL):
+    """Send reminders every interval seconds; safe to run on several hosts."""
+    while True:
+        try:
+            connection = get_rabbitmq_connection()
+            channel = open_channel(connection)
+            print("⏰ Reminder scheduler started...")
+            while True:
+                sent = run_once(channel)
+                print(f"📨 Sent {sent} loan reminders")
+                connection.sleep(interval)
+
+        except pika.exceptions.AMQPError as e:
+            print(f"🔴 RabbitMQ Connection Error: {e}. Retrying in 5 seconds...")
+            time.sleep(5)
+
+
+if __name__ == "__main__":
+    # `python reminders.py once` runs a single pass
+    if sys.argv[1:] == ["once"]:
+        connection = get_rabbitmq_connection()
+        print(f"⏰ Sent {run_once(open_channel(connection))} loan reminders")
+        connection.close()
+    else:
+        start_scheduler()
@@ -0,0 +1,215 @@
+"""Incrementally maintained reporting aggregates.
+
+Every write that changes a book passes (before, after) snapshots to
+record() in the same transaction, so the counters are always consistent
+with the books table and /reports/* reads a handful of rows instead of
+scanning it. Deltas are summed per transaction and upserted once, just
+before it commits, and the overall totals are spread over REPORT_SHARDS
+("all", n) rows, so concurrent writers do not all queue on one row lock.
+Run `python reports.py rebuild` to recompute them from scratch if they
+ever drift. The users total in row_counts is maintained and rebuilt here
+too.
+"""
+import os
+import random
+import sys
+from collections import defaultdict
+from datetime import date
+from sqlalchemy import case, delete, event, func, select, text, update
+from sqlalchemy.dialects import mysql, postgresql, sqlite
+from sqlalchemy.orm import Session
+from models import Book, User, ReportCounter, ReportDueDate, ReportBorrower, RowCount
+import counts
+
+# Rows per upsert statement, to stay under database parameter limits
+UPSERT_CHUNK = 500
+# Rows the overall book and loan totals are spread over; each transaction adds to a random one
+REPORT_SHARDS = int(os.getenv("REPORT_SHARDS", "16"))
+SNAPSHOT_FIELDS = ("category", "publisher", "available", "borrower_id", "return_date")
+DIALECT_INSERTS = {"postgresql": postgresql.insert, "sqlite": sqlite.insert, "mysql": mysql.insert}
+
+
+def snapshot(book):
+    """The fields of a book (ORM object or mapping) that reports depend on."""
+    if isinstance(book, Book):
+        return {field: getattr(book, field) for field in SNAPSHOT_FIELDS}
+    return {field: book.get(field) for field in SNAPSHOT_FIELDS}
+
+
+def _pending(db: Session):
+    if "report_deltas" not in db.info:
+        db.info["report_deltas"] = (
+            defaultdict(lambda: [0, 0]),  # (dimension, value) -> [books, borrowed]
+            defaultdict(int),  # return_date -> loans
+            defaultdict(lambda: [0, 0]),  # user_id -> [current_loans, total_loans]
+        )
+    return db.info["report_deltas"]
+
+
+def record(db: Session, changes):
+    """Add the counter deltas of [(before, after), ...] to the transaction; None means created/deleted."""
+    counters, due_dates, borrowers = _pending(db)
+
+    for before, after in changes:
+        for sign, state in ((-1, before), (1, after)):
+            if state is None:
+                continue
+            borrowed = not state["available"]
+            for key in (("all", ""), ("category", state["category"]), ("publisher", state["publisher"])):
+                counters[key][0] += sign
+                counters[key][1] += sign * borrowed
+            if borrowed and state["return_date"] is not None:
+                due_dates[state["return_date"]] += sign
+            if borrowed and state["borrower_id"] is not None:
+                borrowers[state["borrower_id"]][0] += sign
+        # A new loan starts when a book becomes borrowed by someone it was not borrowed by
+        if after is not None and not after["available"] and after["borrower_id"] is not None and (
+                before is None or before["available"] or before["borrower_id"] != after["borrower_id"]):
+            borrowers[after["borrower_id"]][1] += 1
+    counts.changed(db)
+
+
+@event.listens_for(Session, "before_commit")
+def _write_deltas(session):
+    pending = session.info.pop("report_deltas", None)
+    if pending is None:
+        return
+    counters, due_dates, borrowers = pending
+    if ("all", "") in counters:
+        counters[("all", str(random.randrange(REPORT_SHARDS)))] = counters.pop(("all", ""))
+    _increment(session, ReportCounter, ("dimension", "value"), ("books", "borrowed"),
+               [(*key, *deltas) for key, deltas in counters.items() if any(deltas)])
+    _increment(session, ReportDueDate, ("return_date",), ("loans",),
+               [(key, delta) for key, delta in due_dates.items() if delta])
+    _increment(session, ReportBorrower, ("user_id",), ("current_loans", "total_loans"),
+               [(key, *deltas) for key, deltas in borrowers.items() if any(deltas)])
+
+
+@event.listens_for(Session, "after_rollback")
+def _forget_deltas(session):
+    session.info.pop("report_deltas", None)
+
+
+def totals(db: Session):
+    """(books, borrowed) overall, summed over the ("all", n) shard rows."""
+    return db.execute(
+        select(func.coalesce(func.sum(ReportCounter.books), 0), func.coalesce(func.sum(ReportCounter.borrowed), 0))
+        .where(ReportCounter.dimension == "all")
+    ).one()
+
+
+def _increment(db: Session, model, keys, columns, rows):
+    """Add deltas to counter rows, creating missing ones, with multi-row upserts."""
+    if not rows:
+        return
+    rows = [dict(zip(keys + columns, row)) for row in sorted(rows)]  # fixed order avoids deadlocks
+    table = model.__table__
+    dialect = db.get_bind().dialect.name
+    for start in range(0, len(rows), UPSERT_CHUNK):
+        statement = DIALECT_INSERTS[dialect](model).values(rows[start:start + UPSERT_CHUNK])
+        if dialect == "mysql":
+            statement = statement.on_duplicate_key_update(
+                {column: table.c[column] + statement.inserted[column] for column in columns})
+        else:
+            statement = statement.on_conflict_do_update(
+                index_elements=list(keys), set_={column: table.c[column] + statement.excluded[column] for column in columns})
+        db.execute(statement)
+
+
+def count_users(db: Session, delta: int):
+    """Keep the users total for listing endpoints in step with user inserts and deletes."""
+    _increment(db, RowCount, ("table_name",), ("total",), [("users", delta)])
+    counts.changed(db)
+
+
+def forget_borrower(db: Session, user_id: int):
+    """A deleted user's books lose their borrower (ON DELETE SET NULL)."""
+    forget_borrowers(db, [user_id])
+
+
+def forget_borrowers(db: Session, user_ids):
+    db.execute(delete(ReportBorrower).where(ReportBorrower.user_id.in_(user_ids)))
+
+
+def summary(db: Session, today=None):
+    today = today or date.today()
+    books, borrowed = totals(db)
+    overdue = db.scalar(select(func.coalesce(func.sum(ReportDueDate.loans), 0)).where(ReportDueDate.return_date < today))
+    return {"books": books, "borrowed": borrowed, "available": books - borrowed, "overdue": overdue}
+
+
+def breakdown(db: Session, dimension: str):
+    rows = db.execute(
+        select(ReportCounter.value, ReportCounter.books, ReportCounter.borrowed)
+        .where(ReportCounter.dimension == dimension, ReportCounter.books > 0)
+        .order_by(ReportCounter.books.desc(), ReportCounter.value)
+    )
+    return [{dimension: value, "books": books, "borrowed": borrowed, "available": books - borrowed}
+            for value, books, borrowed in rows]
+
+
+def top_borrowers(db: Session, limit: int = 10, by: str = "total_loans"):
+    column = getattr(ReportBorrower, by)
+    rows = db.execute(
+        select(ReportBorrower.user_id, User.email, User.firstname, User.lastname,
+               ReportBorrower.current_loans, ReportBorrower.total_loans)
+        .join(User, User.id == ReportBorrower.user_id)
+        .where(column > 0)
+        .order_by(column.desc(), ReportBorrower.user_id)
+        .limit(limit)
+    )
+    return [dict(row._mapping) for row in rows]
+
+
+def rebuild(db: Session):
+    """Recompute every aggregate from the books table in one transaction.
+
+    Lifetime loan totals cannot be derived from current state, so they are
+    kept (raised to at least the current loans).
+    """
+    if db.get_bind().dialect.name == "postgresql":
+        # Hold off writers so the rebuilt counters match the snapshot they were computed from
+        db.execute(text("LOCK TABLE books IN SHARE MODE"))
+    borrowed = func.sum(case((Book.available == False, 1), else_=0))
+
+    db.execute(delete(ReportCounter))
+    counters = [("all", "", *db.execute(select(func.count(Book.id), func.coalesce(borrowed, 0))).one())]
+    for dimension, column in (("category", Book.category), ("publisher", Book.publisher)):
+        counters += [(dimension, value, books, loans)
+                     for value, books, loans in db.execute(select(column, func.count(Book.id), borrowed).group_by(column))]
+    _increment(db, ReportCounter, ("dimension", "value"), ("books", "borrowed"), counters)
+
+    db.execute(delete(ReportDueDate))
+    _increment(db, ReportDueDate, ("return_date",), ("loans",), list(db.execute(
+        select(Book.return_date, func.count(Book.id))
+        .where(Book.available == False, Book.return_date.is_not(None))
+        .group_by(Book.return_date)
+    )))
+
+    db.execute(update(ReportBorrower).values(current_loans=0))
+    _increment(db, ReportBorrower, ("user_id",), ("current_loans", "total_loans"), [
+        (user_id, loans, 0) for user_id, loans in db.execute(
+            select(Book.borrower_id, func.count(Book.id))
+            .where(Book.available == False, Book.borrower_id.is_not(None))
+            .group_by(Book.borrower_id)
+        )
+    ])
+    db.execute(update(ReportBorrower).where(ReportBorrower.total_loans < ReportBorrower.current_loans)
+               .values(total_loans=ReportBorrower.current_loans))
+
+    db.execute(delete(RowCount))
+    _increment(db, RowCount, ("table_name",), ("total",), [("users", db.scalar(select(func.count(User.id))))])
+    db.commit()
+    print(f"📊 Rebuilt report aggregates for {counters[0][2]} books")
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] != ["rebuild"]:
+        sys.exit("usage: python reports.py rebuild")
+    from database import SessionLocal
+
+    session = SessionLocal()
+    try:
+        rebuild(session)
+    finally:
+        session.close()
@@ -46,6 +46,25 @@ class User(UserBase):
     id: int
     books: List[Book] = []
 
+# One page of a cursor-paginated listing; pass next_cursor back as ?cursor=
+class BookPage(BaseModel):
+    items: List[Book1]
+    next_cursor: Optional[str] = None
+
+class UserPage(BaseModel):
+    items: List[User]
+    next_cursor: Optional[str] = None
+
+# Bulk delete: ids and/or exact-match filters, combined with AND
+class BookBulkDelete(BaseModel):
+    ids: Optional[List[int]] = None
+    category: Optional[str] = None
+    publisher: Optional[str] = None
+    available: Optional[bool] = None
+
+class UserBulkDelete(BaseModel):
+    ids: List[int]
+
 class BookUpdate(BaseModel):
     title: Optional[str] = None
     publisher: Optional[str] = None
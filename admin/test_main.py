@@ -4,21 +4,31 @@ import pytest
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.pool import StaticPool
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from fastapi.testclient import TestClient
 
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
-from database import Base, get_db
+from database import Base, get_db, get_async_db
 from main import app
 import schema
+import models
+import json
+from messaging.codec import decode_event, properties
 
-SQLALCHEMY_DATABASE_URL = "sqlite:///"
+# Shared-cache in-memory database so the sync and async (aiosqlite) engines see the same data
+SQLALCHEMY_DATABASE_URL = "sqlite:///file:admin_test?mode=memory&cache=shared&uri=true"
 engine = create_engine(
     SQLALCHEMY_DATABASE_URL,
     connect_args={"check_same_thread": False},
     poolclass=StaticPool,
 )
 TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+async_engine = create_async_engine(
+    "sqlite+aiosqlite:///file:admin_test?mode=memory&cache=shared&uri=true",
+    poolclass=StaticPool,
+)
+TestingAsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
 
 Base.metadata.create_all(bind=engine)
 
@@ -31,6 +41,12 @@ def override_get_db():
 
 app.dependency_overrides[get_db] = override_get_db
 
+async def override_get_async_db():
+    async with TestingAsyncSessionLocal() as db:
+        yield db
+
+app.dependency_overrides[get_async_db] = override_get_async_db
+
 @pytest.fixture(scope="module")
 def client():
     with TestClient(app) as c:
@@ -49,6 +65,17 @@ def test_create_book(client, setup_database):
     assert response.status_code == 200
     assert response.json()["message"] == "Book added successfully"
 
+def test_create_book_writes_outbox_event(client, setup_database):
+    client.post("/books/", json={"title": "Book A", "publisher": "Pub A", "category": "Fiction", "available": True})
+    db = TestingSessionLocal()
+    try:
+        events = db.query(models.OutboxEvent).all()
+        assert [e.routing_key for e in events] == ["book_created"]
+        event = decode_event("book_created", properties(events[0].content_type), events[0].payload)
+        assert event.title == "Book A"
+    finally:
+        db.close()
+
 def test_get_books(client, setup_database):
     books = [
         {"title": "Book One", "publisher": "Pub A", "category": "Fiction", "available": True},
@@ -87,6 +114,22 @@ def test_update_book(client, setup_database):
     assert response.status_code == 200
     assert response.json()["message"] == "success"
 
+def test_catalog_edits_and_availability_overrides_are_separate_events(client, setup_database):
+    client.post("/books/", json={"title": "Book A", "publisher": "Pub A", "category": "Fiction"})
+    client.put("/books/1", json={"title": "Edited", "publisher": "Pub A", "category": "Fiction"})
+    client.patch("/books/1/availability", json={"available": False})
+
+    db = TestingSessionLocal()
+    try:
+        events = {e.routing_key: decode_event(e.routing_key, properties(e.content_type), e.payload).model_dump()
+                  for e in db.query(models.OutboxEvent)}
+        # Availability is loan state: it never rides on a catalog edit
+        assert events["book_updated"] == {"book_id": 1, "title": "Edited", "publisher": "Pub A", "category": "Fiction", "version": 2}
+        assert events["book_availability"] == {"book_id": 1, "available": False}
+        assert db.get(models.Book, 1).version == 2
+    finally:
+        db.close()
+
 def test_delete_book(client, setup_database):
     client.post("/books/", json={"title": "Book A", "publisher": "Pub A", "category": "Fiction", "available": True})
     response = client.delete("/books/1/delete")
@@ -105,3 +148,635 @@ def test_get_root(client):
     response = client.get("/")
     assert response.status_code == 200
     assert response.json() == {"Hello": "Welcome to the Admin end of the Library API"}
+
+class FakeChannel:
+    def __init__(self, fail=False):
+        self.is_closed = False
+        self.fail = fail
+        self.published = []
+        self.committed = None
+
+    def exchange_declare(self, exchange, exchange_type, durable):
+        pass
+
+    def tx_select(self):
+        self.committed = 0
+
+    def tx_commit(self):
+        self.committed = len(self.published)
+
+    def basic_publish(self, exchange, routing_key, body, properties=None):
+        if self.fail:
+            import pika
+            raise pika.exceptions.StreamLostError("connection dropped")
+        self.published.append((routing_key, body))
+
+class FakeConnection:
+    def __init__(self, channel):
+        self._channel = channel
+        self.is_open = True
+        self.is_closed = False
+
+    def channel(self):
+        return self._channel
+
+    def process_data_events(self, time_limit=0):
+        pass
+
+    def close(self):
+        self.is_open, self.is_closed = False, True
+
+def test_channel_pool_reuses_and_reconnects():
+    from messaging.publisher import ChannelPool
+    channels = [FakeChannel(), FakeChannel(fail=True), FakeChannel()]
+    opened = []
+
+    def factory():
+        opened.append(channels[len(opened)])
+        return FakeConnection(opened[-1])
+
+    pool = ChannelPool(connection_factory=factory)
+    pool.publish("book_created", "{}")
+    pool.publish("book_created", "{}")
+    assert len(opened) == 1 and len(channels[0].published) == 2
+
+    # A dropped connection is replaced and the publish retried
+    channels[0].is_closed = True
+    pool.publish("book_created", "{}")
+    assert len(opened) == 3 and len(channels[2].published) == 1
+    pool.close()
+
+    # A transactional pool commits each batch once the broker has all of it
+    channel = FakeChannel()
+    pool = ChannelPool(connection_factory=lambda: FakeConnection(channel), transactional=True)
+    pool.publish_batch([("book_created", "{}", None), ("book_updated", "{}", None)])
+    assert channel.committed == 2
+    pool.close()
+
+def test_async_publisher_hands_failures_to_the_relay():
+    import asyncio
+    from messaging.async_publisher import AsyncPublisher, OutboundMessage
+
+    class RecordingPool:
+        def __init__(self):
+            self.sent = []
+            self.down = False
+
+        def publish_batch(self, messages):
+            if self.down:
+                raise ConnectionError("broker down")
+            self.sent.extend(routing_key for routing_key, body, properties in messages)
+
+        def close(self):
+            pass
+
+    async def scenario():
+        pool = RecordingPool()
+        published = []
+        pub = AsyncPublisher(pool=pool, maxsize=10, handoff_seconds=0.2)
+        await pub.start(on_published=published.extend)
+
+        pool.down = True
+        assert pub.submit(OutboundMessage("book_created", b"{}", 1, "db"))
+        await asyncio.sleep(0.05)
+        assert pub.stats["left_to_relay"] == 1 and pool.sent == []
+
+        # The relay owns the failed create, so a newer delete must not overtake it on the fast path
+        pool.down = False
+        assert not pub.submit(OutboundMessage("book_deleted", b"{}", 2, "db"))
+        await asyncio.sleep(0.25)
+        assert pub.submit(OutboundMessage("book_updated", b"{}", 3, "db"))
+        await pub.stop()
+        assert pool.sent == ["book_updated"]
+        assert len(published) == 1
+
+    asyncio.run(scenario())
+
+class FakeAckChannel:
+    def __init__(self):
+        self.acked = []
+        self.nacked = []
+
+    def basic_ack(self, delivery_tag, multiple=False):
+        self.acked.append((delivery_tag, multiple))
+
+    def basic_nack(self, delivery_tag, requeue=True):
+        self.nacked.append(delivery_tag)
+
+class FakeMethod:
+    def __init__(self, routing_key, delivery_tag):
+        self.routing_key = routing_key
+        self.delivery_tag = delivery_tag
+
+def test_batch_consumer_applies_in_one_transaction_and_acks(setup_database, monkeypatch):
+    import consumer
+    monkeypatch.setattr(consumer, "SessionLocal", TestingSessionLocal)
+    db = TestingSessionLocal()
+    db.add(models.Book(id=1, title="Book A", publisher="Pub A", category="Fiction", available=True))
+    db.commit()
+    db.close()
+
+    channel = FakeAckChannel()
+    batcher = consumer.BatchConsumer(channel, batch_size=3, batch_wait_ms=1000)
+    messages = [
+        ("user_created", {"user_id": 7, "firstname": "Jane", "lastname": "Doe", "email": "jane@example.com"}),
+        ("book_borrowed", {"book_id": 1, "available": False, "borrower_id": 7, "borrow_date": "2026-01-01", "return_date": "2026-01-08"}),
+        ("book_returned", {"book_id": 1, "available": True, "borrower_id": None, "borrow_date": None, "return_date": None}),
+    ]
+    for tag, (queue, data) in enumerate(messages, start=1):
+        batcher.on_message(channel, FakeMethod(queue, tag), None, json.dumps(data))
+
+    assert channel.acked == [(3, True)]
+    db = TestingSessionLocal()
+    try:
+        assert db.get(models.User, 7).email == "jane@example.com"
+        book = db.get(models.Book, 1)
+        assert book.available and book.borrower_id is None
+    finally:
+        db.close()
+
+class RetryChannel(FakeAckChannel):
+    def __init__(self):
+        super().__init__()
+        self.queues = {}
+
+    def basic_publish(self, exchange, routing_key, body, properties=None, mandatory=False):
+        assert mandatory and properties.delivery_mode == 2
+        self.queues.setdefault(routing_key, []).append((properties, body))
+
+    def basic_get(self, queue, auto_ack=False):
+        if not self.queues.get(queue):
+            return None, None, None
+        properties, body = self.queues[queue].pop(0)
+        return FakeMethod(queue, len(self.acked) + 100), properties, body
+
+def test_failed_messages_back_off_then_dead_letter_and_replay(monkeypatch):
+    import consumer
+    from messaging import retry
+    monkeypatch.setattr(consumer, "apply_message", lambda queue, data: False)
+    monkeypatch.setattr(retry, "RETRY_MAX_ATTEMPTS", 2)
+    assert [retry.retry_delay_ms(n) for n in (1, 2, 3)] == [1000, 2000, 4000]
+
+    channel = RetryChannel()
+    body = json.dumps({"user_id": 7, "firstname": "Jane", "lastname": "Doe", "email": "jane@example.com"})
+    consumer.process_user_created(channel, FakeMethod("user.created", 1), None, body)
+    assert channel.acked == [(1, False)]
+    properties, body = channel.queues.pop("user_created.retry.1000ms")[0]
+    assert properties.headers["x-retry-attempt"] == 1
+
+    # Back from the retry queue the routing key is the queue name; the header names the event
+    method = FakeMethod("user_created", 2)
+    assert retry.event_name(method, properties) == "user_created"
+    consumer.process_user_created(channel, method, properties, body)
+    properties, body = channel.queues.pop("user_created.retry.2000ms")[0]
+    consumer.process_user_created(channel, FakeMethod("user_created", 3), properties, body)
+    assert list(channel.queues) == ["user_created.dead"]
+    assert len(channel.acked) == 3
+
+    assert retry.replay(channel, "user_created") == 1
+    properties, _ = channel.queues["user_created"][0]
+    assert "x-retry-attempt" not in properties.headers and properties.headers["x-event"] == "user_created"
+
+def test_undecodable_message_is_dead_lettered():
+    import consumer
+    channel = RetryChannel()
+    consumer.process_book_borrowed(channel, FakeMethod("book.borrowed", 1), None, b"not json")
+    assert channel.acked == [(1, False)]
+    properties, _ = channel.queues["book_borrowed.dead"][0]
+    assert properties.headers["x-last-failure"] == "undecodable"
+
+def test_worker_pool_keeps_per_entity_order():
+    import threading
+    from messaging.workers import PartitionedWorkerPool
+
+    applied = {}
+    lock = threading.Lock()
+
+    def handler(item):
+        key, seq = item
+        with lock:
+            applied.setdefault(key, []).append(seq)
+        return True
+
+    done = []
+    pool = PartitionedWorkerPool(4, handler)
+    pool.start()
+    for seq in range(50):
+        for key in range(8):
+            pool.submit(("book", key), (key, seq), done.append)
+    pool.stop()
+
+    assert len(done) == 400 and all(done)
+    assert all(seqs == list(range(50)) for seqs in applied.values())
+    report = pool.report()
+    assert sum(row["processed"] for row in report) == 400
+
+def test_codec_round_trips_and_validates():
+    from datetime import date
+    from messaging.codec import encode, JSON, MSGPACK
+
+    message = {"book_id": 1, "available": False, "borrower_id": 7, "borrow_date": date(2026, 1, 1), "return_date": date(2026, 1, 8)}
+    packed, content_type = encode(message, MSGPACK)
+    as_json, _ = encode(message, JSON)
+    assert len(packed) < len(as_json)
+    for body, ct in [(packed, content_type), (as_json, JSON)]:
+        event = decode_event("book_borrowed", properties(ct), body)
+        assert event.return_date == date(2026, 1, 8)
+
+    # Legacy messages without properties are JSON; missing keys fail validation
+    assert decode_event("book_borrowed", None, b'{"book_id": 1}') is None
+
+def test_async_publisher_coalesces_latest_update():
+    import asyncio
+    from messaging.async_publisher import AsyncPublisher, OutboundMessage
+
+    class RecordingPool:
+        sent = []
+
+        def publish_batch(self, messages):
+            self.sent.extend(body for routing_key, body, properties in messages)
+
+        def close(self):
+            pass
+
+    async def scenario():
+        pool = RecordingPool()
+        superseded = []
+        pub = AsyncPublisher(pool=pool, coalesce_window_ms=50)
+        await pub.start(on_superseded=superseded.extend)
+        for version in range(5):
+            pub.submit(OutboundMessage("book_updated", b"book-1-v%d" % version, version), coalesce_key=1)
+        pub.submit(OutboundMessage("book_updated", b"book-2-v0", 10), coalesce_key=2)
+        await asyncio.sleep(0.2)
+        await pub.stop()
+        assert sorted(pool.sent) == [b"book-1-v4", b"book-2-v0"]
+        assert pub.stats["coalesced"] == 4
+        assert sorted(m.message_id for m in superseded) == [0, 1, 2, 3]
+
+    asyncio.run(scenario())
+
+def test_publisher_metrics(client):
+    response = client.get("/metrics/publisher")
+    assert response.status_code == 200
+    assert "coalesced" in response.json()
+
+def test_topology_routes_events_through_one_exchange():
+    from messaging import topology
+
+    class BindingChannel:
+        def __init__(self):
+            self.bindings = []
+
+        def exchange_declare(self, exchange, exchange_type, durable):
+            assert exchange_type == "topic"
+
+        def queue_declare(self, queue, durable):
+            pass
+
+        def queue_bind(self, queue, exchange, routing_key):
+            self.bindings.append((queue, routing_key))
+
+    channel = BindingChannel()
+    topology.bind_queues(channel, topology.CONSUMES["admin"])
+    assert ("book_borrowed", "book.borrowed") in channel.bindings
+    assert topology.event_name(topology.routing_key("book_updated")) == "book_updated"
+    # Every event has a queue bound for it (cache invalidations use per-process queues)
+    consumed = {event for events in topology.CONSUMES.values() for event in events}
+    assert set(topology.ROUTING_KEYS) - consumed == {"books_invalidated"}
+
+def test_bulk_import_csv_and_ndjson(client, setup_database):
+    csv_body = "title,publisher,category\nBook A,Pub A,Fiction\nBook B,Pub B,Science\n"
+    response = client.post("/books/bulk", content=csv_body, headers={"Content-Type": "text/csv"})
+    assert response.status_code == 200
+    assert response.json()["ids"] == [1, 2]
+
+    ndjson_body = '{"title": "Book C", "publisher": "Pub C", "category": "Art"}\n'
+    response = client.post("/books/bulk", content=ndjson_body, headers={"Content-Type": "application/x-ndjson"})
+    assert response.json()["ids"] == [3]
+
+    db = TestingSessionLocal()
+    try:
+        events = db.query(models.OutboxEvent).filter(models.OutboxEvent.routing_key == "books_created").all()
+        event = decode_event("books_created", properties(events[0].content_type), events[0].payload)
+        assert [book.title for book in event.books] == ["Book A", "Book B"]
+    finally:
+        db.close()
+
+def test_bulk_import_reports_bad_line(client, setup_database):
+    response = client.post("/books/bulk", content='{"title": "Book A"}\n', headers={"Content-Type": "application/x-ndjson"})
+    assert response.status_code == 422
+    assert response.json()["detail"]["line"] == 1
+    body = b"title,publisher,category\nBook A,Pub A,Fiction\nCaf\xe9,Pub B,Food\n"
+    response = client.post("/books/bulk", content=body, headers={"Content-Type": "text/csv"})
+    assert (response.status_code, response.json()["detail"]["line"]) == (422, 3)
+
+def test_search_books_ranks_title_matches_first(client, setup_database):
+    client.post("/books/", json={"title": "Gardening Basics", "publisher": "Dune Press", "category": "Home"})
+    client.post("/books/", json={"title": "Dune", "publisher": "Ace", "category": "Fiction"})
+    client.post("/books/", json={"title": "Cooking", "publisher": "Ace", "category": "Food"})
+    response = client.get("/books/search", params={"q": "dune"})
+    assert response.status_code == 200
+    assert [b["title"] for b in response.json()] == ["Dune", "Gardening Basics"]
+    assert client.get("/books/search", params={"q": ""}).status_code == 422
+
+def test_cursor_pagination_is_stable_under_inserts(client, setup_database):
+    for i in range(5):
+        client.post("/books/", json={"title": f"Book {i}", "publisher": "Pub", "category": "Cat"})
+
+    page = client.get("/books/", params={"cursor": "", "limit": 2}).json()
+    assert [b["title"] for b in page["items"]] == ["Book 0", "Book 1"]
+    # A concurrent insert does not shift or repeat rows on later pages
+    client.post("/books/", json={"title": "Book 5", "publisher": "Pub", "category": "Cat"})
+    titles = []
+    while page["next_cursor"]:
+        page = client.get("/books/", params={"cursor": page["next_cursor"], "limit": 2}).json()
+        titles += [b["title"] for b in page["items"]]
+    assert titles == ["Book 2", "Book 3", "Book 4", "Book 5"]
+
+    assert client.get("/users/", params={"cursor": ""}).json() == {"items": [], "next_cursor": None}
+    assert client.get("/borrowed/books/", params={"cursor": "nonsense"}).status_code == 400
+    # Without a cursor the listing is unchanged
+    assert isinstance(client.get("/books/").json(), list)
+
+def test_filter_books_combines_filters_with_counts(client, setup_database):
+    for title, publisher, category in [("A", "Ace", "Fiction"), ("B", "Ace", "Fiction"), ("C", "Ace", "History"),
+                                       ("D", "Tor", "Fiction"), ("E", "Ace", "Fiction")]:
+        client.post("/books/", json={"title": title, "publisher": publisher, "category": category})
+    client.patch("/books/2/availability", json={"available": False})
+
+    response = client.get("/books/filter", params={"category": "Fiction", "publisher": "Ace", "limit": 1, "total": "exact"})
+    page = response.json()
+    assert (response.headers["X-Total-Count"], [b["title"] for b in page["items"]]) == ("3", ["A"])
+    response = client.get("/books/filter", params={"category": "Fiction", "publisher": "Ace", "available": True,
+                                                   "cursor": page["next_cursor"], "limit": 5, "total": "exact"})
+    page = response.json()
+    assert (response.headers["X-Total-Count"], [b["title"] for b in page["items"]], page["next_cursor"]) == ("2", ["E"], None)
+    assert client.get("/books/filter", params={"publisher": "Tor", "total": "exact"}).headers["X-Total-Count"] == "1"
+    # Like the other listings, the total is only counted on request
+    assert "X-Total-Count" not in client.get("/books/filter", params={"publisher": "Tor"}).headers
+
+def test_fast_list_path_matches_pydantic_output(client, setup_database):
+    from datetime import date
+    db = TestingSessionLocal()
+    db.add(models.User(id=1, email="jane@example.com", firstname="Jane", lastname="Doe"))
+    db.add_all([
+        models.Book(id=1, title="Dune", publisher="Ace", category="Fiction", available=False, borrower_id=1,
+                    borrow_date=date(2025, 1, 1), return_date=date(2025, 1, 8)),
+        models.Book(id=2, title="Emma", publisher="Ace", category="Fiction", available=True),
+    ])
+    db.commit()
+    try:
+        books = db.query(models.Book).order_by(models.Book.id).all()
+        expected = [schema.Book1.model_validate(b, from_attributes=True).model_dump(mode="json") for b in books]
+        assert client.get("/books/").json() == expected
+        assert client.get("/borrowed/books/").json() == expected[:1]
+        assert client.get("/books/", params={"cursor": ""}).json()["items"] == expected
+        assert client.get("/borrowed/books/", params={"cursor": ""}).json()["items"] == expected[:1]
+        assert client.get("/books/title/dune/").json() == [schema.Book.model_validate(books[0]).model_dump(mode="json")]
+    finally:
+        db.close()
+    # The documented response shape is unchanged
+    response = app.openapi()["paths"]["/books/title/{title}/"]["get"]["responses"]["200"]
+    assert response["content"]["application/json"]["schema"]["items"] == {"$ref": "#/components/schemas/Book"}
+
+def test_reports_follow_writes_and_match_rebuild(client, setup_database, monkeypatch):
+    from datetime import date, timedelta
+    import consumer
+    import reports
+    monkeypatch.setattr(consumer, "SessionLocal", TestingSessionLocal)
+    monkeypatch.setattr(consumer, "versions", consumer.VersionMap())
+    for title, publisher, category in [("A", "Ace", "Fiction"), ("B", "Ace", "History"), ("C", "Tor", "Fiction")]:
+        client.post("/books/", json={"title": title, "publisher": publisher, "category": category})
+    for user_id in (1, 2):
+        consumer.apply_message("user_created", {"user_id": user_id, "firstname": "U", "lastname": str(user_id),
+                                                "email": f"u{user_id}@example.com", "version": 1})
+
+    def loan(book_id, borrower_id, return_date, version):
+        available = borrower_id is None
+        consumer.apply_message("book_returned" if available else "book_borrowed", {
+            "book_id": book_id, "available": available, "borrower_id": borrower_id,
+            "borrow_date": None if available else date.today() - timedelta(days=10),
+            "return_date": return_date, "version": version})
+
+    loan(1, 1, date.today() - timedelta(days=1), 1)  # overdue
+    loan(2, 1, date.today() + timedelta(days=5), 1)
+    loan(2, None, None, 2)
+    loan(3, 2, date.today() + timedelta(days=5), 1)
+    loan(2, 2, date.today() - timedelta(days=5), 1)  # stale: matches no row and leaves the counters alone
+    assert client.get("/reports/summary").json() == {"books": 3, "borrowed": 2, "available": 1, "overdue": 1}
+    client.put("/books/3", json={"category": "History"})
+    client.delete("/books/1/delete")
+
+    summary = client.get("/reports/summary").json()
+    assert summary == {"books": 2, "borrowed": 1, "available": 1, "overdue": 0}
+    assert client.get("/reports/categories").json() == [{"category": "History", "books": 2, "borrowed": 1, "available": 1}]
+    assert [p["publisher"] for p in client.get("/reports/publishers").json()] == ["Ace", "Tor"]
+    top = client.get("/reports/top-borrowers").json()
+    assert [(b["user_id"], b["current_loans"], b["total_loans"]) for b in top] == [(1, 0, 2), (2, 1, 1)]
+
+    # A rebuild from the books table lands on the same numbers
+    db = TestingSessionLocal()
+    try:
+        assert db.query(models.ReportCounter).filter(models.ReportCounter.dimension == "all").count() > 1
+        reports.rebuild(db)
+        assert reports.summary(db) == summary
+        assert reports.top_borrowers(db) == top
+    finally:
+        db.close()
+
+def test_reminders_are_chunked_and_sent_once_per_window(setup_database):
+    from datetime import date, timedelta
+    import pika
+    import reminders
+
+    class ConfirmChannel:
+        def __init__(self):
+            self.published, self.unroutable = [], False
+
+        def basic_publish(self, exchange, routing_key, body, properties, mandatory=False):
+            assert mandatory and properties.delivery_mode == 2
+            if self.unroutable:
+                raise pika.exceptions.UnroutableError([])
+            self.published.append((routing_key, decode_event("loan_reminders", properties, body)))
+
+    today = date(2026, 10, 18)
+    db = TestingSessionLocal()
+    db.add_all([models.User(id=1, firstname="Ann", lastname="A", email="ann@example.com"),
+                models.User(id=2, firstname="Bob", lastname="B", email="bob@example.com")])
+    for book_id, borrower_id, due in [(1, 1, -3), (2, 1, 1), (3, 2, 10), (4, None, None), (5, 2, -1)]:
+        db.add(models.Book(id=book_id, title=f"Book {book_id}", publisher="P", category="C",
+                           available=borrower_id is None, borrower_id=borrower_id,
+                           return_date=today + timedelta(days=due) if due is not None else None))
+    db.commit()
+    db.close()
+
+    # A publish that is not confirmed leaves the loans unstamped for the next run
+    channel = ConfirmChannel()
+    channel.unroutable = True
+    with pytest.raises(pika.exceptions.UnroutableError):
+        reminders.run_once(channel, today, TestingSessionLocal)
+    channel.unroutable = False
+
+    assert reminders.run_once(channel, today, TestingSessionLocal, chunk_size=2) == 3
+    assert len(channel.published) == 2  # one message per chunk
+    sent = [(r.book_id, r.kind, r.email) for key, event in channel.published for r in event.reminders]
+    assert sent == [(1, "overdue", "ann@example.com"), (5, "overdue", "bob@example.com"), (2, "due_soon", "ann@example.com")]
+    assert {key for key, event in channel.published} == {"loan.reminders"}
+
+    # Nothing is sent twice within the repeat window; afterwards open loans are reminded again
+    assert reminders.run_once(channel, today + timedelta(days=1), TestingSessionLocal) == 0
+    assert reminders.run_once(channel, today + timedelta(days=reminders.REMINDER_REPEAT_DAYS), TestingSessionLocal) == 3
+    db = TestingSessionLocal()
+    try:
+        assert db.get(models.Book, 3).reminded_on is None
+    finally:
+        db.close()
+
+def test_listing_totals_follow_counters_and_count_cache(client, setup_database, monkeypatch):
+    import consumer
+    import counts
+    monkeypatch.setattr(consumer, "SessionLocal", TestingSessionLocal)
+    monkeypatch.setattr(consumer, "versions", consumer.VersionMap())
+    for title, category in [("A", "Fiction"), ("B", "Fiction"), ("C", "History")]:
+        client.post("/books/", json={"title": title, "publisher": "Ace", "category": category})
+    for user_id in (1, 2):
+        consumer.apply_message("user_created", {"user_id": user_id, "firstname": "U", "lastname": str(user_id),
+                                                "email": f"u{user_id}@example.com", "version": 1})
+    client.patch("/books/1/availability", json={"available": False})
+
+    assert "X-Total-Count" not in client.get("/books/").headers
+    assert client.get("/books/", params={"total": "exact"}).headers["X-Total-Count"] == "3"
+    assert client.get("/borrowed/books/", params={"total": "exact"}).headers["X-Total-Count"] == "1"
+    assert client.get("/users/", params={"total": "exact", "cursor": ""}).headers["X-Total-Count"] == "2"
+    assert client.get("/users/", params={"total": "guess"}).status_code == 422
+    client.delete("/users/2/delete")
+    # SQLite has no planner estimates, so approximate falls back to the counters
+    assert client.get("/users/", params={"total": "approximate"}).headers["X-Total-Count"] == "1"
+
+    # Filtered totals are cached until the TTL or a local commit that changes counts
+    assert client.get("/books/filter", params={"category": "Fiction", "total": "exact"}).headers["X-Total-Count"] == "2"
+    db = TestingSessionLocal()
+    db.add(models.Book(title="D", publisher="Ace", category="Fiction"))  # bypasses crud and the counters
+    db.commit()
+    db.close()
+    assert client.get("/books/filter", params={"category": "Fiction", "total": "exact"}).headers["X-Total-Count"] == "2"
+    monkeypatch.setattr(counts, "COUNT_CACHE_TTL", 0)
+    counts.clear()
+    assert client.get("/books/filter", params={"category": "Fiction", "total": "exact"}).headers["X-Total-Count"] == "3"
+
+def test_bulk_delete_books_and_users_publish_one_event(client, setup_database, monkeypatch):
+    import consumer
+    import crud
+    monkeypatch.setattr(consumer, "SessionLocal", TestingSessionLocal)
+    monkeypatch.setattr(consumer, "versions", consumer.VersionMap())
+    monkeypatch.setattr(crud, "BULK_DELETE_CHUNK", 2)
+    for title, category in [("A", "Weeded"), ("B", "Weeded"), ("C", "Fiction"), ("D", "Weeded"), ("E", "Fiction")]:
+        client.post("/books/", json={"title": title, "publisher": "Ace", "category": category})
+    for user_id in (1, 2, 3):
+        consumer.apply_message("user_created", {"user_id": user_id, "firstname": "U", "lastname": str(user_id),
+                                                "email": f"u{user_id}@example.com", "version": 1})
+    consumer.apply_message("book_borrowed", {"book_id": 5, "available": False, "borrower_id": 2,
+                                             "borrow_date": None, "return_date": None, "version": 1})
+    db = TestingSessionLocal()
+    db.query(models.OutboxEvent).delete()
+    db.commit()
+    db.close()
+
+    assert client.post("/books/bulk-delete", json={}).status_code == 400
+    response = client.post("/books/bulk-delete", json={"category": "Weeded", "ids": [1, 2, 3, 42]})
+    assert (response.json()["count"], response.json()["ids"]) == (2, [1, 2])
+    assert client.post("/books/bulk-delete", json={"category": "Weeded"}).json()["ids"] == [4]
+    assert client.post("/users/bulk-delete", json={"ids": [2, 3, 7]}).json()["ids"] == [2, 3]
+
+    db = TestingSessionLocal()
+    try:
+        events = [(e.routing_key, decode_event(e.routing_key, properties(e.content_type), e.payload).model_dump())
+                  for e in db.query(models.OutboxEvent).order_by(models.OutboxEvent.id)]
+        assert events == [("books_deleted", {"book_ids": [1, 2]}), ("books_deleted", {"book_ids": [4]}),
+                          ("users_deleted", {"user_ids": [2, 3]})]
+        assert db.get(models.Book, 5).borrower_id is None
+    finally:
+        db.close()
+    assert client.get("/reports/summary").json()["books"] == 2
+    assert client.get("/users/", params={"total": "exact"}).headers["X-Total-Count"] == "1"
+
+def test_reconcile_narrows_to_mismatched_ranges_and_repairs(setup_database):
+    from datetime import date
+    from sqlalchemy import insert
+    import consumer
+    import reconcile
+
+    # The "user service": a second database with the same replicated columns
+    replica_engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(bind=replica_engine)
+    ReplicaSession = sessionmaker(bind=replica_engine)
+    books = [{"id": i, "title": f"Book {i}", "publisher": "Pub", "category": "Fiction", "available": True, "version": 1}
+             for i in range(1, 1001)]
+    users = [{"id": i, "firstname": "U", "lastname": str(i), "email": f"u{i}@example.com", "version": 1} for i in (1, 2)]
+    for session_factory in (TestingSessionLocal, ReplicaSession):
+        db = session_factory()
+        db.execute(insert(models.Book), books)
+        db.execute(insert(models.User), users)
+        db.commit()
+        db.close()
+
+    db = TestingSessionLocal()
+    db.query(models.Book).filter(models.Book.id == 20).delete()  # deleted here, delete event lost
+    db.query(models.User).filter(models.User.id == 2).delete()  # user_created never arrived
+    db.commit()
+    db.close()
+    replica = ReplicaSession()
+    replica.query(models.Book).filter(models.Book.id == 10).delete()  # book_created lost
+    replica.query(models.Book).filter(models.Book.id == 300).update({"title": "Stale title"})
+    replica.query(models.Book).filter(models.Book.id == 700).update(
+        {"available": False, "borrower_id": 1, "return_date": date(2026, 11, 1), "loan_version": 1})  # borrow event lost
+    replica.commit()
+
+    remote = reconcile.LocalPeer(replica)
+    ranges = reconcile.mismatched_ranges(reconcile.LocalPeer(TestingSessionLocal()), remote, "books", fanout=4, leaf_rows=20)
+    assert len(ranges) == 4 and sum(hi - lo for lo, hi in ranges) < 100
+    assert reconcile.reconcile("books", remote, TestingSessionLocal, dry_run=True, fanout=4, leaf_rows=20)["ranges"] == ranges
+
+    result = reconcile.reconcile("books", remote, TestingSessionLocal, fanout=4, leaf_rows=20)
+    assert result["repaired"] == {"books_created": 1, "books_deleted": 1, "books_updated": 1, "loans": 1}
+    assert reconcile.reconcile("users", remote, TestingSessionLocal)["repaired"] == {"users_created": 1}
+
+    db = TestingSessionLocal()
+    try:
+        events = [(e.routing_key, decode_event(e.routing_key, properties(e.content_type), e.payload).model_dump())
+                  for e in db.query(models.OutboxEvent).order_by(models.OutboxEvent.id)]
+        assert [(key, data["book_id"]) for key, data in events] == [("book_created", 10), ("book_deleted", 20), ("book_updated", 300)]
+        assert (events[2][1]["title"], events[2][1]["version"]) == ("Book 300", 2)
+        assert (db.get(models.Book, 700).borrower_id, db.get(models.User, 2).email) == (1, "u2@example.com")
+        # Once the user service applies the re-sent events, loans and users already match
+        for key, data in events:
+            consumer_db = ReplicaSession()
+            if key == "book_created":
+                consumer_db.add(models.Book(id=10, title="Book 10", publisher="Pub", category="Fiction", version=1))
+            elif key == "book_deleted":
+                consumer_db.query(models.Book).filter(models.Book.id == 20).delete()
+            else:
+                consumer_db.query(models.Book).filter(models.Book.id == 300).update({"title": data["title"], "version": 2})
+            consumer_db.commit()
+            consumer_db.close()
+        assert reconcile.mismatched_ranges(reconcile.LocalPeer(db), remote, "books") == []
+    finally:
+        db.close()
+        replica.close()
+
+def test_snapshot_streams_compressed_consistent_catalog(setup_database):
+    import gzip
+    from sqlalchemy import insert
+    import snapshot
+    db = TestingSessionLocal()
+    db.add(models.User(id=1, firstname="Jane", lastname="Doe", email="jane@example.com"))
+    db.execute(insert(models.Book), [{"title": f"Book {i}", "publisher": "Pub", "category": "Fiction"} for i in range(300)])
+    db.commit()
+    db.close()
+
+    lines = [json.loads(line) for line in gzip.decompress(b"".join(snapshot.stream(TestingSessionLocal))).splitlines()]
+    header, rows, trailer = lines[0], lines[1:-1], lines[-1]
+    assert header["snapshot"] == 1 and header["columns"]["users"] == ["id", "firstname", "lastname", "email", "version"]
+    assert rows[0] == ["users", [1, "Jane", "Doe", "jane@example.com", 1]]
+    assert [row[1][0] for row in rows[1:]] == list(range(1, 301))
+    assert trailer == {"end": True, "rows": {"users": 1, "books": 300}}
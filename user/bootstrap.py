@@ -0,0 +1,106 @@
+"""Bootstrap a new user-service replica from the admin catalog snapshot.
+
+    python bootstrap.py [ADMIN_API_URL]
+
+1. Declare and bind this replica's queues (set RABBITMQ_QUEUE_PREFIX), so
+   every event committed from now on is buffered for it.
+2. Stream GET /snapshot from the admin service and insert its users and
+   books with executemany INSERTs of BOOTSTRAP_BATCH_SIZE rows.
+3. Start the consumer. It drains the buffered events; the ones the
+   snapshot already contains are dropped by the version checks.
+"""
+import gzip
+import os
+import sys
+from datetime import date
+from urllib.request import urlopen
+import orjson
+from sqlalchemy import Date, insert, select
+from sqlalchemy.orm import Session
+from database import SessionLocal
+from models import Book, User
+from messaging.config import get_rabbitmq_connection
+from messaging import topology
+import consumer
+
+ADMIN_API_URL = os.getenv("ADMIN_API_URL", "http://localhost:8000")
+BOOTSTRAP_BATCH_SIZE = int(os.getenv("BOOTSTRAP_BATCH_SIZE", "5000"))
+SNAPSHOT_FORMAT = 1
+
+MODELS = {"users": User, "books": Book}
+
+
+class SnapshotError(Exception):
+    pass
+
+
+def read_snapshot(stream):
+    """Parsed lines of a gzip NDJSON snapshot, decompressed as they arrive."""
+    for line in gzip.GzipFile(fileobj=stream):
+        yield orjson.loads(line)
+
+
+def _converters(model, columns):
+    """Dates travel as ISO strings; everything else maps to the column as is."""
+    unknown = set(columns) - set(model.__table__.c.keys())
+    if unknown:
+        raise SnapshotError(f"Unknown {model.__tablename__} columns in snapshot: {sorted(unknown)}")
+    return [date.fromisoformat if isinstance(model.__table__.c[name].type, Date) else None for name in columns]
+
+
+def load(db: Session, records, batch_size=BOOTSTRAP_BATCH_SIZE):
+    """Insert a snapshot into empty tables, committing every batch. Returns rows per table."""
+    records = iter(records)
+    header = next(records, None)
+    if not header or header.get("snapshot") != SNAPSHOT_FORMAT:
+        raise SnapshotError("Not a catalog snapshot (or an unsupported format)")
+    if db.scalar(select(Book.id).limit(1)) is not None or db.scalar(select(User.id).limit(1)) is not None:
+        raise SnapshotError("Replica database is not empty")
+
+    columns = header["columns"]
+    converters = {table: _converters(MODELS[table], columns[table]) for table in columns}
+    loaded = {table: 0 for table in columns}
+    batch, batch_table = [], None
+
+    def flush():
+        if batch:
+            db.execute(insert(MODELS[batch_table]), batch)
+            db.commit()
+            loaded[batch_table] += len(batch)
+            batch.clear()
+
+    for record in records:
+        if isinstance(record, dict):
+            flush()
+            if record.get("end") and record["rows"] == loaded:
+                print(f"📦 Snapshot of {header['taken_at']} loaded: {loaded}")
+                return loaded
+            raise SnapshotError(f"Snapshot trailer {record} does not match the rows loaded: {loaded}")
+        table, values = record
+        if table != batch_table:
+            flush()
+            batch_table = table
+        batch.append({name: convert(value) if convert and value is not None else value
+                      for name, convert, value in zip(columns[table], converters[table], values)})
+        if len(batch) >= batch_size:
+            flush()
+    raise SnapshotError("Snapshot ended without a trailer; it was truncated")
+
+
+def bootstrap(admin_url=ADMIN_API_URL):
+    connection = get_rabbitmq_connection()
+    topology.bind_queues(connection.channel(), consumer.APPLIERS)
+    connection.close()
+    print("🎧 Queues bound; events are buffered while the snapshot loads")
+
+    db = SessionLocal()
+    try:
+        with urlopen(f"{admin_url.rstrip('/')}/snapshot") as response:
+            load(db, read_snapshot(response))
+    finally:
+        db.close()
+    consumer.start_consumer()
+
+
+if __name__ == "__main__":
+    bootstrap(*sys.argv[1:2])
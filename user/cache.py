@@ -0,0 +1,127 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+import pika
+from messaging.config import get_rabbitmq_connection
+from messaging.codec import decode_event
+from messaging import topology
+
+BOOK_CACHE_SIZE = int(os.getenv("BOOK_CACHE_SIZE", "10000"))
+BOOK_CACHE_TTL = float(os.getenv("BOOK_CACHE_TTL", "300"))
+# Set to false to run without the invalidation listener (entries then live at most BOOK_CACHE_TTL)
+BOOK_CACHE_LISTEN = os.getenv("BOOK_CACHE_LISTEN", "true").lower() in ("1", "true", "yes")
+
+# Events after which other processes' cached copies of a book are stale
+INVALIDATING_EVENTS = ["book_borrowed", "book_returned", "books_invalidated"]
+
+
+class BookCache:
+    """Read-through LRU cache with a TTL for single-book lookups.
+
+    Entries are dropped explicitly when a book changes; the TTL only bounds
+    staleness if an invalidation is ever lost. A load that races with an
+    invalidation is returned but not stored, so a slow reader cannot put a
+    pre-commit row back after the writer invalidated it.
+    """
+
+    def __init__(self, maxsize=BOOK_CACHE_SIZE, ttl=BOOK_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0, "expirations": 0, "invalidations": 0}
+        self._entries = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+        self._generation = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, loader):
+        """Return the cached value for key, calling loader() on a miss.
+
+        None results are not cached, so unknown ids keep reaching the loader.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self.stats["hits"] += 1
+                    return entry[1]
+                del self._entries[key]
+                self.stats["expirations"] += 1
+            self.stats["misses"] += 1
+            generation = self._generation
+
+        value = loader()
+        if value is None:
+            return None
+        with self._lock:
+            if generation == self._generation:
+                self._entries[key] = (time.monotonic() + self.ttl, value)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.maxsize:
+                    self._entries.popitem(last=False)
+                    self.stats["evictions"] += 1
+        return value
+
+    def invalidate(self, *keys):
+        with self._lock:
+            self._generation += 1
+            for key in keys:
+                if self._entries.pop(key, None) is not None:
+                    self.stats["invalidations"] += 1
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+
+    def metrics(self):
+        lookups = self.stats["hits"] + self.stats["misses"]
+        return {**self.stats, "size": len(self), "maxsize": self.maxsize, "ttl_seconds": self.ttl,
+                "hit_ratio": round(self.stats["hits"] / lookups, 3) if lookups else 0.0}
+
+
+def listen(cache):
+    """Drop cached books changed by the consumer or by other API processes.
+
+    Invalidations sent while disconnected are lost, so the whole cache is
+    cleared on every (re)connect.
+    """
+    def on_message(ch, method, properties, body):
+        event = topology.event_name(method.routing_key)
+        message = decode_event(event, properties, body)
+        if message is None:
+            return
+        data = message.model_dump()
+        cache.invalidate(*data.get("book_ids", [data.get("book_id")]))
+
+    while True:
+        try:
+            connection = get_rabbitmq_connection()
+            channel = connection.channel()
+            topology.declare_exchange(channel)
+            queue = channel.queue_declare(queue="", exclusive=True, auto_delete=True).method.queue
+            for event in INVALIDATING_EVENTS:
+                channel.queue_bind(queue=queue, exchange=topology.EXCHANGE, routing_key=topology.routing_key(event))
+
+            cache.clear()
+            channel.basic_consume(queue=queue, on_message_callback=on_message, auto_ack=True)
+            print("🗄️ Book cache is listening for invalidations...")
+            channel.start_consuming()
+
+        except pika.exceptions.AMQPError as e:
+            print(f"🔴 Book cache lost RabbitMQ ({e}). Retrying in 5 seconds...")
+            cache.clear()
+            time.sleep(5)
+
+
+def start_listener(cache):
+    thread = threading.Thread(target=listen, args=(cache,), daemon=True, name="book-cache")
+    thread.start()
+    return thread
+
+
+# Shared cache for GET /books/{book_id}/
+book_cache = BookCache()
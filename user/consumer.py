@@ -1,146 +1,442 @@
 import pika
-import json
+import functools
+import os
+import threading
+import time
+from sqlalchemy import delete, insert, select, update
 from sqlalchemy.orm import Session
 from database import SessionLocal
-from models import Book, User
+from models import Book, DeletedBook, User
 from messaging.config import get_rabbitmq_connection
+from messaging.codec import decode_event
+from messaging import topology
+from messaging.workers import PartitionedWorkerPool
+from messaging.versions import VersionMap
+from messaging import retry
+from messaging.publisher import publish
+from cache import book_cache
+from producer import return_book_borrowed, send_book_borrowed
+from crud import override_availability
 
-def book_created_callback(ch, method, properties, body):
-    """Process book_created messages from Admin API."""
-    data = json.loads(body)
-    book_id = data["book_id"]
-    title = data["title"]
-    publisher = data["publisher"]
-    category = data["category"]
-    available = data["available"]
+# CONSUMER_WORKERS > 1 applies messages on a thread pool partitioned by entity
+CONSUMER_WORKERS = int(os.getenv("CONSUMER_WORKERS", "1"))
+CONSUMER_PREFETCH = int(os.getenv("CONSUMER_PREFETCH", str(CONSUMER_WORKERS * 10)))
 
-    db: Session = SessionLocal()
+# IDs per set-based DELETE, to stay under database parameter limits
+BULK_DELETE_CHUNK = int(os.getenv("BULK_DELETE_CHUNK", "5000"))
 
-    # Check if book already exists
-    existing_book = db.query(Book).filter(Book.id == book_id).first()
-    if not existing_book:
-        new_book = Book(id=book_id, title=title, publisher=publisher, category=category, available=available)
-        db.add(new_book)
-        db.commit()
-        print(f"✅ User API: Book '{title}' added to Mysql")
+# Highest applied catalog version per book, to skip replays without touching the DB
+versions = VersionMap()
 
-    db.close()
+# Version recorded for deleted books: every later event about them is stale
+DELETED = float("inf")
 
 
-def process_book_deleted(ch, method, properties, body):
-    """Process messages from RabbitMQ for book deletion."""
-    try:
-        data = json.loads(body)
+def parse_message(queue, properties, body):
+    """Decode and validate a message, returning None if it is not valid for the queue."""
+    event = decode_event(queue, properties, body)
+    return event.model_dump() if event is not None else None
 
-        if "book_id" not in data:
-            print(f"⚠️ Invalid book delete message format: {data}")
-            return
 
-        book_id = data["book_id"]
+def mark_stale(db: Session, *book_ids):
+    """Record books whose cached copies must be dropped once the transaction commits."""
+    db.info.setdefault("stale_books", set()).update(book_ids)
 
-        db: Session = SessionLocal()
-        try:
-            db_book = db.query(Book).filter(Book.id == book_id).first()
-            if db_book:
-                db.delete(db_book)  # ✅ Delete book from database
-                db.commit()
-                print(f"🗑️ Admin API: Book {book_id} deleted from PostgreSQL")
-            else:
-                print(f"⚠️ Admin API: Book {book_id} not found in database")
-        finally:
-            db.close()
 
+def mark_applied(db: Session, book_id, version):
+    """Record a catalog version this transaction wrote, for the version map once it commits."""
+    db.info.setdefault("applied_versions", []).append((book_id, version))
+
+
+def record_versions(db: Session):
+    """Teach the version map only the versions that were actually written."""
+    for book_id, version in db.info.pop("applied_versions", ()):
+        versions.record(("book", book_id), version)
+
+
+def invalidate_cached_books(db: Session):
+    """Drop committed changes from the local cache and tell every API process to do the same."""
+    book_ids = sorted(db.info.pop("stale_books", ()))
+    if not book_ids:
+        return
+    book_cache.invalidate(*book_ids)
+    try:
+        publish("books_invalidated", {"book_ids": book_ids})
     except Exception as e:
-        print(f"❌ Error processing book delete message: {e}")
+        # Cached copies then expire after BOOK_CACHE_TTL
+        print(f"⚠️ Could not broadcast cache invalidation for books {book_ids}: {e}")
 
 
+def apply_book_created(db: Session, data):
+    """Add a book created in the Admin API. Does not commit."""
+    book_id = data["book_id"]
+    title = data["title"]
 
+    # Check if book already exists or was deleted since
+    if db.get(DeletedBook, book_id) is not None:
+        mark_applied(db, book_id, DELETED)
+        print(f"ℹ️ User API: Book {book_id} was deleted, ignoring its creation")
+    elif db.get(Book, book_id) is None:
+        db.add(Book(id=book_id, title=title, publisher=data["publisher"], category=data["category"],
+                    available=data["available"], version=data["version"] or 1))
+        mark_stale(db, book_id)
+        mark_applied(db, book_id, data["version"])
+        print(f"✅ User API: Book '{title}' added to Mysql")
 
 
+def apply_books_created(db: Session, data):
+    """Add a chunk of bulk-imported books with one SELECT and one executemany INSERT. Does not commit."""
+    books = data["books"]
+    book_ids = [book["book_id"] for book in books]
+    existing = set(db.scalars(select(Book.id).where(Book.id.in_(book_ids))))
+    existing.update(db.scalars(select(DeletedBook.id).where(DeletedBook.id.in_(book_ids))))
+    rows = [
+        {"id": book["book_id"], "title": book["title"], "publisher": book["publisher"],
+         "category": book["category"], "available": book["available"], "version": book["version"] or 1}
+        for book in books if book["book_id"] not in existing
+    ]
+    if rows:
+        db.execute(insert(Book), rows)
+        mark_stale(db, *(row["id"] for row in rows))
+        for row in rows:
+            mark_applied(db, row["id"], row["version"])
+    print(f"✅ User API: {len(rows)} bulk-imported books added to Mysql")
+
+
+def bury(db: Session, book_ids):
+    """Leave tombstones for deleted books, so late or redelivered creates stay deleted."""
+    buried = set(db.scalars(select(DeletedBook.id).where(DeletedBook.id.in_(book_ids))))
+    rows = [{"id": book_id} for book_id in dict.fromkeys(book_ids) if book_id not in buried]
+    if rows:
+        db.execute(insert(DeletedBook), rows)
+    for book_id in book_ids:
+        mark_applied(db, book_id, DELETED)
+
+
+def apply_book_deleted(db: Session, data):
+    """Delete a book removed in the Admin API. Does not commit."""
+    book_id = data["book_id"]
 
+    bury(db, [book_id])
+    db_book = db.get(Book, book_id)
+    if db_book:
+        db.delete(db_book)  # ✅ Delete book from database
+        mark_stale(db, book_id)
+        print(f"🗑️ User API: Book {book_id} deleted from Mysql")
+    else:
+        print(f"⚠️ User API: Book {book_id} not found in database")
+
+
+def _chunks(ids):
+    return [ids[start:start + BULK_DELETE_CHUNK] for start in range(0, len(ids), BULK_DELETE_CHUNK)]
+
+
+def apply_books_deleted(db: Session, data):
+    """Delete a bulk-deleted set of books with one DELETE per chunk of ids. Does not commit."""
+    deleted = 0
+    for chunk in _chunks(data["book_ids"]):
+        deleted += db.execute(delete(Book).where(Book.id.in_(chunk)).execution_options(synchronize_session=False)).rowcount
+        bury(db, chunk)
+        mark_stale(db, *chunk)
+    print(f"🗑️ User API: {deleted} bulk-deleted books removed from Mysql")
+
+
+def apply_user_deleted(db: Session, data):
+    """Delete a user removed in the Admin API. Does not commit."""
+    user_id = data["user_id"]
+
+    db_user = db.get(User, user_id)
+    if db_user:
+        # Their borrowed books lose the borrower (ON DELETE SET NULL)
+        mark_stale(db, *db.scalars(select(Book.id).where(Book.borrower_id == user_id)))
+        db.delete(db_user)  # ✅ Delete user from database
+        print(f"🗑️ User API: User {user_id} deleted from Mysql")
+    else:
+        print(f"⚠️ User API: User {user_id} not found in database")
+
+
+def apply_users_deleted(db: Session, data):
+    """Delete a bulk-deleted set of users and detach their books, set-based. Does not commit."""
+    deleted = 0
+    for chunk in _chunks(data["user_ids"]):
+        mark_stale(db, *db.scalars(select(Book.id).where(Book.borrower_id.in_(chunk))))
+        db.execute(update(Book).where(Book.borrower_id.in_(chunk)).values(borrower_id=None)
+                   .execution_options(synchronize_session=False))
+        deleted += db.execute(delete(User).where(User.id.in_(chunk)).execution_options(synchronize_session=False)).rowcount
+    print(f"🗑️ User API: {deleted} bulk-deleted users removed from Mysql")
+
+
+def apply_book_updated(db: Session, data):
+    """Apply a book edited in the Admin API as one conditional UPDATE. Does not commit."""
+    book_id = data["book_id"]
+    version = data["version"]
+
+    values = {
+        "title": data["title"],
+        "publisher": data["publisher"],
+        "category": data["category"],
+    }
+    statement = update(Book).where(Book.id == book_id)
+    if version:
+        # Only newer catalog versions win; duplicates and reorders match no row
+        statement = statement.where(Book.version < version)
+        values["version"] = version
+    result = db.execute(statement.values(**values).execution_options(synchronize_session=False))
+
+    if result.rowcount:
+        mark_stale(db, book_id)
+        mark_applied(db, book_id, version)
+        print(f"✅ User API: Book {book_id} marked as updated in Mysql")
+    elif db.get(Book, book_id) is None and db.get(DeletedBook, book_id) is None:
+        # Overtook its book_created; fail so the retry queues apply it after the create
+        raise LookupError(f"Book {book_id} not created yet")
+    else:
+        print(f"⚠️ User API: Book {book_id} deleted or version {version} is stale")
+
+
+def apply_book_availability(db: Session, data):
+    """Apply an admin availability override as a loan change and echo it back. Does not commit.
+
+    The override ends any loan and takes the next loan_version, so the
+    book_borrowed/book_returned echo wins over older loan events on the
+    admin side and loses to newer ones.
+    """
+    book_id, available = data["book_id"], data["available"]
+    book = override_availability(db, book_id, available)
+    if book is None:
+        print(f"⚠️ User API: Book {book_id} not found or already {'available' if available else 'unavailable'}")
+        return
+    mark_stale(db, book_id)
+    send = return_book_borrowed if available else send_book_borrowed
+    send(db, book_id, available, None, None, None, book.loan_version)
+    print(f"✅ User API: Book {book_id} availability overridden to {available}")
+
+
+APPLIERS = {
+    "book_created": apply_book_created,
+    "book_deleted": apply_book_deleted,
+    "user_deleted": apply_user_deleted,
+    "book_updated": apply_book_updated,
+    "books_created": apply_books_created,
+    "books_deleted": apply_books_deleted,
+    "users_deleted": apply_users_deleted,
+    "book_availability": apply_book_availability,
+}
+
+
+def is_stale(queue, data):
+    """Drop catalog events already applied, using only the in-memory map."""
+    version = data.get("version")
+    if "book_id" in data and versions.is_stale(("book", data["book_id"]), version):
+        print(f"ℹ️ Skipping stale {queue} event (version {version})")
+        return True
+    return False
+
+
+def partition_key(queue, data):
+    """Events about the same entity must be applied in order."""
+    if "book_id" in data:
+        return ("book", data["book_id"])
+    return ("user", data["user_id"])
+
+
+# Bulk event -> (list field, entity, id of a list item)
+BULK_EVENTS = {
+    "books_created": ("books", "book", lambda book: book["book_id"]),
+    "books_deleted": ("book_ids", "book", lambda book_id: book_id),
+    "users_deleted": ("user_ids", "user", lambda user_id: user_id),
+}
+
+
+def split_for_pool(pool, queue, data):
+    """Return (partition key, data) parts for the worker pool.
+
+    Bulk events are split by worker so every entity in them stays ordered
+    with the later single-entity events for the same id.
+    """
+    if queue not in BULK_EVENTS:
+        return [(partition_key(queue, data), data)]
+    field, entity, item_id = BULK_EVENTS[queue]
+    groups = {}
+    for item in data[field]:
+        key = (entity, item_id(item))
+        groups.setdefault(pool.partition(key), (key, []))[1].append(item)
+    return [(key, {field: items}) for key, items in groups.values()]
+
+
+def apply_message(queue, data):
+    """Apply one message in its own transaction. Returns False on DB failure."""
+    if is_stale(queue, data):
+        return True
 
-def process_user_deleted(ch, method, properties, body):
-    """Process messages from RabbitMQ for user deletion."""
+    db: Session = SessionLocal()
     try:
-        data = json.loads(body)
+        APPLIERS[queue](db, data)
+        db.commit()
+        record_versions(db)
+        invalidate_cached_books(db)
+        return True
+    except Exception as db_error:
+        db.rollback()
+        db.info.pop("stale_books", None)
+        db.info.pop("applied_versions", None)
+        print(f"❌ Database error processing {queue} message: {db_error}")
+        return False
+    finally:
+        db.close()
+
+
+def _process(queue, ch, method, properties, body):
+    """Apply one delivery; failures go to the retry queues instead of being lost."""
+    data = parse_message(queue, properties, body)
+    if data is None:
+        retry.dead_letter(ch, queue, properties, body, "undecodable")
+    elif not apply_message(queue, data):
+        retry.defer(ch, queue, properties, body)
+    ch.basic_ack(delivery_tag=method.delivery_tag)
 
-        if "user_id" not in data:
-            print(f"⚠️ Invalid book delete message format: {data}")
-            return
 
-        user_id = data["user_id"]
+def book_created_callback(ch, method, properties, body):
+    """Process book_created messages from Admin API."""
+    _process("book_created", ch, method, properties, body)
 
-        db: Session = SessionLocal()
-        try:
-            db_user = db.query(User).filter(User.id == user_id).first()
-            if db_user:
-                db.delete(db_user)  # ✅ Delete user from database
-                db.commit()
-                print(f"🗑️ Admin API:User {user_id} deleted from PostgreSQL")
-            else:
-                print(f"⚠️ Admin API: User {user_id} not found in database")
-        finally:
-            db.close()
 
-    except Exception as e:
-        print(f"❌ Error processing book delete message: {e}")
+def process_book_deleted(ch, method, properties, body):
+    """Process messages from RabbitMQ for book deletion."""
+    _process("book_deleted", ch, method, properties, body)
+
 
+def process_user_deleted(ch, method, properties, body):
+    """Process messages from RabbitMQ for user deletion."""
+    _process("user_deleted", ch, method, properties, body)
 
 
 def process_book_updated(ch, method, properties, body):
-    """Process messages from RabbitMQ for book borrowing."""
-    try:
-        data = json.loads(body)
+    """Process messages from RabbitMQ for book updates."""
+    _process("book_updated", ch, method, properties, body)
 
-        if not all(k in data for k in ["book_id", "title", "publisher", "category","available"]):
-            print(f"⚠️ Invalid user message format: {data}")
-            return
 
-        book_id = data["book_id"]
-        title = data["title"]
-        publisher = data["publisher"]
-        category = data["category"]
-        available = data["available"]
+def process_books_created(ch, method, properties, body):
+    """Process bulk-import book chunks from the Admin API."""
+    _process("books_created", ch, method, properties, body)
 
 
-        db: Session = SessionLocal()
-        try:
-            db_book = db.query(Book).filter(Book.id == book_id).first()
-            if db_book:
-                # ✅ Update the existing book record
-                db_book.title = title
-                db_book.publisher = publisher
-                db_book.category = category
-                db_book.available = available
-
-                db.commit()
-                print(f"✅ Admin API: Book {book_id} marked as updated in PostgreSQL")
-            else:
-                print(f"⚠️ Admin API: Book {book_id} not found in database")
-        finally:
-            db.close()
+def process_books_deleted(ch, method, properties, body):
+    """Process bulk book deletions from the Admin API."""
+    _process("books_deleted", ch, method, properties, body)
 
-    except Exception as e:
-        print(f"❌ Error processing book borrow message: {e}")
+
+def process_users_deleted(ch, method, properties, body):
+    """Process bulk user deletions from the Admin API."""
+    _process("users_deleted", ch, method, properties, body)
 
 
-   # Setup RabbitMQ Consumer
-connection = get_rabbitmq_connection()
-channel = connection.channel()
+def process_book_availability(ch, method, properties, body):
+    """Process availability overrides from the Admin API."""
+    _process("book_availability", ch, method, properties, body)
 
-# Declare queues
-channel.queue_declare(queue="book_created")
-channel.queue_declare(queue="book_deleted", durable=False)
-channel.queue_declare(queue="user_deleted", durable=False)
 
-channel.queue_declare(queue="book_updated", durable=False)
-# Bind consumers to queues
-channel.basic_consume(queue="book_created", on_message_callback=book_created_callback, auto_ack=True)
-channel.basic_consume(queue="book_deleted", on_message_callback=process_book_deleted, auto_ack=True)  # ✅ Listen for delete messages
-channel.basic_consume(queue="user_deleted", on_message_callback=process_user_deleted, auto_ack=True)
+def defer_and_ack(ch, queue, properties, body, tag):
+    retry.defer(ch, queue, properties, body)
+    ch.basic_ack(delivery_tag=tag)
 
-channel.basic_consume(queue="book_updated", on_message_callback=process_book_updated, auto_ack=True)
 
+def worker_pool_callback(connection, pool):
+    """Build an on_message callback that hands messages to the worker pool.
 
-print("🎧 User API is listening for book updates...")
-channel.start_consuming()
+    Acks and retries happen on the connection's thread (pika is not
+    thread-safe) once every worker is done; a lost connection simply leaves
+    them unacked for redelivery.
+    """
+    def on_message(ch, method, properties, body):
+        queue = retry.event_name(method, properties)
+        data = parse_message(queue, properties, body)
+        if data is None:
+            retry.dead_letter(ch, queue, properties, body, "undecodable")
+            ch.basic_ack(delivery_tag=method.delivery_tag)
+            return
+
+        parts = split_for_pool(pool, queue, data)
+        remaining = [len(parts), True]
+        lock = threading.Lock()
+
+        def on_done(success, tag=method.delivery_tag):
+            # Ack once every part of the message has been applied
+            with lock:
+                remaining[0] -= 1
+                remaining[1] = remaining[1] and success
+                if remaining[0]:
+                    return
+                success = remaining[1]
+            if success:
+                callback = functools.partial(ch.basic_ack, delivery_tag=tag)
+            else:
+                # The whole message is retried; re-applying the parts that succeeded is harmless
+                callback = functools.partial(defer_and_ack, ch, queue, properties, body, tag)
+            try:
+                connection.add_callback_threadsafe(callback)
+            except Exception:
+                pass
+
+        for key, part in parts:
+            pool.submit(key, (queue, part), on_done)
+
+    return on_message
+
+
+def start_consumer(workers=CONSUMER_WORKERS, prefetch=CONSUMER_PREFETCH):
+    """Start RabbitMQ consumer with automatic reconnection."""
+    pool = None
+    if workers > 1:
+        pool = PartitionedWorkerPool(workers, lambda item: apply_message(*item))
+        pool.start()
+
+    while True:
+        try:
+            # Setup RabbitMQ Consumer
+            connection = get_rabbitmq_connection()
+            channel = connection.channel()
+            # Retry and dead-letter copies are confirmed before the original delivery is acked
+            channel.confirm_delivery()
+
+            # Declare our queues and bind them to the event exchange, plus their retry and dead-letter queues
+            topology.bind_queues(channel, APPLIERS)
+            retry.declare_queues(channel, APPLIERS)
+
+            if pool is not None:
+                channel.basic_qos(prefetch_count=prefetch)
+                on_message = worker_pool_callback(connection, pool)
+                for event in APPLIERS:
+                    channel.basic_consume(queue=topology.queue_name(event), on_message_callback=on_message)
+
+                print(f"🎧 User API is listening for book updates ({workers} workers)...")
+                while True:
+                    connection.process_data_events(time_limit=1)
+                    pool.maybe_report()
+
+            # Bind consumers to queues; acked once applied or handed to a retry queue
+            channel.basic_qos(prefetch_count=prefetch)
+            channel.basic_consume(queue=topology.queue_name("book_created"), on_message_callback=book_created_callback)
+            channel.basic_consume(queue=topology.queue_name("book_deleted"), on_message_callback=process_book_deleted)  # ✅ Listen for delete messages
+            channel.basic_consume(queue=topology.queue_name("user_deleted"), on_message_callback=process_user_deleted)
+            channel.basic_consume(queue=topology.queue_name("book_updated"), on_message_callback=process_book_updated)
+            channel.basic_consume(queue=topology.queue_name("books_created"), on_message_callback=process_books_created)
+            channel.basic_consume(queue=topology.queue_name("books_deleted"), on_message_callback=process_books_deleted)
+            channel.basic_consume(queue=topology.queue_name("users_deleted"), on_message_callback=process_users_deleted)
+            channel.basic_consume(queue=topology.queue_name("book_availability"), on_message_callback=process_book_availability)
+
+            print("🎧 User API is listening for book updates...")
+            channel.start_consuming()
+
+        except pika.exceptions.AMQPConnectionError as e:
+            print(f"🔴 RabbitMQ Connection Error: {e}. Retrying in 5 seconds...")
+            time.sleep(5)
+        except (pika.exceptions.UnroutableError, pika.exceptions.NackError) as e:
+            # A retry copy was refused: reconnecting redelivers everything still unacked
+            print(f"🔴 Could not hand a failed message to its retry queue ({e}). Reconnecting in 5 seconds...")
+            connection.close()
+            time.sleep(5)
+
+
+if __name__ == "__main__":
+    start_consumer()
@@ -1,7 +1,16 @@
+import re
 from fastapi import HTTPException
+from sqlalchemy import case, func, or_, select, update
+from sqlalchemy.dialects.mysql import match
 from sqlalchemy.orm import Session
 import schema, models
+from pagination import keyset_page
+from cache import book_cache
 from datetime import date, timedelta
+from producer import send_user_created_message, send_book_borrowed, return_book_borrowed
+
+# InnoDB does not index shorter words (innodb_ft_min_token_size)
+FULLTEXT_MIN_WORD = 3
 
 # Create User
 def add_user(db: Session, user: schema.UserCreate):
@@ -11,6 +20,11 @@ def add_user(db: Session, user: schema.UserCreate):
         firstname=user.firstname
     )
     db.add(db_user)
+    db.flush()
+
+    # Publish user-created event through the outbox, in the same transaction
+    send_user_created_message(db, db_user.id, db_user.firstname, db_user.lastname, db_user.email, db_user.version)
+
     db.commit()
     db.refresh(db_user)
     return db_user
@@ -22,64 +36,184 @@ def get_user_by_email(db: Session, email: str):
 
 # Borrow Book
 def borrow_book(db: Session, book_borrow: schema.BookBorrow, user_id: int):
-    db_book = db.query(models.Book).filter(models.Book.id == book_borrow.book_id).first()
-
-    if not db_book:
-        raise HTTPException(status_code=404, detail="Book not found")
+    # One conditional UPDATE: of concurrent borrowers only the first matches the row
+    borrow_date = date.today()
+    statement = (
+        update(models.Book)
+        .where(models.Book.id == book_borrow.book_id, models.Book.available == True)
+        .values(available=False, borrower_id=user_id, borrow_date=borrow_date,
+                return_date=borrow_date + timedelta(days=book_borrow.borrow_duration),
+                loan_version=models.Book.loan_version + 1)
+    )
+    db_book = _update_book_returning(db, statement, book_borrow.book_id)
 
-    if not db_book.available:
+    if db_book is None:
+        # Lost the race or bad id; only this failure path needs a SELECT
+        if db.query(models.Book.id).filter(models.Book.id == book_borrow.book_id).first() is None:
+            raise HTTPException(status_code=404, detail="Book not found")
         raise HTTPException(status_code=400, detail="Book is not available")
 
-    # Update the book's availability and borrow details in the frontend database
-    db_book.available = False
-    db_book.borrower_id = user_id
-    db_book.borrow_date = date.today()
-    db_book.return_date = date.today() + timedelta(days=book_borrow.borrow_duration)
+    send_book_borrowed(db, db_book.id, db_book.available, db_book.borrower_id, db_book.borrow_date, db_book.return_date, db_book.loan_version)
+    _commit_keeping(db, db_book)
+    # Other processes drop their copy when the book_borrowed event reaches them
+    book_cache.invalidate(db_book.id)
+
+    return db_book
+
+
+def _update_book_returning(db: Session, statement, book_id: int):
+    """Run a conditional UPDATE on one book; return the updated Book, or None if no row matched."""
+    if db.get_bind().dialect.update_returning:
+        return db.scalars(statement.returning(models.Book).execution_options(populate_existing=True)).first()
+    # MySQL has no RETURNING: read the row back, it is already locked by our UPDATE
+    if db.execute(statement.execution_options(synchronize_session=False)).rowcount == 0:
+        return None
+    return db.get(models.Book, book_id, populate_existing=True)
+
 
+def _commit_keeping(db: Session, db_book):
+    """Commit without expiring db_book, so callers read it without another SELECT."""
+    db.expunge(db_book)
     db.commit()
-    db.refresh(db_book)
 
-    return db_book
 
+# Columns of schema.Book: list endpoints select just these and skip ORM objects and Pydantic
+BOOK_COLUMNS = (
+    models.Book.id, models.Book.title, models.Book.publisher, models.Book.category, models.Book.available,
+    models.Book.borrower_id, models.Book.borrow_date, models.Book.return_date,
+)
+
+
+def _rows(result):
+    """Plain dicts from a projected query, ready for orjson."""
+    keys = list(result.keys())
+    return [dict(zip(keys, row)) for row in result]
 
-#Get all books
+
+def book_rows(db: Session, *criteria, offset: int = 0, limit: int = None):
+    statement = select(*BOOK_COLUMNS).where(*criteria).offset(offset or None).limit(limit)
+    return _rows(db.execute(statement))
+
+
+#Get all books (as schema.Book rows)
 def get_books(db: Session, offset: int = 0, limit: int = 10):
-    return db.query(models.Book).offset(offset).limit(limit).all()
+    return book_rows(db, offset=offset, limit=limit)
+
+def get_books_page(db: Session, cursor: str = "", limit: int = 10):
+    return keyset_page(db.query(models.Book), models.Book.id, cursor, limit)
 
 # Function to return borrowed books
 def return_book(db: Session, book_id: int):
     """Marks a book as returned and updates availability."""
-    book = db.query(models.Book).filter(models.Book.id == book_id, models.Book.available == False).first()
+    statement = (
+        update(models.Book)
+        .where(models.Book.id == book_id, models.Book.available == False)
+        .values(available=True, borrower_id=None, borrow_date=None, return_date=None,
+                loan_version=models.Book.loan_version + 1)
+    )
+    book = _update_book_returning(db, statement, book_id)
     if not book:
         return None
 
-    book.available = True
-    book.borrower_id = None
-    book.borrow_date = None
-    book.return_date = None
-
-    db.commit()
-    db.refresh(book)
+    return_book_borrowed(db, book.id, book.available, book.borrower_id, book.borrow_date, book.return_date, book.loan_version)
+    _commit_keeping(db, book)
+    book_cache.invalidate(book.id)
     return book
 
+def override_availability(db: Session, book_id: int, available: bool):
+    """Force availability for an admin override, ending any loan. Does not commit; returns the Book or None."""
+    statement = (
+        update(models.Book)
+        .where(models.Book.id == book_id, models.Book.available != available)
+        .values(available=available, borrower_id=None, borrow_date=None, return_date=None,
+                loan_version=models.Book.loan_version + 1)
+    )
+    return _update_book_returning(db, statement, book_id)
+
+
 
 
+# On MySQL the lookups below match whole words (the last one as a prefix) through
+# the FULLTEXT index, like /books/search; the LIKE then keeps matches in the field
+def _field_contains(db: Session, column, text: str):
+    criteria = [column.ilike(f"%{text}%")]
+    words = [word for word in re.findall(r"\w+", text) if len(word) >= FULLTEXT_MIN_WORD]
+    if words and db.get_bind().dialect.name == "mysql":
+        criteria.append(_fulltext(words))
+    return criteria
 
-# GET BOOK BY title
+# GET BOOK BY title (as schema.Book rows)
 def get_book_by_title(db: Session, title: str):
-    return db.query(models.Book).filter(models.Book.title.ilike(f"%{title}%")).all()
+    return book_rows(db, *_field_contains(db, models.Book.title, title))
 
 # GET BOOKS BY CATEGORY
 def get_books_by_category(db: Session, category: str):
-    return db.query(models.Book).filter(models.Book.category.ilike(f"%{category}%")).all()
+    return book_rows(db, *_field_contains(db, models.Book.category, category))
 
 
 
 # GET BOOK BY publisher
 def get_books_by_publisher(db: Session, publisher: str):
-    return db.query(models.Book).filter(models.Book.publisher.ilike(f"%{publisher}%")).all()
+    return book_rows(db, *_field_contains(db, models.Book.publisher, publisher))
+
+
+# FILTER BOOKS by any combination of category, publisher and availability
+def filter_books(db: Session, category: str = None, publisher: str = None, available: bool = None,
+                 cursor: str = "", limit: int = 10):
+    query = db.query(models.Book)
+    if category is not None:
+        query = query.filter(models.Book.category == category)
+    if publisher is not None:
+        query = query.filter(models.Book.publisher == publisher)
+    if available is not None:
+        query = query.filter(models.Book.available == available)
+    # Both queries are served by the composite (category, publisher, available, id) indexes
+    total = query.with_entities(func.count(models.Book.id)).scalar()
+    books, next_cursor = keyset_page(query, models.Book.id, cursor, limit)
+    return books, next_cursor, total
+
+
+# GET BOOKS BY ids, in the order given (search results come ranked)
+def get_books_by_ids(db: Session, book_ids):
+    books = {book.id: book for book in db.query(models.Book).filter(models.Book.id.in_(book_ids))}
+    return [books[book_id] for book_id in book_ids if book_id in books]
+
+
+# SEARCH BOOKS in the database, used while the in-memory index is not ready
+def _fulltext(words):
+    """MATCH over the FULLTEXT index: every word required, the last one as a prefix."""
+    against = " ".join(f"+{word}" for word in words[:-1]) + f" +{words[-1]}*"
+    return match(models.Book.title, models.Book.publisher, models.Book.category, against=against).in_boolean_mode()
+
+
+def search_books(db: Session, q: str, limit: int = 20):
+    if db.get_bind().dialect.name == "mysql":
+        # Ranked by relevance
+        words = re.findall(r"\w+", q)
+        if not words:
+            return []
+        relevance = _fulltext(words)
+        return db.query(models.Book).filter(relevance).order_by(relevance.desc(), models.Book.id).limit(limit).all()
+
+    pattern = f"%{q}%"
+    title_hit = case((models.Book.title.ilike(pattern), 0), else_=1)
+    return (
+        db.query(models.Book)
+        .filter(or_(models.Book.title.ilike(pattern), models.Book.publisher.ilike(pattern), models.Book.category.ilike(pattern)))
+        .order_by(title_hit, models.Book.id)
+        .limit(limit)
+        .all()
+    )
 
 
 # GET Book BY id
 def get_book_by_id(db: Session, book_id: int):
-    return db.query(models.Book).filter(models.Book.id ==book_id).first()
\ No newline at end of file
+    return db.query(models.Book).filter(models.Book.id ==book_id).first()
+
+
+# GET Book BY id through the in-process cache; returns a detached schema.Book
+def get_book_by_id_cached(db: Session, book_id: int):
+    def load():
+        book = get_book_by_id(db, book_id)
+        return schema.Book.model_validate(book) if book is not None else None
+    return book_cache.get(book_id, load)
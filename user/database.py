@@ -1,6 +1,7 @@
 import os
 from dotenv import load_dotenv
 from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.orm import declarative_base
 from sqlalchemy.orm import sessionmaker
 
@@ -8,11 +9,55 @@ load_dotenv()
 
 SQLALCHEMY_DATABASE_URL = os.environ.get('DB_URL')
 
+# Connection pool settings (ignored for SQLite, which uses its own pool)
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', '10'))
+DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', '20'))
+DB_POOL_RECYCLE = int(os.environ.get('DB_POOL_RECYCLE', '1800'))
+DB_POOL_PRE_PING = os.environ.get('DB_POOL_PRE_PING', 'true').lower() in ('1', 'true', 'yes')
+DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', '30'))
+DB_CONNECT_TIMEOUT = int(os.environ.get('DB_CONNECT_TIMEOUT', '10'))
+
+# Async drivers for each backend, used when ASYNC_DB_URL is not given
+ASYNC_DRIVERS = {"postgresql": "asyncpg", "mysql": "aiomysql", "sqlite": "aiosqlite"}
+
+
+def async_url(url):
+    """Swap the sync driver in a database URL for its async counterpart."""
+    if not url or "://" not in url:
+        return url
+    scheme, rest = url.split("://", 1)
+    backend = scheme.split("+")[0]
+    driver = ASYNC_DRIVERS.get(backend)
+    return f"{backend}+{driver}://{rest}" if driver else url
+
+
+def engine_options(url):
+    """Pool and timeout options for create_engine / create_async_engine."""
+    if not url or url.startswith("sqlite"):
+        return {}
+    timeout_arg = "timeout" if "+asyncpg" in url else "connect_timeout"
+    return {
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": DB_POOL_PRE_PING,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "connect_args": {timeout_arg: DB_CONNECT_TIMEOUT},
+    }
+
+
 engine = create_engine(
-    SQLALCHEMY_DATABASE_URL
+    SQLALCHEMY_DATABASE_URL,
+    **engine_options(SQLALCHEMY_DATABASE_URL)
 )
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+ASYNC_DATABASE_URL = os.environ.get('ASYNC_DB_URL') or async_url(SQLALCHEMY_DATABASE_URL)
+
+# Created on first use so the sync API still starts without an async driver installed
+async_engine = None
+AsyncSessionLocal = None
+
 Base = declarative_base()
 
 # Dependency to get a database session
@@ -21,4 +66,19 @@ def get_db():
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+
+def get_async_engine():
+    global async_engine, AsyncSessionLocal
+    if async_engine is None:
+        async_engine = create_async_engine(ASYNC_DATABASE_URL, **engine_options(ASYNC_DATABASE_URL))
+        AsyncSessionLocal = async_sessionmaker(async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
+    return async_engine
+
+
+# Dependency to get an async database session for non-blocking read endpoints
+async def get_async_db():
+    get_async_engine()
+    async with AsyncSessionLocal() as db:
+        yield db
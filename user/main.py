@@ -1,14 +1,36 @@
-from fastapi import FastAPI, HTTPException, Depends
+import os
+import secrets
+from fastapi import APIRouter, FastAPI, HTTPException, Depends, Header, Query, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import ORJSONResponse
 from sqlalchemy.orm import Session
-from database import SessionLocal, engine, Base, get_db
+from sqlalchemy.ext.asyncio import AsyncSession
+from database import SessionLocal, engine, Base, get_db, get_async_db
 import schema, crud
-from typing import List
+from typing import List, Literal, Optional, Union
+from contextlib import asynccontextmanager
+from messaging.async_publisher import publisher
+import outbox
+import search
+import digest
+from cache import book_cache, BOOK_CACHE_LISTEN, start_listener
 
-from producer import send_user_created_message, send_book_borrowed, return_book_borrowed
 # Create database tables
 Base.metadata.create_all(bind=engine)
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Committed outbox events are published in the background, off the request path
+    await publisher.start(on_published=outbox.discard_published)
+    if search.SEARCH_INDEX_ENABLED:
+        search.start_listener(search.index)
+    if BOOK_CACHE_LISTEN:
+        start_listener(book_cache)
+    yield
+    await publisher.stop()
+
+app = FastAPI(lifespan=lifespan)
 
 
 # Endpoint to Enroll new user
@@ -18,11 +40,8 @@ def enroll(user: schema.UserCreate, db: Session = Depends(get_db)):
     if db_user:
         raise HTTPException(status_code=400, detail="Email already registered")
     
+    # The user-created event is written to the outbox by crud and relayed to RabbitMQ
     created_user = crud.add_user(db=db, user=user)
-
-    # Publish user-created event to RabbitMQ
-    send_user_created_message(created_user.id, created_user.firstname, created_user.lastname, created_user.email)
-
     
     return {"message": "Account created successfully","user": created_user}
 
@@ -34,9 +53,6 @@ def borrow_book(email: str, book_borrow: schema.BookBorrow, db: Session = Depend
         raise HTTPException(status_code=400, detail="Email not registered")
 
     borrowed_book = crud.borrow_book(db=db, book_borrow=book_borrow, user_id=db_user.id)
-
-    # Publish borrow book event to RabbitMQ
-    send_book_borrowed(borrowed_book.id, borrowed_book.available, borrowed_book.borrower_id, borrowed_book.borrow_date, borrowed_book.return_date)
     
     return schema.BorrowedBookResponse(
         book_title=borrowed_book.title,
@@ -48,10 +64,19 @@ def borrow_book(email: str, book_borrow: schema.BookBorrow, db: Session = Depend
 
 
 # Endpoint to GET all books
-@app.get("/books/", response_model=List[schema.Book], tags=["Book"])
-def get_books(db: Session = Depends(get_db), offset: int = 0, limit: int = 10):
-    books = crud.get_books(db, offset=offset, limit=limit)
-    return books
+@app.get("/books/", response_model=Union[List[schema.Book], schema.BookPage], tags=["Book"])
+async def get_books(db: AsyncSession = Depends(get_async_db), offset: int = 0, limit: int = 10,
+                    cursor: Optional[str] = None):
+    # ?cursor= (empty) starts keyset pagination; follow next_cursor for later pages
+    if cursor is not None:
+        try:
+            books, next_cursor = await db.run_sync(crud.get_books_page, cursor=cursor, limit=limit)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        return {"items": books, "next_cursor": next_cursor}
+    books = await db.run_sync(crud.get_books, offset=offset, limit=limit)
+    # Projected rows serialized by orjson; response_model still documents the shape
+    return ORJSONResponse(books)
 
 @app.post("/return_book/", tags=["Book"])
 def return_book(request: schema.ReturnRequest, db: Session = Depends(get_db)):
@@ -60,47 +85,111 @@ def return_book(request: schema.ReturnRequest, db: Session = Depends(get_db)):
     if not book:
         raise HTTPException(status_code=400, detail="Book not found or not borrowed")
 
-    # Publish book returned event to RabbitMQ
-    return_book_borrowed(book.id, book.available, book.borrower_id, book.borrow_date, book.return_date)
-
     return {"message": f"Book {book.id} returned successfully"}
 
+# Endpoint to GET books filtered by category, publisher and availability, one page at a time
+# The total matching books comes back in the X-Total-Count header
+@app.get("/books/filter", response_model=schema.BookPage, tags=["Book"])
+async def filter_books(response: Response, category: Optional[str] = None, publisher: Optional[str] = None,
+                       available: Optional[bool] = None, cursor: str = "", limit: int = Query(10, ge=1, le=100),
+                       db: AsyncSession = Depends(get_async_db)):
+    try:
+        books, next_cursor, total = await db.run_sync(crud.filter_books, category=category, publisher=publisher,
+                                                      available=available, cursor=cursor, limit=limit)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    response.headers["X-Total-Count"] = str(total)
+    return {"items": books, "next_cursor": next_cursor}
+
+# Endpoint to SEARCH books by title, publisher or category, best matches first
+@app.get("/books/search", response_model=List[schema.Book], tags=["Book"])
+async def search_books(q: str = Query(min_length=1), limit: int = Query(20, ge=1, le=100),
+                       db: AsyncSession = Depends(get_async_db)):
+    if search.index.ready:
+        # Pure CPU under the index lock: keep it off the event loop
+        book_ids = await run_in_threadpool(search.index.search, q, limit)
+        return await db.run_sync(crud.get_books_by_ids, book_ids)
+    return await db.run_sync(crud.search_books, q=q, limit=limit)
+
 # Endpoint to GET Book by id
 @app.get("/books/{book_id}/", response_model=schema.Book, tags=["Book"])
 
-def get_Book_by_id(book_id: int, db: Session = Depends(get_db)):
-   print(f"Fetching book with ID: {book_id}")  # Debugging line
-   book= crud.get_book_by_id(db=db, book_id=book_id) 
+async def get_Book_by_id(book_id: int, db: AsyncSession = Depends(get_async_db)):
+   # Cache hits never open a database connection
+   book= await db.run_sync(crud.get_book_by_id_cached, book_id=book_id) 
    if book is None:
        raise HTTPException(status_code=404, detail="Book not found")
    return book
 
 # Endpoint to GET Book by title
 @app.get("/books/title/{title}/", response_model=List[schema.Book], tags=["Book"] )
-def get_book_by_title(title: str, db:Session = Depends(get_db)):
-    print(f"checking")
-    books=crud.get_book_by_title(db=db, title=title)
+async def get_book_by_title(title: str, db: AsyncSession = Depends(get_async_db)):
+    books=await db.run_sync(crud.get_book_by_title, title=title)
     if not books:
         raise HTTPException(status_code=404, detail="Book not found")
-    # Convert each SQLAlchemy model instance to a Pydantic schema
-    return [schema.Book.model_validate(book) for book in books]
+    return ORJSONResponse(books)
 
 # Endpoint to GET Books by category
 @app.get("/books/category/{category}/", response_model=List[schema.Book], tags=["Book"])
-def get_books_by_category(category: str, db: Session = Depends(get_db)):
-    books = crud.get_books_by_category(db=db, category=category)
+async def get_books_by_category(category: str, db: AsyncSession = Depends(get_async_db)):
+    books = await db.run_sync(crud.get_books_by_category, category=category)
     if not books:
         raise HTTPException(status_code=404, detail="No books found in this category")
-    return books
+    return ORJSONResponse(books)
 
 # Endpoint to GET Books by publisher
 @app.get("/books/publisher/{publisher}/", response_model=List[schema.Book], tags=["Book"])
-def get_books_by_publisher(publisher: str, db: Session = Depends(get_db)):
-    books = crud.get_books_by_publisher(db=db, publisher=publisher)
+async def get_books_by_publisher(publisher: str, db: AsyncSession = Depends(get_async_db)):
+    books = await db.run_sync(crud.get_books_by_publisher, publisher=publisher)
     if not books:
         raise HTTPException(status_code=404, detail="No books found for this publisher")
-    return books
+    return ORJSONResponse(books)
+
+
+
+# Endpoint to GET book cache hit, miss and eviction counters
+@app.get("/metrics/cache", tags=["Book"])
+def get_cache_metrics():
+    return book_cache.metrics()
+
+
+# Range digests for the admin service's reconcile tool (see digest.py); only digests of
+# matching ranges cross the network, rows are fetched just for ranges that differ.
+# They expose every user's name and email, so they need the shared SYNC_TOKEN and
+# are switched off without one.
+SYNC_TOKEN = os.getenv("SYNC_TOKEN", "")
+SYNC_MAX_ROWS = int(os.getenv("SYNC_MAX_ROWS", "10000"))
+SyncTable = Literal["books", "users"]
+
+
+def require_sync_token(x_sync_token: str = Header("")):
+    if not SYNC_TOKEN or not secrets.compare_digest(x_sync_token.encode(), SYNC_TOKEN.encode()):
+        raise HTTPException(status_code=403, detail="Sync endpoints need a valid X-Sync-Token")
+
+
+sync = APIRouter(prefix="/sync", tags=["Sync"], dependencies=[Depends(require_sync_token)], include_in_schema=False)
+
+
+@sync.get("/{table}/bounds")
+async def sync_bounds(table: SyncTable, db: AsyncSession = Depends(get_async_db)):
+    return await db.run_sync(digest.bounds, table)
+
+
+@sync.get("/{table}/digests")
+async def sync_digests(table: SyncTable, lo: int, hi: int, parts: int = Query(16, ge=1, le=1024),
+                       db: AsyncSession = Depends(get_async_db)):
+    return await db.run_sync(digest.range_digests, table, lo, hi, parts)
+
+
+@sync.get("/{table}/rows")
+async def sync_rows(table: SyncTable, lo: int, hi: int, db: AsyncSession = Depends(get_async_db)):
+    rows = await db.run_sync(digest.range_rows, table, lo, hi, SYNC_MAX_ROWS + 1)
+    if len(rows) > SYNC_MAX_ROWS:
+        raise HTTPException(status_code=400, detail=f"More than {SYNC_MAX_ROWS} rows in range; narrow it with digests")
+    return ORJSONResponse(rows)
+
 
+app.include_router(sync)
 
 
 @app.get("/")
@@ -0,0 +1,209 @@
+import asyncio
+import os
+import time
+from collections import namedtuple
+from messaging.codec import JSON, properties
+from messaging.publisher import ChannelPool
+
+ASYNC_PUBLISH_QUEUE_SIZE = int(os.getenv("ASYNC_PUBLISH_QUEUE_SIZE", "10000"))
+ASYNC_PUBLISH_BATCH_SIZE = int(os.getenv("ASYNC_PUBLISH_BATCH_SIZE", "200"))
+# What to do when the queue is full: "block" (for a while) or "drop"; either way
+# a message that is not sent here stays in the outbox for the relay
+ASYNC_PUBLISH_FULL_POLICY = os.getenv("ASYNC_PUBLISH_FULL_POLICY", "block")
+ASYNC_PUBLISH_BLOCK_TIMEOUT = float(os.getenv("ASYNC_PUBLISH_BLOCK_TIMEOUT", "1.0"))
+# After leaving a message to the relay, leave every new one to it for this long.
+# Keep it above OUTBOX_RELAY_DELAY plus a relay poll, so the relay has sent the
+# left-over message before the fast path resumes with anything newer.
+ASYNC_PUBLISH_HANDOFF_SECONDS = float(os.getenv("ASYNC_PUBLISH_HANDOFF_SECONDS", "15"))
+ASYNC_PUBLISH_SHUTDOWN_TIMEOUT = float(os.getenv("ASYNC_PUBLISH_SHUTDOWN_TIMEOUT", "10"))
+# Hold keyed messages this long and send only the latest per key (0 disables).
+# Keep it well below OUTBOX_RELAY_DELAY so the relay does not race the window.
+ASYNC_PUBLISH_COALESCE_MS = int(os.getenv("ASYNC_PUBLISH_COALESCE_MS", "0"))
+
+# `source` is the database bind whose outbox holds the message
+OutboundMessage = namedtuple("OutboundMessage", ["routing_key", "body", "message_id", "source", "content_type"],
+                             defaults=[None, None, JSON])
+
+
+class AsyncPublisher:
+    """Fire-and-forget publisher that runs on the application's event loop.
+
+    Endpoints hand messages to a bounded asyncio queue and return at once; a
+    background task drains the queue in batches and publishes each batch as
+    one channel transaction in a worker thread, so request latency no longer
+    depends on RabbitMQ. submit() may be called from the loop or from the
+    threadpool that runs sync endpoints. on_published only gets batches the
+    broker has committed, so their outbox rows can go.
+
+    Messages submitted with a coalesce_key are held for coalesce_window_ms;
+    a newer message with the same key replaces the pending one (latest wins)
+    and the replaced message is passed to on_superseded.
+
+    This is only a latency shortcut for outbox events: a message that does
+    not fit in the queue or fails to publish is left to the outbox relay. The
+    relay sends it later, so for handoff_seconds afterwards submit() leaves
+    every new message to the relay as well, and a failed batch abandons the
+    rest of the queue. Otherwise an unversioned book_deleted could overtake
+    the book_created left behind and be undone by it.
+    """
+
+    def __init__(self, pool=None, maxsize=ASYNC_PUBLISH_QUEUE_SIZE, batch_size=ASYNC_PUBLISH_BATCH_SIZE,
+                 full_policy=ASYNC_PUBLISH_FULL_POLICY, block_timeout=ASYNC_PUBLISH_BLOCK_TIMEOUT,
+                 handoff_seconds=ASYNC_PUBLISH_HANDOFF_SECONDS, coalesce_window_ms=ASYNC_PUBLISH_COALESCE_MS):
+        if full_policy not in ("block", "drop"):
+            raise ValueError(f"Unknown full policy: {full_policy}")
+        # Its own transactional channels; the shared pool's channels are not confirmed
+        self.pool = pool if pool is not None else ChannelPool(transactional=True)
+        self.maxsize = maxsize
+        self.batch_size = batch_size
+        self.full_policy = full_policy
+        self.block_timeout = block_timeout
+        self.handoff_seconds = handoff_seconds
+        self.coalesce_window = coalesce_window_ms / 1000
+        self.on_published = None
+        self.on_superseded = None
+        self.stats = {"submitted": 0, "published": 0, "left_to_relay": 0, "failed": 0, "coalesced": 0}
+        self._handoff_until = 0.0
+        self._pending = {}
+        self._background = set()
+        self._loop = None
+        self._queue = None
+        self._task = None
+
+    @property
+    def running(self):
+        return self._task is not None and not self._task.done()
+
+    async def start(self, on_published=None, on_superseded=None):
+        """Start the background publishing task on the running loop."""
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue(maxsize=self.maxsize)
+        self.on_published = on_published
+        self.on_superseded = on_superseded
+        self._handoff_until = 0.0
+        self._task = asyncio.create_task(self._run())
+        print("📤 Async publisher started")
+
+    async def stop(self, timeout=ASYNC_PUBLISH_SHUTDOWN_TIMEOUT):
+        """Flush queued messages, then stop the task and close the pool."""
+        if not self.running:
+            return
+        # Send held messages now instead of waiting out the coalescing window
+        for key in list(self._pending):
+            self._release(key)
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+        except asyncio.TimeoutError:
+            print(f"⚠️ Async publisher flush timed out with {self._queue.qsize()} messages queued")
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        if self._background:
+            await asyncio.gather(*self._background, return_exceptions=True)
+        # Whatever could not be flushed is still in the outbox
+        self.stats["left_to_relay"] += self._queue.qsize()
+        self._task = None
+        await asyncio.to_thread(self.pool.close)
+        print(f"📤 Async publisher stopped: {self.stats}")
+
+    def submit(self, message: OutboundMessage, coalesce_key=None):
+        """Queue a message without waiting for the broker.
+
+        Returns False when the publisher is not running or is handing off to
+        the relay, so the caller can fall back to another delivery path.
+        """
+        if not self.running or time.monotonic() < self._handoff_until:
+            return False
+        self.stats["submitted"] += 1
+        if coalesce_key is not None and self.coalesce_window > 0:
+            key = (message.routing_key, coalesce_key)
+            if self._in_loop():
+                self._coalesce(key, message)
+            else:
+                self._loop.call_soon_threadsafe(self._coalesce, key, message)
+        elif self._in_loop():
+            if self.full_policy == "block" and self._queue.full():
+                self._loop.create_task(self._queue.put(message))
+            else:
+                self._offer(message)
+        elif self.full_policy == "block":
+            # Sync endpoints wait up to block_timeout for space, then drop
+            future = asyncio.run_coroutine_threadsafe(self._queue.put(message), self._loop)
+            try:
+                future.result(self.block_timeout)
+            except Exception:
+                future.cancel()
+                self._loop.call_soon_threadsafe(self._hand_off, 1)
+        else:
+            self._loop.call_soon_threadsafe(self._offer, message)
+        return True
+
+    def _in_loop(self):
+        try:
+            return asyncio.get_running_loop() is self._loop
+        except RuntimeError:
+            return False
+
+    def _coalesce(self, key, message):
+        superseded = self._pending.get(key)
+        self._pending[key] = message
+        if superseded is None:
+            self._loop.call_later(self.coalesce_window, self._release, key)
+            return
+        self.stats["coalesced"] += 1
+        if self.on_superseded:
+            task = self._loop.create_task(asyncio.to_thread(self.on_superseded, [superseded]))
+            self._background.add(task)
+            task.add_done_callback(self._background.discard)
+
+    def _release(self, key):
+        message = self._pending.pop(key, None)
+        if message is not None:
+            self._offer(message)
+
+    def _offer(self, message):
+        try:
+            self._queue.put_nowait(message)
+        except asyncio.QueueFull:
+            self._hand_off(1)
+
+    def _hand_off(self, count):
+        """Leave messages to the relay, and everything newer until it has caught up."""
+        self.stats["left_to_relay"] += count
+        self._handoff_until = time.monotonic() + self.handoff_seconds
+
+    def _publish_batch(self, batch):
+        self.pool.publish_batch([
+            (message.routing_key, message.body, properties(message.content_type, message.message_id))
+            for message in batch
+        ])
+
+    async def _run(self):
+        while True:
+            batch = [await self._queue.get()]
+            while len(batch) < self.batch_size and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            try:
+                await asyncio.to_thread(self._publish_batch, batch)
+                self.stats["published"] += len(batch)
+                if self.on_published:
+                    await asyncio.to_thread(self.on_published, batch)
+            except Exception as e:
+                self.stats["failed"] += len(batch)
+                print(f"❌ Async publish of {len(batch)} messages failed: {e}; leaving them to the outbox relay")
+                # Newer queued messages must not overtake the failed ones
+                abandoned = 0
+                while not self._queue.empty():
+                    self._queue.get_nowait()
+                    self._queue.task_done()
+                    abandoned += 1
+                self._hand_off(len(batch) + abandoned)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+
+# Shared publisher started by the FastAPI lifespan
+publisher = AsyncPublisher()
@@ -0,0 +1,77 @@
+import json
+import os
+import struct
+from datetime import date
+import pika
+from pydantic import ValidationError
+from messaging.events import EVENTS, SCHEMA_VERSION
+
+try:
+    import msgpack
+except ImportError:  # JSON stays available as a fallback
+    msgpack = None
+
+JSON = "application/json"
+MSGPACK = "application/msgpack"
+
+# Content type used for new messages; consumers accept both
+MESSAGE_CODEC = os.getenv("MESSAGE_CODEC", MSGPACK if msgpack else JSON)
+
+# msgpack extension type for dates: 4-byte proleptic ordinal instead of a string
+_DATE_EXT = 1
+
+
+def _pack_default(value):
+    if isinstance(value, date):
+        return msgpack.ExtType(_DATE_EXT, struct.pack(">I", value.toordinal()))
+    raise TypeError(f"Cannot encode {type(value).__name__}")
+
+
+def _unpack_ext(code, data):
+    if code == _DATE_EXT:
+        return date.fromordinal(struct.unpack(">I", data)[0])
+    return msgpack.ExtType(code, data)
+
+
+def encode(message: dict, content_type: str = MESSAGE_CODEC):
+    """Serialize an event dict, returning (body, content_type)."""
+    if content_type == MSGPACK and msgpack is not None:
+        return msgpack.packb(message, default=_pack_default), MSGPACK
+    return json.dumps(message, default=str).encode(), JSON
+
+
+def properties(content_type, message_id=None, **kwargs):
+    """AMQP properties carrying the codec and schema version of a message."""
+    return pika.BasicProperties(
+        content_type=content_type,
+        message_id=str(message_id) if message_id is not None else None,
+        headers={"schema_version": SCHEMA_VERSION},
+        **kwargs,
+    )
+
+
+def decode_event(routing_key, properties, body):
+    """Decode and validate a message in one step.
+
+    Returns the validated event model, or None (after logging) when the
+    message cannot be decoded, fails validation or comes from a newer schema.
+    Messages without properties are treated as legacy JSON.
+    """
+    content_type = getattr(properties, "content_type", None) or JSON
+    headers = getattr(properties, "headers", None) or {}
+    version = headers.get("schema_version", 1)
+    if version > SCHEMA_VERSION:
+        print(f"⚠️ Unsupported {routing_key} schema version {version}")
+        return None
+
+    model = EVENTS[routing_key]
+    try:
+        if content_type == MSGPACK:
+            if msgpack is None:
+                print(f"⚠️ Cannot decode {routing_key}: msgpack is not installed")
+                return None
+            return model.model_validate(msgpack.unpackb(body, ext_hook=_unpack_ext))
+        return model.model_validate_json(body)
+    except (ValidationError, ValueError) as e:
+        print(f"⚠️ Invalid {routing_key} message format: {e}")
+        return None
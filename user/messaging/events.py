@@ -0,0 +1,109 @@
+from datetime import date
+from typing import List, Optional
+from pydantic import BaseModel
+
+# Bump when an event's fields change incompatibly; consumers reject newer versions
+SCHEMA_VERSION = 1
+
+
+# Versioned events carry the origin row's version; 0 marks legacy messages
+class UserCreated(BaseModel):
+    user_id: int
+    firstname: str
+    lastname: str
+    email: str
+    version: int = 0
+
+
+class UserDeleted(BaseModel):
+    user_id: int
+
+
+class BookRecord(BaseModel):
+    book_id: int
+    title: str
+    publisher: str
+    category: str
+    available: bool
+    version: int = 0
+
+
+class BookUpdated(BaseModel):
+    """Catalog fields only; availability is loan state and travels in loan events."""
+    book_id: int
+    title: str
+    publisher: str
+    category: str
+    version: int = 0
+
+
+class BookAvailability(BaseModel):
+    """An admin override of a book's availability, applied by the user service as a loan change."""
+    book_id: int
+    available: bool
+
+
+class BooksCreated(BaseModel):
+    """A chunk of books from a bulk catalog import."""
+    books: List[BookRecord]
+
+
+class BookDeleted(BaseModel):
+    book_id: int
+
+
+class BooksDeleted(BaseModel):
+    """Books removed by one bulk delete."""
+    book_ids: List[int]
+
+
+class UsersDeleted(BaseModel):
+    user_ids: List[int]
+
+
+class BookLoan(BaseModel):
+    book_id: int
+    available: bool
+    borrower_id: Optional[int]
+    borrow_date: Optional[date]
+    return_date: Optional[date]
+    version: int = 0
+
+
+class BooksInvalidated(BaseModel):
+    """Books whose cached copies a user service replica must drop."""
+    book_ids: List[int]
+
+
+class LoanReminder(BaseModel):
+    book_id: int
+    title: str
+    borrower_id: int
+    email: str
+    firstname: str
+    return_date: date
+    # "overdue" or "due_soon"
+    kind: str
+
+
+class LoanReminders(BaseModel):
+    """One scheduler chunk of reminders for a notification service."""
+    reminders: List[LoanReminder]
+
+
+# Schema for every routing key exchanged between the two services
+EVENTS = {
+    "user_created": UserCreated,
+    "user_deleted": UserDeleted,
+    "book_created": BookRecord,
+    "book_updated": BookUpdated,
+    "book_availability": BookAvailability,
+    "books_created": BooksCreated,
+    "book_deleted": BookDeleted,
+    "books_deleted": BooksDeleted,
+    "users_deleted": UsersDeleted,
+    "book_borrowed": BookLoan,
+    "book_returned": BookLoan,
+    "books_invalidated": BooksInvalidated,
+    "loan_reminders": LoanReminders,
+}
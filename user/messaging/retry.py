@@ -0,0 +1,156 @@
+"""Delayed retries and dead-lettering for consumer queues.
+
+A message whose handler fails is re-published to a retry queue for the
+delay of its attempt, and acked once the broker has confirmed the copy
+(consumer channels run in confirm mode). Each retry queue holds messages
+for its delay (x-message-ttl) and then dead-letters them back to the
+consumer queue, so a failing message waits out its backoff outside the
+queue instead of blocking or hot-looping in front of healthy traffic.
+There is one queue per delay because RabbitMQ only expires messages at the
+head of a queue: mixing delays in one queue would hold short ones behind
+long ones. The delay is part of the queue name, so changing RETRY_* only
+adds queues instead of redeclaring existing ones with other arguments.
+
+After RETRY_MAX_ATTEMPTS retries, or straight away for messages that can
+never be decoded, the message is parked in the queue's dead-letter queue.
+Inspect and replay those with:
+
+    python -m messaging.retry list|replay EVENT [--limit N]
+"""
+import os
+import sys
+from datetime import datetime
+import pika
+from messaging import topology
+
+RETRY_MAX_ATTEMPTS = int(os.getenv("RETRY_MAX_ATTEMPTS", "5"))
+RETRY_BASE_DELAY_MS = int(os.getenv("RETRY_BASE_DELAY_MS", "1000"))
+RETRY_MAX_DELAY_MS = int(os.getenv("RETRY_MAX_DELAY_MS", "300000"))
+
+ATTEMPT_HEADER = "x-retry-attempt"
+# Messages coming back from a retry queue carry the queue name as routing key
+EVENT_HEADER = "x-event"
+
+
+def retry_delay_ms(attempt):
+    """Exponential backoff: base, 2 x base, 4 x base, ... capped at RETRY_MAX_DELAY_MS."""
+    return min(RETRY_BASE_DELAY_MS * 2 ** (attempt - 1), RETRY_MAX_DELAY_MS)
+
+
+def retry_queue(queue, attempt):
+    return f"{queue}.retry.{retry_delay_ms(attempt)}ms"
+
+
+def dead_letter_queue(queue):
+    return f"{queue}.dead"
+
+
+def declare_queues(channel, events):
+    """Declare the retry queues and dead-letter queue of each event's consumer queue."""
+    for event in events:
+        queue = topology.queue_name(event)
+        for attempt in range(1, RETRY_MAX_ATTEMPTS + 1):
+            # Capped delays repeat; declaring the same queue twice is a no-op
+            channel.queue_declare(queue=retry_queue(queue, attempt), durable=False, arguments={
+                "x-message-ttl": retry_delay_ms(attempt),
+                "x-dead-letter-exchange": "",
+                "x-dead-letter-routing-key": queue,
+            })
+        channel.queue_declare(queue=dead_letter_queue(queue), durable=True)
+
+
+def event_name(method, properties):
+    """The event a delivery carries, whether fresh from the exchange or back from a retry."""
+    headers = (properties.headers if properties is not None else None) or {}
+    return headers.get(EVENT_HEADER) or topology.event_name(method.routing_key)
+
+
+def attempts(properties):
+    return int(((properties.headers if properties is not None else None) or {}).get(ATTEMPT_HEADER, 0))
+
+
+def defer(channel, event, properties, body, reason="handler failed"):
+    """Re-publish a failed message to its next retry queue, or dead-letter it.
+
+    On a confirm-mode channel this returns once the broker has the copy,
+    and raises (UnroutableError, NackError) if it does not; only then may
+    the caller ack the original delivery. A crash in between only
+    duplicates the message. Returns the queue it was sent to.
+    """
+    attempt = attempts(properties) + 1
+    queue = topology.queue_name(event)
+    target = retry_queue(queue, attempt) if attempt <= RETRY_MAX_ATTEMPTS else dead_letter_queue(queue)
+    return _republish(channel, target, event, properties, body, {ATTEMPT_HEADER: attempt, "x-last-failure": reason})
+
+
+def dead_letter(channel, event, properties, body, reason):
+    """Park a message that retrying cannot fix (e.g. it does not decode)."""
+    return _republish(channel, dead_letter_queue(topology.queue_name(event)), event, properties, body,
+                      {ATTEMPT_HEADER: attempts(properties), "x-last-failure": reason})
+
+
+def _republish(channel, target, event, properties, body, headers):
+    headers = {**((properties.headers if properties is not None else None) or {}), **headers, EVENT_HEADER: event}
+    if target.endswith(".dead"):
+        headers["x-dead-lettered-at"] = datetime.utcnow().isoformat()
+    channel.basic_publish(exchange="", routing_key=target, body=body, mandatory=True, properties=pika.BasicProperties(
+        content_type=properties.content_type if properties is not None else None,
+        message_id=properties.message_id if properties is not None else None,
+        headers=headers,
+        delivery_mode=2,  # The dead-letter queue is durable; its messages must be too
+    ))
+    print(f"↪️ {event} message sent to {target} ({headers['x-last-failure']})")
+    return target
+
+
+def inspect(channel, event, limit=20):
+    """Peek at dead-lettered messages; they stay in the queue."""
+    from messaging.codec import decode_event
+
+    queue = dead_letter_queue(topology.queue_name(event))
+    messages, last_tag = [], None
+    for _ in range(limit):
+        method, properties, body = channel.basic_get(queue=queue, auto_ack=False)
+        if method is None:
+            break
+        last_tag = method.delivery_tag
+        message = decode_event(event, properties, body)
+        messages.append({"headers": properties.headers, "data": message.model_dump() if message else body})
+    if last_tag is not None:
+        channel.basic_nack(delivery_tag=last_tag, multiple=True, requeue=True)  # Put them all back
+    return messages
+
+
+def replay(channel, event, limit=None):
+    """Move dead-lettered messages back to the consumer queue with a fresh attempt count."""
+    queue = topology.queue_name(event)
+    replayed = 0
+    while limit is None or replayed < limit:
+        method, properties, body = channel.basic_get(queue=dead_letter_queue(queue), auto_ack=False)
+        if method is None:
+            break
+        headers = {key: value for key, value in (properties.headers or {}).items()
+                   if key not in (ATTEMPT_HEADER, "x-last-failure", "x-dead-lettered-at")}
+        channel.basic_publish(exchange="", routing_key=queue, body=body, mandatory=True, properties=pika.BasicProperties(
+            content_type=properties.content_type, message_id=properties.message_id, headers=headers, delivery_mode=2))
+        channel.basic_ack(delivery_tag=method.delivery_tag)
+        replayed += 1
+    return replayed
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    limit = int(args[args.index("--limit") + 1]) if "--limit" in args else None
+    if len(args) < 2 or args[0] not in ("list", "replay"):
+        sys.exit("usage: python -m messaging.retry list|replay EVENT [--limit N]")
+    from messaging.config import get_rabbitmq_connection
+
+    connection = get_rabbitmq_connection()
+    channel = connection.channel()
+    if args[0] == "list":
+        for message in inspect(channel, args[1], limit or 20):
+            print(f"💀 {message['headers']}\n   {message['data']}")
+    else:
+        channel.confirm_delivery()  # Each replayed message is confirmed before its dead copy is acked
+        print(f"🔁 Replayed {replay(channel, args[1], limit)} {args[1]} messages")
+    connection.close()
@@ -0,0 +1,81 @@
+import os
+
+# One topic exchange carries every inter-service event
+EXCHANGE = os.getenv("RABBITMQ_EXCHANGE", "library.events")
+# Replicas with their own database set a distinct prefix to get their own queues
+QUEUE_PREFIX = os.getenv("RABBITMQ_QUEUE_PREFIX", "")
+
+# Event name (used throughout the code) -> routing key on the exchange
+ROUTING_KEYS = {
+    "user_created": "user.created",
+    "user_deleted": "user.deleted",
+    "book_created": "book.created",
+    "book_updated": "book.updated",
+    "book_availability": "book.availability",
+    "books_created": "book.created.batch",
+    "book_deleted": "book.deleted",
+    "books_deleted": "book.deleted.batch",
+    "users_deleted": "user.deleted.batch",
+    "book_borrowed": "book.borrowed",
+    "book_returned": "book.returned",
+    # Broadcast by the user consumer to every user API process after it commits
+    "books_invalidated": "cache.books.invalidated",
+    # Published by the admin reminder scheduler
+    "loan_reminders": "loan.reminders",
+}
+EVENT_NAMES = {routing_key: event for event, routing_key in ROUTING_KEYS.items()}
+
+# Queues that must survive a broker restart
+DURABLE_EVENTS = {"loan_reminders"}
+
+# Events each service consumes
+CONSUMES = {
+    "admin": ["user_created", "book_borrowed", "book_returned"],
+    "user": ["book_created", "book_deleted", "user_deleted", "book_updated", "books_created", "books_deleted",
+             "users_deleted", "book_availability"],
+    # Read by a notification service; declared by the reminder scheduler as well
+    "notifications": ["loan_reminders"],
+}
+
+
+def routing_key(event):
+    return ROUTING_KEYS.get(event, event)
+
+
+def event_name(routing_key):
+    """Map a delivery's routing key back to the event name."""
+    return EVENT_NAMES.get(routing_key, routing_key)
+
+
+def queue_name(event):
+    return f"{QUEUE_PREFIX}.{event}" if QUEUE_PREFIX else event
+
+
+def declare_exchange(channel):
+    """Declare the event exchange. Publishers call this once per channel."""
+    channel.exchange_declare(exchange=EXCHANGE, exchange_type="topic", durable=True)
+
+
+def bind_queues(channel, events):
+    """Declare a consumer's queues and bind them to the exchange; returns
+    {queue: event}."""
+    declare_exchange(channel)
+    queues = {}
+    for event in events:
+        queue = queue_name(event)
+        channel.queue_declare(queue=queue, durable=event in DURABLE_EVENTS)
+        channel.queue_bind(queue=queue, exchange=EXCHANGE, routing_key=ROUTING_KEYS[event])
+        queues[queue] = event
+    return queues
+
+
+if __name__ == "__main__":
+    # Declare the whole topology up front, e.g. during deployment
+    from messaging.config import get_rabbitmq_connection
+
+    connection = get_rabbitmq_connection()
+    channel = connection.channel()
+    for service, events in CONSUMES.items():
+        bind_queues(channel, events)
+        print(f"✅ Declared {service} queues on exchange {EXCHANGE}")
+    connection.close()
@@ -1,4 +1,5 @@
-from sqlalchemy import Boolean, Column, Date, ForeignKey, Integer, String
+from datetime import datetime
+from sqlalchemy import Boolean, Column, Date, DateTime, ForeignKey, Index, Integer, LargeBinary, String
 from sqlalchemy.orm import relationship
 from database import Base
 
@@ -9,6 +10,8 @@ class User(Base):
     email = Column(String(255), unique=True, index=True, nullable=False)
     lastname = Column(String(255), index=True, nullable=False)
     firstname = Column(String(255), index=True, nullable=False)
+    # Bumped by the user service, which owns user records
+    version = Column(Integer, nullable=False, default=1, server_default="1")
 
     # Relationship with books (No cascade delete)
     books = relationship("Book", back_populates="user")
@@ -23,8 +26,37 @@ class Book(Base):
     available = Column(Boolean, index=True, default=True, nullable=False)
     borrow_date = Column(Date, nullable=True)
     return_date = Column(Date, nullable=True)
+    # Catalog changes are versioned by the admin service, loans by the user service
+    version = Column(Integer, nullable=False, default=1, server_default="1")
+    loan_version = Column(Integer, nullable=False, default=0, server_default="0")
     
     borrower_id = Column(Integer, ForeignKey("users.id", ondelete="SET NULL"), nullable=True)
 
     # Relationship with user (borrower)
     user = relationship("User", back_populates="books")
+
+    # create_all only adds these to new databases; existing ones need them created once
+    __table_args__ = (
+        # Filtered browsing (GET /books): equality filters, then id for keyset paging
+        Index("ix_books_category_publisher_available", "category", "publisher", "available", "id"),
+        Index("ix_books_publisher_available", "publisher", "available", "id"),
+        Index("ix_books_category_available", "category", "available", "id"),
+        # Serves MATCH ... AGAINST searches on MySQL
+        Index("ix_books_fulltext", "title", "publisher", "category", mysql_prefix="FULLTEXT").ddl_if(dialect="mysql"),
+    )
+
+class OutboxEvent(Base):
+    """Event written in the same transaction as the change it describes."""
+    __tablename__ = "outbox"
+
+    id = Column(Integer, primary_key=True, index=True)
+    routing_key = Column(String(100), nullable=False)
+    payload = Column(LargeBinary, nullable=False)
+    content_type = Column(String(50), nullable=False, default="application/json")
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+
+class DeletedBook(Base):
+    """Tombstone of a book deleted in the Admin API, so redelivered creates cannot bring it back."""
+    __tablename__ = "deleted_books"
+
+    id = Column(Integer, primary_key=True)
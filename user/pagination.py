@@ -0,0 +1,36 @@
+import base64
+import json
+
+
+# Cursors are opaque to clients: base64 of the last key on the previous page
+def encode_cursor(last_id):
+    return base64.urlsafe_b64encode(json.dumps({"id": last_id}).encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    """Return the key to continue after, or None for the first page ("")."""
+    if not cursor:
+        return None
+    try:
+        data = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        return int(data["id"])
+    except (ValueError, TypeError, KeyError):
+        raise ValueError("Invalid cursor")
+
+
+def keyset_page(query, key, cursor, limit):
+    """Fetch one page of query ordered by key, starting after the cursor.
+
+    The database seeks straight to the cursor through the key's index, so
+    page 10,000 costs the same as page 1, and rows inserted meanwhile never
+    shift later pages. Returns (rows, next_cursor); next_cursor is None on
+    the last page.
+    """
+    after = decode_cursor(cursor)
+    if after is not None:
+        query = query.filter(key > after)
+    rows = query.order_by(key).limit(limit + 1).all()
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, encode_cursor(getattr(rows[-1], key.key))
@@ -1,74 +1,51 @@
-import pika
-import json
-from messaging.config import get_rabbitmq_connection
-
-def send_user_created_message(user_id, lastname, firstname, email):
-    """Send a message when a new user is created in the User API."""
-    connection = get_rabbitmq_connection()
-    channel = connection.channel()
-
-    # Declare the queue
-    channel.queue_declare(queue="user_created")
+from sqlalchemy.orm import Session
+from outbox import stage_event
 
+def send_user_created_message(db: Session, user_id, firstname, lastname, email, version):
+    """Queue a user_created event in the caller's transaction."""
     # Create the message data
     message = {
         "user_id": user_id,
         "firstname": firstname,
         "lastname": lastname,
         "email": email,
+        "version": version,
     }
     
-    # Send the message
-    channel.basic_publish(exchange="", routing_key="user_created", body=json.dumps(message))
-
-    print(f"📨 Sent user_created message: {message}")
-    channel.close()
-    connection.close()
+    stage_event(db, "user_created", message)
 
+    print(f"📨 Queued user_created message: {message}")
 
-def send_book_borrowed(book_id, available, borrower_id, borrow_date, return_date):
-    """Send a message when a book is borrowed."""
-    connection = get_rabbitmq_connection()
-    channel = connection.channel()
-
-    # Declare queue for book borrowed event
-    channel.queue_declare(queue="book_borrowed")
 
+def send_book_borrowed(db: Session, book_id, available, borrower_id, borrow_date, return_date, version):
+    """Queue a book_borrowed event in the caller's transaction."""
     # Create message data
     message = {
         "book_id": book_id,
         "available": available,
         "borrower_id": borrower_id,
         "borrow_date": borrow_date,
-        "return_date": return_date
+        "return_date": return_date,
+        "version": version,
     }
     
-    channel.basic_publish(exchange="", routing_key="book_borrowed", body=json.dumps(message, default=str))
-
-    print(f"📨 Sent borrowed book message: {message}")
-    channel.close()
-    connection.close()
-
+    stage_event(db, "book_borrowed", message)
 
-def return_book_borrowed(book_id, available, borrower_id, borrow_date, return_date):
-    """Send a message when a book is returned."""
-    connection = get_rabbitmq_connection()
-    channel = connection.channel()
+    print(f"📨 Queued borrowed book message: {message}")
 
-    # Declare queue for book return event
-    channel.queue_declare(queue="book_returned")
 
+def return_book_borrowed(db: Session, book_id, available, borrower_id, borrow_date, return_date, version):
+    """Queue a book_returned event in the caller's transaction."""
     # Create message data
     message = {
         "book_id": book_id,
         "available": available,
         "borrower_id": borrower_id,
         "borrow_date": borrow_date,
-        "return_date": return_date
+        "return_date": return_date,
+        "version": version,
     }
     
-    channel.basic_publish(exchange="", routing_key="book_returned", body=json.dumps(message, default=str))
+    stage_event(db, "book_returned", message)
 
-    print(f"📨 Sent returned book message: {message}")
-    channel.close()
-    connection.close()
\ No newline at end of file
+    print(f"📨 Queued returned book message: {message}")
@@ -0,0 +1,75 @@
+import os
+import time
+import pika
+from database import SessionLocal
+from messaging.config import get_rabbitmq_connection
+from messaging.codec import properties
+from messaging import topology
+import outbox
+
+OUTBOX_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", "500"))
+OUTBOX_POLL_INTERVAL = float(os.getenv("OUTBOX_POLL_INTERVAL", "0.5"))
+# Events younger than this are normally delivered by the API's async publisher
+OUTBOX_RELAY_DELAY = float(os.getenv("OUTBOX_RELAY_DELAY", "5"))
+
+
+def publish_batch(channel, events):
+    """Publish a batch of outbox events and wait for a single broker confirm.
+
+    pika's BlockingChannel only offers per-message synchronous confirms, so the
+    batch is wrapped in a channel transaction instead: tx_commit returns once
+    the broker has accepted every message, in one round trip per batch.
+    """
+    for event in events:
+        channel.basic_publish(
+            exchange=topology.EXCHANGE,
+            routing_key=topology.routing_key(event.routing_key),
+            body=event.payload,
+            properties=properties(event.content_type, event.id),
+        )
+    channel.tx_commit()
+
+
+def relay_once(channel, batch_size=OUTBOX_BATCH_SIZE):
+    """Drain one batch from the outbox. Returns the number of events sent."""
+    db = SessionLocal()
+    try:
+        events = outbox.fetch_batch(db, batch_size, min_age_seconds=OUTBOX_RELAY_DELAY)
+        if not events:
+            db.rollback()
+            return 0
+        publish_batch(channel, events)
+        # A crash before this commit re-sends the batch: delivery is at-least-once
+        outbox.delete_events(db, [event.id for event in events])
+        db.commit()
+        return len(events)
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+def start_relay():
+    """Continuously move committed outbox events to RabbitMQ."""
+    while True:
+        try:
+            connection = get_rabbitmq_connection()
+            channel = connection.channel()
+            topology.declare_exchange(channel)
+            channel.tx_select()
+            print("📤 Outbox relay started...")
+            while True:
+                sent = relay_once(channel)
+                if sent:
+                    print(f"📨 Relayed {sent} outbox events")
+                if sent < OUTBOX_BATCH_SIZE:
+                    connection.sleep(OUTBOX_POLL_INTERVAL)
+
+        except pika.exceptions.AMQPError as e:
+            print(f"🔴 RabbitMQ Connection Error: {e}. Retrying in 5 seconds...")
+            time.sleep(5)
+
+
+if __name__ == "__main__":
+    start_relay()
@@ -1,5 +1,5 @@
 from pydantic import BaseModel, ConfigDict
-from typing import Optional
+from typing import List, Optional
 from datetime import date
 
 class UserBase(BaseModel):
@@ -34,6 +34,11 @@ class Book(BookBase):
     borrow_date: Optional[date] = None
     return_date: Optional[date] = None
 
+# One page of a cursor-paginated listing; pass next_cursor back as ?cursor=
+class BookPage(BaseModel):
+    items: List[Book]
+    next_cursor: Optional[str] = None
+
 class BookCreate(BookBase):
     pass  # Inherits from BookBase
 
@@ -0,0 +1,221 @@
+import bisect
+import heapq
+import math
+import os
+import re
+import threading
+import time
+import pika
+from sqlalchemy import select
+from database import SessionLocal
+from models import Book
+from messaging.config import get_rabbitmq_connection
+from messaging.codec import decode_event
+from messaging import topology
+
+# Set to false to skip the in-memory index; search then falls back to the database
+SEARCH_INDEX_ENABLED = os.getenv("SEARCH_INDEX_ENABLED", "true").lower() in ("1", "true", "yes")
+# How many vocabulary words a trailing prefix ("harr" -> harry, harrow, ...) may expand to
+SEARCH_PREFIX_EXPANSION = int(os.getenv("SEARCH_PREFIX_EXPANSION", "50"))
+
+# Title words count more than publisher or category words
+FIELD_WEIGHTS = {"title": 3, "publisher": 1, "category": 1}
+INDEX_EVENTS = ["book_created", "books_created", "book_updated", "book_deleted", "books_deleted"]
+
+TOKEN = re.compile(r"\w+")
+
+
+def tokenize(text):
+    return TOKEN.findall(text.lower())
+
+
+class BookIndex:
+    """In-memory inverted index over book titles, publishers and categories.
+
+    Each word maps to {book_id: weight}. A query matches books containing
+    every word (the last one as a prefix, for search-as-you-type) and ranks
+    them by the summed idf-weighted field weights. Searching touches only the
+    postings of the query words, so it stays in the millisecond range no
+    matter how many books are indexed.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self.ready = False
+        self._postings = {}
+        self._vocabulary = []  # sorted, for prefix lookups
+        self._documents = {}  # book_id -> indexed words
+        self._versions = {}
+
+    def __len__(self):
+        return len(self._documents)
+
+    def add(self, book_id, title, publisher, category, version=0):
+        """Index or re-index a book; older versions than the indexed one are ignored."""
+        with self._lock:
+            self._add(book_id, title, publisher, category, version)
+
+    def _add(self, book_id, title, publisher, category, version, sort_vocabulary=True):
+        """Without sort_vocabulary new words are left out of the vocabulary; rebuild sorts it once."""
+        if version and version < self._versions.get(book_id, 0):
+            return
+        self._remove(book_id)
+        weights = {}
+        for field, text in (("title", title), ("publisher", publisher), ("category", category)):
+            for word in tokenize(text):
+                weights[word] = weights.get(word, 0) + FIELD_WEIGHTS[field]
+        for word, weight in weights.items():
+            postings = self._postings.get(word)
+            if postings is None:
+                postings = self._postings[word] = {}
+                if sort_vocabulary:
+                    bisect.insort(self._vocabulary, word)
+            postings[book_id] = weight
+        self._documents[book_id] = list(weights)
+        if version:
+            self._versions[book_id] = version
+
+    def remove(self, book_id):
+        with self._lock:
+            self._remove(book_id)
+            self._versions.pop(book_id, None)
+
+    def _remove(self, book_id):
+        for word in self._documents.pop(book_id, ()):
+            postings = self._postings[word]
+            del postings[book_id]
+            if not postings:
+                del self._postings[word]
+                del self._vocabulary[bisect.bisect_left(self._vocabulary, word)]
+
+    def _expand(self, prefix):
+        start = bisect.bisect_left(self._vocabulary, prefix)
+        words = []
+        for word in self._vocabulary[start:start + SEARCH_PREFIX_EXPANSION]:
+            if not word.startswith(prefix):
+                break
+            words.append(word)
+        return words
+
+    def _term_scores(self, words, candidates=None):
+        """Add the best score among words to each candidate containing one of them.
+
+        Without candidates every book containing one of the words is scored;
+        with them only the candidates are looked up, so later query words
+        cost no more than the smallest posting list.
+        """
+        total = len(self._documents)
+        weighted = [(postings, math.log(1 + total / len(postings)))
+                    for postings in (self._postings.get(word) for word in words) if postings]
+        scores = {}
+        if candidates is None:
+            for postings, idf in weighted:
+                for book_id, weight in postings.items():
+                    scores[book_id] = max(scores.get(book_id, 0), weight * idf)
+            return scores
+        for book_id, score in candidates.items():
+            best = max((postings[book_id] * idf for postings, idf in weighted if book_id in postings), default=None)
+            if best is not None:
+                scores[book_id] = score + best
+        return scores
+
+    def search(self, q, limit=20):
+        """Return up to limit book ids, best match first."""
+        words = tokenize(q)
+        if not words:
+            return []
+        with self._lock:
+            # Every word must match, the last one as a prefix; start from the rarest
+            terms = [[word] for word in dict.fromkeys(words[:-1])] + [self._expand(words[-1])]
+            terms.sort(key=lambda term: sum(len(self._postings.get(word, ())) for word in term))
+            ranked = None
+            for term in terms:
+                ranked = self._term_scores(term, ranked)
+                if not ranked:
+                    return []
+        return [book_id for book_id, score in heapq.nsmallest(limit, ranked.items(), key=lambda item: (-item[1], item[0]))]
+
+    def apply(self, event, data):
+        """Update the index from a catalog event."""
+        if event == "book_deleted":
+            self.remove(data["book_id"])
+        elif event == "books_deleted":
+            for book_id in data["book_ids"]:
+                self.remove(book_id)
+        elif event == "books_created":
+            for book in data["books"]:
+                self.add(book["book_id"], book["title"], book["publisher"], book["category"], book["version"])
+        else:
+            self.add(data["book_id"], data["title"], data["publisher"], data["category"], data["version"])
+
+    def rebuild(self, db):
+        """Replace the index with every book in the database."""
+        fresh = BookIndex()
+        rows = db.execute(
+            select(Book.id, Book.title, Book.publisher, Book.category, Book.version)
+            .execution_options(yield_per=10000)
+        )
+        # Sorting the vocabulary once is O(V log V); an insort per new word would be O(V^2)
+        for row in rows:
+            fresh._add(*row, sort_vocabulary=False)
+        fresh._vocabulary = sorted(fresh._postings)
+        with self._lock:
+            self._postings, self._vocabulary = fresh._postings, fresh._vocabulary
+            self._documents, self._versions = fresh._documents, fresh._versions
+            self.ready = True
+        print(f"🔎 Search index built with {len(self)} books")
+
+
+def _rebuild(index, session_factory):
+    db = session_factory()
+    try:
+        index.rebuild(db)
+    except Exception as e:
+        print(f"❌ Search index rebuild failed: {e}")
+    finally:
+        db.close()
+
+
+def listen(index, session_factory=SessionLocal):
+    """Keep the index current from catalog events on a private queue.
+
+    The queue only exists while connected, so the index is rebuilt from the
+    database after every (re)connect; the queue is bound first, so nothing
+    committed after the snapshot is missed.
+    """
+    def on_message(ch, method, properties, body):
+        event = topology.event_name(method.routing_key)
+        message = decode_event(event, properties, body)
+        if message is not None:
+            index.apply(event, message.model_dump())
+
+    while True:
+        try:
+            connection = get_rabbitmq_connection()
+            channel = connection.channel()
+            topology.declare_exchange(channel)
+            queue = channel.queue_declare(queue="", exclusive=True, auto_delete=True).method.queue
+            for event in INDEX_EVENTS:
+                channel.queue_bind(queue=queue, exchange=topology.EXCHANGE, routing_key=topology.routing_key(event))
+
+            _rebuild(index, session_factory)
+            channel.basic_consume(queue=queue, on_message_callback=on_message, auto_ack=True)
+            print("🔎 Search index is listening for catalog changes...")
+            channel.start_consuming()
+
+        except pika.exceptions.AMQPError as e:
+            print(f"🔴 Search index lost RabbitMQ ({e}). Retrying in 5 seconds...")
+            # Serve searches from the current database state until events flow again
+            if not index.ready:
+                _rebuild(index, session_factory)
+            time.sleep(5)
+
+
+def start_listener(index):
+    thread = threading.Thread(target=listen, args=(index,), daemon=True, name="search-index")
+    thread.start()
+    return thread
+
+
+# Shared index used by the search endpoint
+index = BookIndex()
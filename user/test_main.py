@@ -4,20 +4,31 @@ import pytest
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.pool import StaticPool
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from fastapi.testclient import TestClient
 
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+# Tests build the search index themselves instead of listening to RabbitMQ
+os.environ.setdefault("SEARCH_INDEX_ENABLED", "false")
+os.environ.setdefault("BOOK_CACHE_LISTEN", "false")
 
-from database import Base, get_db
+from database import Base, get_db, get_async_db
 from main import app
+import models
 
-SQLALCHEMY_DATABASE_URL = "sqlite:///"
+# Shared-cache in-memory database so the sync and async (aiosqlite) engines see the same data
+SQLALCHEMY_DATABASE_URL = "sqlite:///file:user_test?mode=memory&cache=shared&uri=true"
 engine = create_engine(
     SQLALCHEMY_DATABASE_URL,
     connect_args={"check_same_thread": False},
     poolclass=StaticPool,
 )
 TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+async_engine = create_async_engine(
+    "sqlite+aiosqlite:///file:user_test?mode=memory&cache=shared&uri=true",
+    poolclass=StaticPool,
+)
+TestingAsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
 
 Base.metadata.create_all(bind=engine)
 
@@ -30,6 +41,12 @@ def override_get_db():
 
 app.dependency_overrides[get_db] = override_get_db
 
+async def override_get_async_db():
+    async with TestingAsyncSessionLocal() as db:
+        yield db
+
+app.dependency_overrides[get_async_db] = override_get_async_db
+
 @pytest.fixture(scope="module")
 def client():
     with TestClient(app) as c:
@@ -105,7 +122,353 @@ def test_get_books_by_publisher(client, setup_database):
     assert response.status_code == 200
     assert len(response.json()) > 0
 
+def test_borrow_and_return_write_outbox_events(client, setup_database):
+    db = TestingSessionLocal()
+    db.add(models.Book(id=1, title="Test Book", publisher="Test Publisher", category="Fiction", available=True))
+    db.commit()
+    db.close()
+
+    client.post("/Enroll_User/", json={"firstname": "Jane", "lastname": "Doe", "email": "janedoe@example.com"})
+    response = client.post("/books/borrow?email=janedoe@example.com", json={"book_id": 1, "borrow_duration": 7})
+    assert response.status_code == 200
+    response = client.post("/return_book/", json={"book_id": 1})
+    assert response.status_code == 200
+
+    db = TestingSessionLocal()
+    try:
+        keys = [e.routing_key for e in db.query(models.OutboxEvent).order_by(models.OutboxEvent.id)]
+        assert keys == ["user_created", "book_borrowed", "book_returned"]
+    finally:
+        db.close()
+
+def test_consumer_applies_bulk_created_books(setup_database):
+    import consumer
+    db = TestingSessionLocal()
+    db.add(models.Book(id=1, title="Existing", publisher="Pub", category="Fiction", available=True))
+    db.commit()
+    books = [{"book_id": i, "title": f"Book {i}", "publisher": "Pub", "category": "Fiction", "available": True, "version": 1} for i in (1, 2, 3)]
+    consumer.apply_books_created(db, {"books": books})
+    db.commit()
+    try:
+        assert [b.title for b in db.query(models.Book).order_by(models.Book.id)] == ["Existing", "Book 2", "Book 3"]
+    finally:
+        db.close()
+
+def test_consumer_applies_bulk_deletes_set_based(setup_database, monkeypatch):
+    import consumer
+    monkeypatch.setattr(consumer, "SessionLocal", TestingSessionLocal)
+    monkeypatch.setattr(consumer, "BULK_DELETE_CHUNK", 2)
+    broadcasts = []
+    monkeypatch.setattr(consumer, "publish", lambda event, message: broadcasts.append((event, message)))
+    db = TestingSessionLocal()
+    db.add_all([models.User(id=1, firstname="A", lastname="A", email="a@example.com"),
+                models.User(id=2, firstname="B", lastname="B", email="b@example.com")])
+    for i in range(1, 6):
+        db.add(models.Book(id=i, title=f"Book {i}", publisher="Pub", category="Fiction", available=i != 5,
+                           borrower_id=2 if i == 5 else None))
+    db.commit()
+    db.close()
+
+    assert consumer.apply_message("books_deleted", {"book_ids": [1, 2, 3, 99]})
+    assert consumer.apply_message("users_deleted", {"user_ids": [2, 3]})
+    db = TestingSessionLocal()
+    try:
+        assert [(b.id, b.borrower_id) for b in db.query(models.Book).order_by(models.Book.id)] == [(4, None), (5, None)]
+        assert [u.id for u in db.query(models.User)] == [1]
+        assert broadcasts == [("books_invalidated", {"book_ids": [1, 2, 3, 99]}), ("books_invalidated", {"book_ids": [5]})]
+    finally:
+        db.close()
+
 def test_get_root(client):
     response = client.get("/")
     assert response.status_code == 200
-    assert response.json() == {"Hello": "Welcome to the User end of the Library API"}
\ No newline at end of file
+    assert response.json() == {"Hello": "Welcome to the User end of the Library API"}
+
+def test_consumer_skips_stale_book_updates(setup_database, monkeypatch):
+    import consumer
+    monkeypatch.setattr(consumer, "SessionLocal", TestingSessionLocal)
+    monkeypatch.setattr(consumer, "versions", consumer.VersionMap())
+    db = TestingSessionLocal()
+    db.add(models.Book(id=1, title="Original", publisher="Pub", category="Fiction", available=True, version=1))
+    db.commit()
+    db.close()
+
+    update = {"book_id": 1, "publisher": "Pub", "category": "Fiction", "available": True}
+    assert consumer.apply_message("book_updated", {**update, "title": "Third", "version": 3})
+    # Out-of-order older version: rejected by the conditional UPDATE
+    assert consumer.apply_message("book_updated", {**update, "title": "Second", "version": 2})
+    # Duplicate: dropped by the in-memory map before touching the database
+    assert consumer.is_stale("book_updated", {**update, "title": "Third", "version": 3})
+
+    db = TestingSessionLocal()
+    try:
+        book = db.get(models.Book, 1)
+        assert (book.title, book.version) == ("Third", 3)
+    finally:
+        db.close()
+
+    # An update overtaking its create is retried instead of marking the create stale
+    created = {"book_id": 2, "title": "Draft", "publisher": "Pub", "category": "Fiction", "available": True, "version": 1}
+    assert not consumer.apply_message("book_updated", {**update, "book_id": 2, "title": "Final", "version": 2})
+    assert consumer.apply_message("book_created", created)
+    assert consumer.apply_message("book_updated", {**update, "book_id": 2, "title": "Final", "version": 2})
+
+    # Deletes leave a tombstone, so a redelivered create does not resurrect the book
+    assert consumer.apply_message("book_deleted", {"book_id": 2})
+    consumer.versions = consumer.VersionMap()  # As after a restart
+    assert consumer.apply_message("book_created", created)
+
+    db = TestingSessionLocal()
+    try:
+        assert db.get(models.Book, 2) is None
+    finally:
+        db.close()
+
+def test_catalog_update_keeps_loan_recorded_after_it(client, setup_database, monkeypatch):
+    import consumer
+    monkeypatch.setattr(consumer, "SessionLocal", TestingSessionLocal)
+    monkeypatch.setattr(consumer, "versions", consumer.VersionMap())
+    db = TestingSessionLocal()
+    db.add(models.Book(id=1, title="Original", publisher="Pub", category="Fiction", available=True, version=1))
+    db.commit()
+    db.close()
+
+    # The admin read the book as available, then the borrow lands here before its title edit does
+    client.post("/Enroll_User/", json={"firstname": "Jane", "lastname": "Doe", "email": "janedoe@example.com"})
+    assert client.post("/books/borrow?email=janedoe@example.com", json={"book_id": 1, "borrow_duration": 7}).status_code == 200
+    assert consumer.apply_message("book_updated", {"book_id": 1, "title": "Edited", "publisher": "Pub",
+                                                   "category": "Fiction", "available": True, "version": 2})
+    db = TestingSessionLocal()
+    try:
+        book = db.get(models.Book, 1)
+        assert (book.title, book.available, book.loan_version) == ("Edited", False, 1)
+    finally:
+        db.close()
+
+    # An admin override ends the loan as a new loan version and is echoed back
+    assert consumer.apply_message("book_availability", {"book_id": 1, "available": True})
+    db = TestingSessionLocal()
+    try:
+        book = db.get(models.Book, 1)
+        assert (book.available, book.borrower_id, book.loan_version) == (True, None, 2)
+        last = db.query(models.OutboxEvent).order_by(models.OutboxEvent.id.desc()).first()
+        assert last.routing_key == "book_returned"
+    finally:
+        db.close()
+
+def test_search_index_ranks_and_follows_events():
+    from search import BookIndex
+    index = BookIndex()
+    index.add(1, "Dune", "Ace", "Fiction", 1)
+    index.add(2, "Dune Messiah", "Ace", "Fiction", 1)
+    index.add(3, "Gardening", "Dune Press", "Home", 1)
+    assert index.search("dune") == [1, 2, 3]
+    assert index.search("dune mess") == [2]
+    assert index.search("ace fic") == [1, 2]
+
+    index.apply("book_updated", {"book_id": 2, "title": "Children of Dune", "publisher": "Ace", "category": "Fiction", "version": 3})
+    # Stale update arriving late is ignored
+    index.apply("book_updated", {"book_id": 2, "title": "Dune Messiah", "publisher": "Ace", "category": "Fiction", "version": 2})
+    assert index.search("children") == [2]
+    assert index.search("messiah") == []
+    index.apply("book_deleted", {"book_id": 1})
+    assert index.search("dune") == [2, 3]
+
+def test_search_index_rebuild_sorts_vocabulary_once(setup_database):
+    from search import BookIndex
+    db = TestingSessionLocal()
+    db.add_all([models.Book(id=1, title="Zen Garden", publisher="Pub", category="Home", available=True, version=1),
+                models.Book(id=2, title="Alpine Zebras", publisher="Pub", category="Nature", available=True, version=1)])
+    db.commit()
+    index = BookIndex()
+    try:
+        index.rebuild(db)
+    finally:
+        db.close()
+    assert index._vocabulary == sorted(index._vocabulary) and "zebras" in index._vocabulary
+    index.add(3, "Zeppelins", "Pub", "History", 1)
+    assert index._vocabulary == sorted(index._vocabulary)
+    assert index.search("ze") == [1, 2, 3]
+
+def test_search_endpoint_uses_index_or_database(client, setup_database, monkeypatch):
+    import search
+    db = TestingSessionLocal()
+    db.add_all([
+        models.Book(id=1, title="Gardening Basics", publisher="Dune Press", category="Home", available=True),
+        models.Book(id=2, title="Dune", publisher="Ace", category="Fiction", available=True),
+    ])
+    db.commit()
+
+    # Not built yet: falls back to the database
+    monkeypatch.setattr(search, "index", search.BookIndex())
+    response = client.get("/books/search", params={"q": "dune"})
+    assert [b["id"] for b in response.json()] == [2, 1]
+
+    search.index.rebuild(db)
+    db.close()
+    response = client.get("/books/search", params={"q": "dun"})
+    assert response.status_code == 200
+    assert [b["title"] for b in response.json()] == ["Dune", "Gardening Basics"]
+
+def test_book_cache_evicts_expires_and_ignores_racing_loads(monkeypatch):
+    import cache
+    clock = [0.0]
+    monkeypatch.setattr(cache.time, "monotonic", lambda: clock[0])
+    book_cache = cache.BookCache(maxsize=2, ttl=10)
+    assert book_cache.get(1, lambda: "one") == "one"
+    assert book_cache.get(1, lambda: "reloaded") == "one"
+    book_cache.get(2, lambda: "two")
+    book_cache.get(3, lambda: "three")  # evicts 1, the least recently used
+    assert book_cache.get(1, lambda: "one again") == "one again"
+    clock[0] = 11
+    assert book_cache.get(1, lambda: "fresh") == "fresh"
+
+    # An invalidation during a load keeps the (possibly stale) result out of the cache
+    book_cache.get(4, lambda: book_cache.invalidate(4) or "pre-commit")
+    assert book_cache.get(4, lambda: "committed") == "committed"
+    assert {k: book_cache.stats[k] for k in ("hits", "evictions", "expirations")} == {"hits": 1, "evictions": 3, "expirations": 1}
+
+def test_book_lookups_are_cached_and_invalidated(client, setup_database, monkeypatch):
+    import consumer
+    from cache import book_cache
+    book_cache.clear()
+    monkeypatch.setattr(consumer, "SessionLocal", TestingSessionLocal)
+    monkeypatch.setattr(consumer, "versions", consumer.VersionMap())
+    broadcasts = []
+    monkeypatch.setattr(consumer, "publish", lambda event, message: broadcasts.append((event, message)))
+    db = TestingSessionLocal()
+    db.add(models.Book(id=1, title="Dune", publisher="Ace", category="Fiction", available=True, version=1))
+    db.commit()
+    db.close()
+
+    hits = book_cache.stats["hits"]
+    assert client.get("/books/1/").json()["available"] is True
+    assert client.get("/books/1/").json()["available"] is True
+    assert book_cache.stats["hits"] == hits + 1
+
+    # A local borrow drops the cached copy, so availability is never stale
+    client.post("/Enroll_User/", json={"firstname": "Jane", "lastname": "Doe", "email": "janedoe@example.com"})
+    client.post("/books/borrow?email=janedoe@example.com", json={"book_id": 1, "borrow_duration": 7})
+    assert client.get("/books/1/").json()["available"] is False
+
+    # So does a catalog update applied by the consumer, which also tells other processes
+    update = {"book_id": 1, "title": "Dune (Deluxe)", "publisher": "Ace", "category": "Fiction", "available": False, "version": 2}
+    assert consumer.apply_message("book_updated", update)
+    assert client.get("/books/1/").json()["title"] == "Dune (Deluxe)"
+    assert broadcasts == [("books_invalidated", {"book_ids": [1]})]
+    assert client.get("/metrics/cache").json()["size"] == 1
+
+def test_concurrent_borrows_have_exactly_one_winner(tmp_path):
+    import threading
+    import time
+    import crud
+    import schema
+    from fastapi import HTTPException
+    # A file database with a real connection pool, so the threads really contend
+    stress_engine = create_engine(f"sqlite:///{tmp_path}/stress.db", connect_args={"timeout": 30},
+                                  pool_size=50, max_overflow=200)
+    Base.metadata.create_all(bind=stress_engine)
+    StressSession = sessionmaker(autocommit=False, autoflush=False, bind=stress_engine)
+    db = StressSession()
+    db.add(models.Book(id=1, title="Popular", publisher="Pub", category="Fiction", available=True))
+    db.add_all([models.User(id=i, email=f"u{i}@example.com", firstname="U", lastname=str(i)) for i in range(1, 201)])
+    db.commit()
+    db.close()
+
+    outcomes = []
+    start = threading.Barrier(200)
+
+    def borrower(user_id):
+        session = StressSession()
+        start.wait()
+        try:
+            crud.borrow_book(session, schema.BookBorrow(book_id=1, borrow_duration=7), user_id)
+            outcomes.append(("won", user_id))
+        except HTTPException as e:
+            outcomes.append((e.status_code, user_id))
+        finally:
+            session.close()
+
+    threads = [threading.Thread(target=borrower, args=(i,)) for i in range(1, 201)]
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+    print(f"\n200 concurrent borrows of one book in {elapsed:.2f}s ({200 / elapsed:.0f} requests/s)")
+
+    winners = [user_id for outcome, user_id in outcomes if outcome == "won"]
+    assert len(winners) == 1
+    assert sorted(outcome for outcome, _ in outcomes if outcome != "won") == [400] * 199
+
+    db = StressSession()
+    try:
+        book = db.get(models.Book, 1)
+        assert (book.available, book.borrower_id, book.loan_version) == (False, winners[0], 1)
+        assert db.query(models.OutboxEvent).filter(models.OutboxEvent.routing_key == "book_borrowed").count() == 1
+        assert crud.return_book(db, 1).available is True
+        assert crud.return_book(db, 1) is None
+        with pytest.raises(HTTPException) as missing:
+            crud.borrow_book(db, schema.BookBorrow(book_id=99, borrow_duration=7), winners[0])
+        assert missing.value.status_code == 404
+    finally:
+        db.close()
+        stress_engine.dispose()
+
+def test_sync_endpoints_expose_range_digests(client, setup_database, monkeypatch):
+    import digest
+    import main
+    db = TestingSessionLocal()
+    for i in range(1, 11):
+        db.add(models.Book(id=i, title=f"Book {i}", publisher="Pub", category="Fiction", available=True))
+    db.commit()
+    db.close()
+
+    # Off without a configured token, and closed to callers without it
+    assert client.get("/sync/users/rows", params={"lo": 0, "hi": 10}).status_code == 403
+    monkeypatch.setattr(main, "SYNC_TOKEN", "s3cret")
+    assert client.get("/sync/users/rows", params={"lo": 0, "hi": 10}, headers={"X-Sync-Token": "guess"}).status_code == 403
+    token = {"X-Sync-Token": "s3cret"}
+
+    assert client.get("/sync/books/bounds", headers=token).json() == {"lo": 1, "hi": 11}
+    assert client.get("/sync/users/bounds", headers=token).json() is None
+    slices = client.get("/sync/books/digests", params={"lo": 1, "hi": 11, "parts": 4}, headers=token).json()
+    assert [(s["lo"], s["hi"], s["count"]) for s in slices] == [(1, 4, 3), (4, 7, 3), (7, 10, 3), (10, 11, 1)]
+    rows = client.get("/sync/books/rows", params={"lo": 10, "hi": 11}, headers=token).json()
+    assert int(slices[-1]["hash"], 16) == digest.row_hash(rows[0].values())
+    assert client.get("/sync/loans/bounds", headers=token).status_code == 422
+    monkeypatch.setattr(main, "SYNC_MAX_ROWS", 5)
+    assert client.get("/sync/books/rows", params={"lo": 1, "hi": 11}, headers=token).status_code == 400
+
+def test_bootstrap_loads_snapshot_in_batches(setup_database):
+    import gzip
+    import io
+    import orjson
+    import bootstrap
+    columns = {"users": ["id", "firstname", "lastname", "email", "version"],
+               "books": ["id", "title", "publisher", "category", "available", "borrower_id",
+                         "borrow_date", "return_date", "version", "loan_version"]}
+    records = [{"snapshot": 1, "taken_at": "2026-10-18T18:00:00", "columns": columns},
+               ["users", [7, "Jane", "Doe", "jane@example.com", 2]]]
+    records += [["books", [i, f"Book {i}", "Pub", "Fiction", i != 3, 7 if i == 3 else None,
+                           "2026-10-01" if i == 3 else None, "2026-10-15" if i == 3 else None, 4, 1 if i == 3 else 0]]
+                for i in range(1, 6)]
+    snapshot = gzip.compress(b"".join(orjson.dumps(r) + b"\n" for r in records + [{"end": True, "rows": {"users": 1, "books": 5}}]))
+
+    db = TestingSessionLocal()
+    try:
+        truncated = gzip.compress(b"".join(orjson.dumps(r) + b"\n" for r in records))
+        with pytest.raises(bootstrap.SnapshotError, match="truncated"):
+            bootstrap.load(db, bootstrap.read_snapshot(io.BytesIO(truncated)), batch_size=2)
+        db.query(models.Book).delete()
+        db.query(models.User).delete()
+        db.commit()
+
+        assert bootstrap.load(db, bootstrap.read_snapshot(io.BytesIO(snapshot)), batch_size=2) == {"users": 1, "books": 5}
+        book = db.get(models.Book, 3)
+        assert (book.available, book.user.email, str(book.return_date), book.version) == (False, "jane@example.com", "2026-10-15", 4)
+        with pytest.raises(bootstrap.SnapshotError, match="not empty"):
+            bootstrap.load(db, bootstrap.read_snapshot(io.BytesIO(snapshot)))
+    finally:
+        db.close()